@@ -0,0 +1,228 @@
+import numpy as np
+
+import profiling
+
+# Dormand-Prince 5(4) Butcher tableau
+_C = np.array([0, 1/5, 3/10, 4/5, 8/9, 1, 1])
+_A = [
+    [],
+    [1/5],
+    [3/40, 9/40],
+    [44/45, -56/15, 32/9],
+    [19372/6561, -25360/2187, 64448/6561, -212/729],
+    [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+    [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84],
+]
+# 5th order weights are the last row of A (first same as last); E holds the 5th minus 4th order weights
+_B = np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84, 0])
+_E = np.array([-71/57600, 0, 71/16695, -71/1920, 17253/339200, -22/525, 1/40])
+
+# Coefficients of the 4th order continuous extension: y(t + theta*h) = y + h * sum_i K_i * (P[i] @ [theta, theta^2, theta^3, theta^4])
+_P = np.array([
+    [1, -8048581381/2820520608, 8663915743/2820520608, -12715105075/11282082432],
+    [0, 0, 0, 0],
+    [0, 131558114200/32700410799, -68118460800/10900136933, 87487479700/32700410799],
+    [0, -1754552775/470086768, 14199869525/1410260304, -10690763975/1880347072],
+    [0, 127303824393/49829197408, -318862633887/49829197408, 701980252875/199316789632],
+    [0, -282668133/205662961, 2019193451/616988883, -1453857185/822651844],
+    [0, 40617522/29380423, -110615467/29380423, 69997945/29380423],
+])
+
+def _stages(f, t, y, dt, k1=None):
+    """
+    Evaluate the seven Dormand-Prince stages of a step, reusing k1 when it is known from the previous step.
+
+    Returns:
+        tuple: (y_new, error, K) with the 5th order solution, the embedded error estimate and the stacked stages.
+    """
+    K = np.empty((7,) + y.shape)
+    K[0] = f(t, y) if k1 is None else k1
+    for i in range(1, 7):
+        increment = sum(a * K[j] for j, a in enumerate(_A[i]) if a != 0)
+        K[i] = f(t + _C[i]*dt, y + dt * increment)
+    y_new = y + dt * np.tensordot(_B, K, axes=1)
+    error = dt * np.tensordot(_E, K, axes=1)
+    return y_new, error, K
+
+def _dense(y, h, K, theta):
+    """
+    Evaluate the continuous extension of a step [t, t + h] at the fractions theta (array of shape (m,)).
+    """
+    powers = theta[np.newaxis, :] ** np.arange(1, 5)[:, np.newaxis]
+    return y + h * np.tensordot((_P @ powers).T, K, axes=1)
+
+def _dense_lanes(y, h, K, theta, derivative=False):
+    """
+    Evaluate the continuous extension (or its derivative with respect to theta) of a step for every orbit of a batch
+    at its own fraction: y has shape (M, 4), K shape (7, M, 4) and theta shape (M,).
+    """
+    exponents = np.arange(1, 5)[:, np.newaxis]
+    if derivative:
+        weights = _P @ (exponents * theta[np.newaxis, :] ** (exponents - 1))
+        return h * np.einsum('im,imk->mk', weights, K)
+    weights = _P @ (theta[np.newaxis, :] ** exponents)
+    return y + h * np.einsum('im,imk->mk', weights, K)
+
+def dormand_prince(f, t, y, dt):
+    """
+    Dormand-Prince 5th order integration method for solving first-order ODEs, as a single fixed step.
+
+    The adaptive integration with error control is done by dormand_prince_solve, which henon_heiles uses when this
+    method is selected.
+
+    Parameters:
+        f  (function): The function that defines the ODE dy/dt = f(t, y).
+        t  (float): Current time.
+        y  (array-like): Current state vector, or an (N, 4) batch of state vectors.
+        dt (float): Step size.
+
+    Returns:
+        array-like: New state vector after one time step.
+    """
+    return _stages(f, t, np.asarray(y, dtype=float), dt)[0]
+
+def dormand_prince_steps(f, y0, t0, t_end, dt, rtol=1e-8, atol=1e-10, max_steps=10**7, stats=None):
+    """
+    Adaptive Dormand-Prince 5(4) integration, yielding every accepted step together with its dense output data.
+
+    The step size is controlled with the embedded 4th order error estimate: a step is accepted when the RMS of
+    error / (atol + rtol*|y|) is at most 1 (the largest value over the orbits of an ensemble is used), and the next step
+    size is scaled by 0.9*err^(-1/5), within a factor of 0.2 to 5.
+
+    Parameters:
+        f  (function): The function that defines the ODE dy/dt = f(t, y).
+        y0 (array): Initial conditions for the state vector (x, y, px and py), or an (N, 4) array of initial conditions.
+        t0 (float): Initial time.
+        t_end (float): Final time.
+        dt (float): Initial step size.
+        rtol, atol (float): Relative and absolute tolerances.
+        max_steps (int): Maximum number of attempted steps.
+        stats (dict): Optional dictionary updated in place with the 'accepted', 'rejected' and 'rhs_evaluations' counts.
+
+    Yields:
+        tuple: (t, y, h, K, y_new) for every accepted step [t, t + h], where K holds the stages used by the dense output.
+    """
+    if stats is None:
+        stats = {}
+    f = profiling.counted(f)
+    stats.setdefault('accepted', 0)
+    stats.setdefault('rejected', 0)
+    stats.setdefault('rhs_evaluations', 0)
+
+    t = t0
+    y = np.array(y0, dtype=float)
+    k1 = None
+    h = dt
+    for _ in range(max_steps):
+        if t >= t_end:
+            return
+        h = min(h, t_end - t)
+
+        y_new, error, K = _stages(f, t, y, h, k1)
+        stats['rhs_evaluations'] += 7 if k1 is None else 6
+        scale = atol + rtol * np.maximum(np.abs(y), np.abs(y_new))
+        err = np.sqrt(np.mean((error / scale)**2, axis=-1)).max()
+
+        if err <= 1:
+            stats['accepted'] += 1
+            profiling.count('steps')
+            yield t, y, h, K, y_new
+            t = t + h
+            y = y_new
+            # First same as last: the last stage is the derivative at the new state
+            k1 = K[6]
+        else:
+            stats['rejected'] += 1
+            profiling.count('rejected_steps')
+        h = h * min(5, max(0.2, 0.9 * err**(-1/5) if err > 0 else 5))
+
+    raise RuntimeError(f"Dormand-Prince integration did not reach t = {t_end} within {max_steps} steps")
+
+def dormand_prince_solve(f, y0, t_values, dt, rtol=1e-8, atol=1e-10, max_steps=10**7):
+    """
+    Integrate with the adaptive Dormand-Prince 5(4) method and sample the solution at the requested times.
+
+    The internal steps are chosen by the error control and are not stored: the solution is evaluated at t_values with
+    the dense output of the step containing each requested time.
+
+    Parameters:
+        f  (function): The function that defines the ODE dy/dt = f(t, y).
+        y0 (array): Initial conditions for the state vector (x, y, px and py), or an (N, 4) array of initial conditions.
+        t_values (array): Increasing times at which the solution is returned.
+        dt (float): Initial step size.
+        rtol, atol (float): Relative and absolute tolerances.
+        max_steps (int): Maximum number of attempted steps.
+
+    Returns:
+        tuple: (y_values, stats) with the states at t_values, of shape (len(t), 4) or (len(t), N, 4), and the step
+               statistics ('accepted', 'rejected', 'rhs_evaluations').
+    """
+    t_values = np.asarray(t_values, dtype=float)
+    y_values = np.zeros((len(t_values),) + np.shape(y0))
+    y_values[0] = y0
+    profiling.record_allocation('trajectory', y_values.nbytes)
+    stats = {}
+
+    i = 1
+    for t, y, h, K, _ in dormand_prince_steps(f, y0, t_values[0], t_values[-1], dt, rtol, atol, max_steps, stats):
+        j = np.searchsorted(t_values, t + h, side='right')
+        if j > i:
+            y_values[i:j] = _dense(y, h, K, (t_values[i:j] - t) / h)
+            i = j
+    # Guard against round-off leaving the last requested times just past the final step
+    y_values[i:] = y_values[i-1]
+
+    return y_values, stats
+
+def dormand_prince_section(f, y0, t0, t_end, dt, direction=1, rtol=1e-8, atol=1e-10, max_steps=10**7):
+    """
+    Integrate with the adaptive Dormand-Prince 5(4) method and return only the crossings of the x = 0 plane.
+
+    Within every accepted step where x changes sign, the crossing is located by Newton iterations on the dense output,
+    so no internal step needs to be kept.
+
+    Parameters:
+        f  (function): The function that defines the ODE dy/dt = f(t, y).
+        y0 (array): Initial conditions for the state vector (x, y, px and py), or an (N, 4) array of initial conditions.
+        t0 (float): Initial time.
+        t_end (float): Final time.
+        dt (float): Initial step size.
+        direction (int): +1 for crossings with increasing x (px > 0), -1 for decreasing x, 0 for both.
+        rtol, atol (float): Relative and absolute tolerances.
+        max_steps (int): Maximum number of attempted steps.
+
+    Returns:
+        tuple: (t_cross, points, orbit) with the crossing times, the states on the plane of shape (M, 4) and the index
+               of the orbit each crossing belongs to (always 0 for a single orbit).
+    """
+    times, points, orbits = [], [], []
+    for t, y, h, K, y_new in dormand_prince_steps(f, y0, t0, t_end, dt, rtol, atol, max_steps):
+        before = y.reshape(-1, 4)[:, 0]
+        after = y_new.reshape(-1, 4)[:, 0]
+        crossing = np.zeros(before.shape, dtype=bool)
+        if direction >= 0:
+            crossing |= (before < 0) & (after >= 0)
+        if direction <= 0:
+            crossing |= (before > 0) & (after <= 0)
+
+        orbit = np.nonzero(crossing)[0]
+        if len(orbit) == 0:
+            continue
+        y_cross = y.reshape(-1, 4)[orbit]
+        K_cross = K.reshape(7, -1, 4)[:, orbit]
+
+        # Newton iterations on the x component of the dense output, starting from the linear estimate
+        theta = before[orbit] / (before[orbit] - after[orbit])
+        for _ in range(6):
+            x = _dense_lanes(y_cross, h, K_cross, theta)[:, 0]
+            theta = np.clip(theta - x / _dense_lanes(y_cross, h, K_cross, theta, derivative=True)[:, 0], 0, 1)
+        point = _dense_lanes(y_cross, h, K_cross, theta)
+        point[:, 0] = 0
+
+        times.append(t + theta * h)
+        points.append(point)
+        orbits.append(orbit)
+
+    if not times:
+        return np.empty(0), np.empty((0, 4)), np.empty(0, dtype=int)
+    return np.concatenate(times), np.concatenate(points), np.concatenate(orbits)
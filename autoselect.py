@@ -0,0 +1,176 @@
+import time
+
+import numpy as np
+
+import cache
+from benchmarks import BENCHMARK_METHODS, best_time, machine_info
+from integration_methods import henon_heiles
+from var import equations_motion, hamiltonian
+
+# Fixed-step methods that can be selected, by name (the names of the command-line options)
+AUTO_METHODS = {name: method for name, method in BENCHMARK_METHODS.items() if name != 'dopri'}
+
+# Symplectic methods, whose energy error stays bounded: the energy of the other methods drifts at least linearly in time
+SYMPLECTIC_METHODS = ('verlet', 'yoshida4', 'yoshida6', 'yoshida8')
+
+# Step sizes of the probe runs
+PROBE_STEPS = (0.2, 0.1, 0.05, 0.02, 0.01, 0.005)
+
+# Largest error kept in the work-precision curves (diverged probe runs), so that their logarithms stay finite
+_ERROR_CEILING = 1e300
+
+def _energy_error(y):
+    """
+    Largest relative energy error over the orbits at every sample of a trajectory, inf once the run has diverged.
+    """
+    energy = hamiltonian(np.asarray(y).reshape(len(y), -1, 4))
+    with np.errstate(invalid='ignore', over='ignore', divide='ignore'):
+        error = np.abs(energy / energy[0] - 1)
+    return np.where(np.isfinite(error), error, np.inf).max(axis=1)
+
+def calibrate(method, y0, dts=PROBE_STEPS, probe_time=20.0, repeat=1, f=equations_motion):
+    """
+    Work-precision curve of an integration method: the energy error and the cost of short probe runs of the given
+    orbits at several step sizes.
+
+    Parameters:
+        method (str): Name of the method (a key of AUTO_METHODS).
+        y0 (array): Initial conditions of the probe runs, of shape (4,) or (N, 4).
+        dts (tuple): Step sizes of the probe runs.
+        probe_time (float): Simulation time of every probe run.
+        repeat (int): Number of timed repetitions of every probe run, the best one is kept.
+        f (function): The function that defines the ODE dy/dt = f(t, y).
+
+    Returns:
+        dict: For every step size 'dt', the largest relative energy error over the first half ('error_half') and over
+              the whole ('error') probe run, and the wall-clock 'seconds_per_step'.
+    """
+    integration_method = AUTO_METHODS[method]
+    y0 = np.asarray(y0, dtype=float)
+    error, error_half, seconds_per_step = [], [], []
+    for dt in dts:
+        num_steps = max(int(round(probe_time / dt)), 2)
+        t_values = np.arange(num_steps + 1) * dt
+        run = lambda: henon_heiles(integration_method, f, y0, t_values, dt)
+        # The unstable runs (e.g. Euler at large steps) overflow: their error is inf
+        with np.errstate(all='ignore'):
+            start = time.perf_counter()
+            y = run()
+            seconds = time.perf_counter() - start
+            if repeat > 1:
+                seconds = min(seconds, best_time(run, repeat - 1))
+            energy_error = _energy_error(y)
+        error.append(energy_error.max())
+        error_half.append(energy_error[:num_steps // 2 + 1].max())
+        seconds_per_step.append(seconds / num_steps)
+
+    return {
+        'dt': np.array(dts, dtype=float),
+        'error': np.minimum(error, _ERROR_CEILING),
+        'error_half': np.minimum(error_half, _ERROR_CEILING),
+        'seconds_per_step': np.array(seconds_per_step),
+    }
+
+def _calibrate_on(machine, *args, **kwargs):
+    """
+    calibrate on the host described by machine, which only enters the cache key of the measured costs.
+    """
+    return calibrate(*args, **kwargs)
+
+def calibration(method, y0, dts=PROBE_STEPS, probe_time=20.0, repeat=1):
+    """
+    Cached version of calibrate, keyed on the method, the probe orbits (and so on their energy) and the host (see
+    benchmarks.machine_info, as the costs of a host do not carry over to another), so that a method is only calibrated
+    once per orbit and energy on every host (see cache.cached).
+
+    Returns:
+        dict: Read-only arrays returned by calibrate.
+    """
+    machine = machine_info()
+    host = tuple(str(machine[name]) for name in ('platform', 'processor', 'cpu_count', 'numba'))
+    return cache.cached(_calibrate_on, host, method, np.asarray(y0, dtype=float), dts=tuple(float(dt) for dt in dts),
+                        probe_time=float(probe_time), repeat=repeat)
+
+def predict_error(calibration, dt, duration, probe_time, min_growth=0.0):
+    """
+    Predicted largest relative energy error of a run of the given duration, from the work-precision curve of a method.
+
+    The error of every probe run is carried over to the duration of the run with the exponent g of error(t) ~ t^g
+    measured between the two halves of the probe run: close to 0 for the bounded errors of the symplectic methods, to 1
+    for a linear drift, and larger for the instabilities of some methods at large steps. A short probe run can hide a
+    slow drift under the oscillations of the energy, hence the lower bound min_growth. The errors are then
+    interpolated between the probe step sizes on a log-log scale, and extrapolated below the smallest one with the
+    order measured on the two smallest steps (at least 1); the curve is made increasing with the step size, so that a
+    lucky step between two probes is not trusted. Steps above the largest probe step are not predicted. The error
+    never goes below the round-off accumulated over the steps of the run.
+
+    Parameters:
+        calibration (dict): Work-precision curve of the method (see calibrate).
+        dt (float or array): Step sizes of the run.
+        duration (float): Simulation time of the run.
+        probe_time (float): Simulation time of the probe runs of the calibration.
+        min_growth (float): Lower bound of the growth exponent (1 for the methods whose energy drifts).
+
+    Returns:
+        float or array: Predicted error, inf above the probe step sizes.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = np.log2(calibration['error'] / calibration['error_half'])
+    growth = np.clip(np.where(np.isfinite(growth), growth, 1.0), min_growth, 2)
+    error = np.minimum(calibration['error'] * max(duration / probe_time, 1.0)**growth, _ERROR_CEILING)
+
+    order = np.argsort(calibration['dt'])
+    log_dt = np.log(calibration['dt'][order])
+    log_error = np.log(np.maximum.accumulate(np.maximum(error[order], 1e-300)))
+
+    log_step = np.log(dt)
+    slope = max((log_error[1] - log_error[0]) / (log_dt[1] - log_dt[0]), 1.0) if len(log_dt) > 1 else 1.0
+    predicted = np.where(log_step < log_dt[0], log_error[0] + slope * (log_step - log_dt[0]), np.interp(log_step, log_dt, log_error))
+    predicted = np.where(log_step > log_dt[-1] + 1e-9, np.inf, np.exp(predicted))
+    return np.maximum(predicted, np.finfo(float).eps * np.sqrt(duration / np.asarray(dt)))
+
+def select_method(y0, tolerance, duration, methods=None, dts=PROBE_STEPS, probe_time=20.0, repeat=1):
+    """
+    Cheapest integration method and step size whose predicted energy error over a run stays below a tolerance.
+
+    Every method is calibrated on probe runs of the orbits (see calibration, which caches the curves), the largest
+    step meeting the tolerance is found on its work-precision curve (see predict_error; the energy of the methods
+    other than SYMPLECTIC_METHODS is assumed to drift), and the predicted cost of the
+    run is its number of steps times the measured cost of a step. When no method meets the tolerance, the one with
+    the smallest predicted error is chosen.
+
+    Parameters:
+        y0 (array): Initial conditions of the run, of shape (4,) or (N, 4).
+        tolerance (float): Largest relative energy error of the run.
+        duration (float): Simulation time of the run.
+        methods (list): Names of the candidate methods (keys of AUTO_METHODS), all of them by default.
+        dts, probe_time, repeat: Probe runs of the calibration (see calibrate); the probe time is at most the duration.
+
+    Returns:
+        dict: The chosen 'method', 'dt', 'num_steps', 'predicted_error' and 'predicted_seconds', whether the tolerance
+              is 'met', and the best choice of every method as 'candidates'.
+    """
+    probe_time = min(probe_time, duration)
+    candidates = []
+    for name in methods or AUTO_METHODS:
+        curve = calibration(name, y0, dts, probe_time, repeat)
+        # Smallest step tried: a hundredth of the smallest probe step
+        steps = np.geomspace(min(dts) / 100, max(dts), 401)
+        error = predict_error(curve, steps, duration, probe_time, min_growth=0.0 if name in SYMPLECTIC_METHODS else 1.0)
+        meets = np.flatnonzero(error <= tolerance)
+        best = meets[-1] if len(meets) else np.argmin(error)
+        num_steps = int(np.ceil(duration / steps[best]))
+        candidates.append({
+            'method': name,
+            'dt': duration / num_steps,
+            'num_steps': num_steps,
+            'predicted_error': float(error[best]),
+            'predicted_seconds': float(np.median(curve['seconds_per_step']) * num_steps),
+        })
+
+    feasible = [candidate for candidate in candidates if candidate['predicted_error'] <= tolerance]
+    if feasible:
+        choice = min(feasible, key=lambda candidate: candidate['predicted_seconds'])
+    else:
+        choice = min(candidates, key=lambda candidate: candidate['predicted_error'])
+    return dict(choice, met=bool(feasible), candidates=candidates)
@@ -0,0 +1,278 @@
+"""
+Performance benchmarks of the integration methods, ensembles, memory use and Poincaré sections.
+
+Usage:
+  benchmarks.py [--quick] [--save FILE] [--check FILE] [--threshold FRACTION] [--repeat R]
+
+Options:
+  --quick               Use short runs (a smoke test of the suite rather than stable measurements).
+  --save FILE           Save the results as a JSON baseline.
+  --check FILE          Compare the results to a JSON baseline and exit with status 1 on a regression.
+  --threshold FRACTION  Relative slowdown (or memory growth) counted as a regression [default: 0.2].
+  --repeat R            Number of timed repetitions of every benchmark, the best one is kept [default: 3].
+
+Examples:
+  python benchmarks.py --save baseline.json
+  python benchmarks.py --check baseline.json --threshold 0.25
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import profiling
+from integration_methods import METHODS, henon_heiles
+from multistep import adams_bashforth_moulton, stormer_cowell
+from sections import find_crossings
+from var import equations_motion
+
+# Integration methods by name: the methods of the command line and the multistep methods
+BENCHMARK_METHODS = dict(METHODS, abm=adams_bashforth_moulton, stormer=stormer_cowell)
+
+# Initial condition of the distorted torus (E = 0.06), as in henon_heiles.py
+Y0 = np.array([0, -0.1475, 0.3101, 0])
+
+def best_time(function, repeat):
+    """
+    Best wall-clock time of repeat calls of function(), which is the least noisy estimate of its cost.
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def machine_info():
+    """
+    Description of the host the timings are measured on: the timings of one host do not carry over to another.
+
+    Returns:
+        dict: The 'python' and 'numpy' versions, the 'platform', the 'processor' architecture, the 'cpu_count' and
+              whether numba is installed ('numba', which changes the fused kernels).
+    """
+    import kernels
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'processor': platform.machine(), 'cpu_count': os.cpu_count(), 'numba': kernels.numba is not None}
+
+def benchmark_methods(num_steps=20000, dt=0.01, repeat=3, methods=None):
+    """
+    Throughput of every integration method on a single orbit.
+
+    Parameters:
+        num_steps (int): Number of time samples of every run.
+        dt (float): Step size (initial step size for dopri).
+        repeat (int): Number of timed repetitions, the best one is kept.
+        methods (list): Names of the methods (keys of BENCHMARK_METHODS), all of them by default.
+
+    Returns:
+        dict: For every method, 'steps_per_second' and 'rhs_per_second' (evaluations of the right-hand side); for the
+              adaptive dopri the steps are the accepted internal steps.
+    """
+    t_values = np.arange(num_steps) * dt
+    results = {}
+    for name in methods or BENCHMARK_METHODS:
+        integration_method = BENCHMARK_METHODS[name]
+        # The steps and RHS calls are counted on an extra run, so that the counting does not weigh on the timings
+        with profiling.profile() as profiler:
+            henon_heiles(integration_method, equations_motion, Y0, t_values, dt)
+        counters = profiler.summary()['counters']
+        seconds = best_time(lambda: henon_heiles(integration_method, equations_motion, Y0, t_values, dt), repeat)
+        results[name] = {'steps_per_second': counters['steps'] / seconds, 'rhs_per_second': counters['rhs_calls'] / seconds}
+    return results
+
+def benchmark_ensembles(sizes=(1, 10, 100, 1000), num_steps=2000, dt=0.01, method='rk4', repeat=3):
+    """
+    Scaling of the vectorized ensemble integration with the number of orbits.
+
+    Parameters:
+        sizes (tuple): Numbers of orbits.
+        num_steps (int): Number of time samples of every run.
+        dt (float): Step size.
+        method (str): Name of the integration method.
+        repeat (int): Number of timed repetitions, the best one is kept.
+
+    Returns:
+        dict: For every ensemble size, 'orbit_steps_per_second' (orbits times steps per second).
+    """
+    t_values = np.arange(num_steps) * dt
+    rng = np.random.default_rng(0)
+    results = {}
+    for size in sizes:
+        y0 = Y0 + 0.01 * rng.normal(size=(size, 4))
+        seconds = best_time(lambda: henon_heiles(METHODS[method], equations_motion, y0, t_values, dt), repeat)
+        results[str(size)] = {'orbit_steps_per_second': size * (num_steps - 1) / seconds}
+    return results
+
+def benchmark_memory(num_steps=20000, dt=0.01, sizes=(1, 100), method='rk4'):
+    """
+    Peak memory allocated by henon_heiles, measured with tracemalloc.
+
+    Returns:
+        dict: For every ensemble size, 'peak_bytes' and 'peak_bytes_per_sample' (relative to the stored trajectory).
+    """
+    t_values = np.arange(num_steps) * dt
+    results = {}
+    for size in sizes:
+        y0 = Y0 if size == 1 else np.tile(Y0, (size, 1))
+        tracemalloc.start()
+        try:
+            henon_heiles(METHODS[method], equations_motion, y0, t_values, dt)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        results[str(size)] = {'peak_bytes': peak, 'peak_bytes_per_sample': peak / (num_steps * size * 4 * 8)}
+    return results
+
+def benchmark_kernels(num_steps=5000, dt=0.01, sizes=(1, 100), methods=('rk4', 'leapfrog'), repeat=3):
+    """
+    Throughput of the fused stepping kernels (kernels.henon_heiles_fused with the 'auto' backend, as --kernel fused)
+    against the generic integration path.
+
+    Parameters:
+        num_steps (int): Number of time samples of every run.
+        dt (float): Step size.
+        sizes (tuple): Numbers of orbits (1 integrates a lone (4,) state).
+        methods (tuple): Names of the methods, among those with a fused kernel.
+        repeat (int): Number of timed repetitions, the best one is kept.
+
+    Returns:
+        dict: For every method and ensemble size, 'generic_orbit_steps_per_second' and 'fused_orbit_steps_per_second'.
+    """
+    from kernels import henon_heiles_fused
+
+    t_values = np.arange(num_steps) * dt
+    results = {}
+    for name in methods:
+        integration_method = METHODS[name]
+        for size in sizes:
+            y0 = Y0 if size == 1 else np.tile(Y0, (size, 1))
+            # The first call compiles the numba loops
+            henon_heiles_fused(integration_method, y0, t_values[:3], dt)
+            generic = best_time(lambda: henon_heiles(integration_method, equations_motion, y0, t_values, dt), repeat)
+            fused = best_time(lambda: henon_heiles_fused(integration_method, y0, t_values, dt), repeat)
+            results[f"{name}/{size}"] = {
+                'generic_orbit_steps_per_second': size * (num_steps - 1) / generic,
+                'fused_orbit_steps_per_second': size * (num_steps - 1) / fused,
+            }
+    return results
+
+def benchmark_sections(num_steps=200001, dt=0.001, repeat=3):
+    """
+    Cost of the Poincaré section extraction and of the plots of poincare_maps on a stored trajectory.
+
+    Returns:
+        dict: 'find_crossings' and 'plot_henon_heiles' with 'samples_per_second' (trajectory samples processed per second).
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import poincare_maps as pm
+
+    t_values = np.arange(num_steps) * dt
+    y = henon_heiles(METHODS['rk4'], equations_motion, Y0, t_values, dt)
+
+    def plot():
+        fig, axs = plt.subplots(1, 3, figsize=(15, 6))
+        pm.plot_henon_heiles(t_values, x=y[:, 0], y=y[:, 1], px=y[:, 2], py=y[:, 3], color='tab:orange', title='', axs=axs)
+        fig.canvas.draw()
+        plt.close(fig)
+
+    return {
+        'find_crossings': {'samples_per_second': num_steps / best_time(lambda: find_crossings(t_values, y), repeat)},
+        'plot_henon_heiles': {'samples_per_second': num_steps / best_time(plot, repeat)},
+    }
+
+def run_benchmarks(quick=False, repeat=3):
+    """
+    Run the whole suite.
+
+    Parameters:
+        quick (bool): Use short runs.
+        repeat (int): Number of timed repetitions of every benchmark.
+
+    Returns:
+        dict: Results by group ('methods', 'ensembles', 'memory', 'kernels', 'sections') and by case, plus a 'machine' description.
+    """
+    scale = 10 if quick else 1
+    return {
+        'machine': machine_info(),
+        'methods': benchmark_methods(num_steps=20000 // scale, repeat=repeat),
+        'ensembles': benchmark_ensembles(num_steps=2000 // scale, repeat=repeat),
+        'memory': benchmark_memory(num_steps=20000 // scale),
+        'kernels': benchmark_kernels(num_steps=5000 // scale, repeat=repeat),
+        'sections': benchmark_sections(num_steps=200000 // scale + 1, repeat=repeat),
+    }
+
+def compare_to_baseline(results, baseline, threshold=0.2):
+    """
+    Find the regressions of a run with respect to a baseline.
+
+    Throughputs (the '*_per_second' metrics) regress when they drop by more than threshold, memory metrics (the 'peak_*'
+    metrics) when they grow by more than threshold. Cases missing from either run are ignored.
+
+    Parameters:
+        results (dict): Results of run_benchmarks.
+        baseline (dict): Baseline results (run_benchmarks output saved earlier).
+        threshold (float): Tolerated relative change.
+
+    Returns:
+        list: Descriptions of the regressions (empty when there is none).
+    """
+    regressions = []
+    for group, cases in baseline.items():
+        if group == 'machine' or group not in results:
+            continue
+        for case, metrics in cases.items():
+            for metric, reference in metrics.items():
+                value = results[group].get(case, {}).get(metric)
+                if value is None or reference <= 0:
+                    continue
+                change = value / reference - 1
+                if metric.endswith('_per_second') and change < -threshold:
+                    regressions.append(f"{group}/{case}/{metric}: {value:.4g} vs {reference:.4g} ({change:+.1%})")
+                elif metric.startswith('peak_') and change > threshold:
+                    regressions.append(f"{group}/{case}/{metric}: {value:.4g} vs {reference:.4g} ({change:+.1%})")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmarks.py", description="Performance benchmarks of the Henon-Heiles integration")
+    parser.add_argument("--quick", action="store_true", help="Use short runs")
+    parser.add_argument("--save", metavar="FILE", help="Save the results as a JSON baseline")
+    parser.add_argument("--check", metavar="FILE", help="Compare the results to a JSON baseline and fail on a regression")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative slowdown (or memory growth) counted as a regression")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed repetitions of every benchmark")
+
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(quick=args.quick, repeat=args.repeat)
+    for group, cases in results.items():
+        if group == 'machine':
+            continue
+        for case, metrics in cases.items():
+            print(f"{group:10s} {case:18s} " + "  ".join(f"{metric} = {value:.4g}" for metric, value in metrics.items()))
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"Baseline saved to {args.save}")
+
+    if args.check:
+        with open(args.check) as file:
+            baseline = json.load(file)
+        regressions = compare_to_baseline(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            return 1
+        print(f"No regression beyond {args.threshold:.0%} with respect to {args.check}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
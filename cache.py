@@ -0,0 +1,250 @@
+import functools
+import hashlib
+import importlib.util
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from integration_methods import henon_heiles
+
+# Size limits of the in-process LRU layer and of the on-disk layer, in bytes
+MEMORY_LIMIT = 256 * 2**20
+DISK_LIMIT = 2 * 2**30
+
+# Version of the cache keys: bump it to invalidate every cached result
+CACHE_VERSION = 1
+
+# Modules of the numerical core, whose source enters every key: the cached functions call into them (callees such as
+# the symplectic compositions, module constants such as the Yoshida weights, the equations of motion)
+CORE_MODULES = ('integration_methods', 'var', 'adaptive', 'multistep', 'kernels', 'potential', 'chaos', 'sections',
+                'initial_conditions')
+
+_memory = OrderedDict()
+_stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+def cache_directory():
+    """
+    Directory of the on-disk cache: $HENON_HEILES_CACHE, or ~/.cache/henon_heiles by default.
+    """
+    return os.environ.get('HENON_HEILES_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'henon_heiles'))
+
+@functools.lru_cache(maxsize=None)
+def _module_digest(name):
+    """
+    Hash of the source file of a module (found without importing it), or '' for the modules without a source file.
+    """
+    try:
+        spec = importlib.util.find_spec(name)
+    except (ImportError, ValueError):
+        return ''
+    if spec is None or not spec.origin or not os.path.isfile(spec.origin):
+        return ''
+    with open(spec.origin, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+def _source_salt():
+    """
+    Salt of every key: the cache version and the source of the numerical core.
+    """
+    return f"version:{CACHE_VERSION}:" + ":".join(_module_digest(name) for name in CORE_MODULES)
+
+def _function_id(function):
+    """
+    Identify a function by its qualified name, the hash of its bytecode and the hash of the source of its module, so
+    that editing it, or the helpers and constants of its module, invalidates the cache.
+    """
+    function = getattr(function, '__func__', function)
+    code = getattr(function, '__code__', None)
+    digest = hashlib.sha256(code.co_code + repr(code.co_consts).encode()).hexdigest() if code is not None else ''
+    module = getattr(function, '__module__', '') or ''
+    return f"{module}.{getattr(function, '__qualname__', repr(function))}:{digest}:{_module_digest(module) if module else ''}"
+
+def _update_hash(digest, value):
+    """
+    Feed a canonical encoding of an argument (array, number, string, function or container of those) into the hash.
+    """
+    if isinstance(value, np.ndarray) or isinstance(value, np.generic):
+        value = np.asarray(value)
+        digest.update(f"array:{value.dtype.str}:{value.shape}:".encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"{type(value).__name__}:{len(value)}:".encode())
+        for item in value:
+            _update_hash(digest, item)
+    elif isinstance(value, dict):
+        digest.update(f"dict:{len(value)}:".encode())
+        for key in sorted(value):
+            _update_hash(digest, key)
+            _update_hash(digest, value[key])
+    elif callable(value):
+        digest.update(f"function:{_function_id(value)}:".encode())
+    elif value is None or isinstance(value, (bool, int, float, str)):
+        digest.update(f"{type(value).__name__}:{value!r}:".encode())
+    else:
+        raise TypeError(f"Cannot hash argument of type {type(value).__name__} for the cache")
+
+def cache_key(*args, **kwargs):
+    """
+    Content hash of a call: arrays are hashed by value, functions by name, bytecode and module source, and every key
+    is salted with CACHE_VERSION and the source of CORE_MODULES.
+
+    Returns:
+        str: Hexadecimal SHA-256 digest.
+    """
+    digest = hashlib.sha256(_source_salt().encode())
+    _update_hash(digest, list(args))
+    _update_hash(digest, kwargs)
+    return digest.hexdigest()
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_nbytes(item) for item in value.values())
+    return sum(_nbytes(item) for item in value)
+
+def _read_only(value):
+    """
+    Mark cached arrays read-only, so that a caller cannot corrupt the cached copy.
+    """
+    for array in ([value] if isinstance(value, np.ndarray) else value.values() if isinstance(value, dict) else value):
+        array.flags.writeable = False
+    return value
+
+def _save(path, value):
+    """
+    Atomically write an array, a tuple of arrays or a dictionary of arrays to a .npz file.
+    """
+    if isinstance(value, np.ndarray):
+        arrays = {'__kind__': np.array('array'), 'array': value}
+    elif isinstance(value, dict):
+        arrays = dict(value, __kind__=np.array('dict'))
+    else:
+        arrays = {f'item_{i}': item for i, item in enumerate(value)}
+        arrays['__kind__'] = np.array('tuple')
+    temporary = path + '.tmp.npz'
+    np.savez(temporary, **arrays)
+    os.replace(temporary, path)
+
+def _load(path):
+    with np.load(path) as data:
+        kind = str(data['__kind__'])
+        if kind == 'array':
+            return data['array']
+        if kind == 'dict':
+            return {key: data[key] for key in data.files if key != '__kind__'}
+        return tuple(data[f'item_{i}'] for i in range(len(data.files) - 1))
+
+def _evict_disk(directory):
+    """
+    Remove the least recently used files of the on-disk cache until it fits in DISK_LIMIT.
+    """
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith('.npz') and '.tmp' not in name:
+            status = os.stat(os.path.join(directory, name))
+            entries.append((status.st_mtime, status.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= DISK_LIMIT:
+            break
+        os.remove(os.path.join(directory, name))
+        total -= size
+
+def get(key):
+    """
+    Look a key up in the in-process layer, then in the on-disk layer.
+
+    Returns:
+        The cached value, or None on a miss (which is counted).
+    """
+    if key in _memory:
+        _memory.move_to_end(key)
+        _stats['memory_hits'] += 1
+        return _memory[key]
+
+    path = os.path.join(cache_directory(), key + '.npz')
+    if os.path.exists(path):
+        value = _read_only(_load(path))
+        # Refresh the modification time: the disk layer evicts the least recently used files
+        os.utime(path)
+        _stats['disk_hits'] += 1
+        _remember(key, value)
+        return value
+
+    _stats['misses'] += 1
+    return None
+
+def _remember(key, value):
+    """
+    Insert a value in the in-process LRU layer, evicting the least recently used values beyond MEMORY_LIMIT.
+    """
+    _memory[key] = value
+    _memory.move_to_end(key)
+    while len(_memory) > 1 and sum(_nbytes(item) for item in _memory.values()) > MEMORY_LIMIT:
+        _memory.popitem(last=False)
+
+def put(key, value):
+    """
+    Store an array, a tuple of arrays or a dictionary of arrays in both layers of the cache.
+
+    Returns:
+        The stored value, marked read-only.
+    """
+    value = _read_only(value)
+    _remember(key, value)
+    directory = cache_directory()
+    os.makedirs(directory, exist_ok=True)
+    _save(os.path.join(directory, key + '.npz'), value)
+    _evict_disk(directory)
+    return value
+
+def cached(function, *args, **kwargs):
+    """
+    Call function(*args, **kwargs) through the cache, keyed on the function and the content of its arguments.
+
+    Parameters:
+        function (function): Function returning an array, a tuple of arrays or a dictionary of arrays.
+        args, kwargs: Arguments of the call (arrays, numbers, strings, functions or containers of those).
+
+    Returns:
+        The (read-only) result of the call.
+    """
+    key = cache_key(function, *args, **kwargs)
+    value = get(key)
+    if value is None:
+        value = put(key, function(*args, **kwargs))
+    return value
+
+def cached_henon_heiles(integration_method, f, y0, t_values, dt, **options):
+    """
+    Cached version of integration_methods.henon_heiles, keyed on the integration method, the right-hand side, the
+    initial conditions, the time grid and the step size.
+
+    Returns:
+        array: Read-only state vector after the whole simulation time.
+    """
+    return cached(henon_heiles, integration_method, f, np.asarray(y0, dtype=float), np.asarray(t_values), dt, **options)
+
+def cache_stats():
+    """
+    Hit and miss counters of the cache since the start of the process (or the last clear_cache).
+
+    Returns:
+        dict: 'memory_hits', 'disk_hits' and 'misses'.
+    """
+    return dict(_stats)
+
+def clear_cache(disk=False):
+    """
+    Empty the in-process layer and reset the counters, and optionally remove the on-disk layer.
+    """
+    _memory.clear()
+    for counter in _stats:
+        _stats[counter] = 0
+    directory = cache_directory()
+    if disk and os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.endswith('.npz'):
+                os.remove(os.path.join(directory, name))
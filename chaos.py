@@ -0,0 +1,126 @@
+import numpy as np
+
+from initial_conditions import section_grid
+from integration_methods import runge_kutta4
+from var import equations_motion, variational_equations
+
+def _extended_system(f, variational, n_vectors):
+    """
+    Right-hand side of the orbits together with their deviation vectors, on flat states of shape (N, 4 + 4*k).
+    """
+    def f_ext(t, z):
+        y = z[:, :4]
+        w = z[:, 4:].reshape(len(z), n_vectors, 4)
+        return np.concatenate([np.asarray(f(t, y)), variational(t, y, w).reshape(len(z), -1)], axis=1)
+    return f_ext
+
+def _alignment_indices(w):
+    """
+    SALI and GALI_k of normalized deviation vectors w of shape (N, k, 4).
+    """
+    sali = np.minimum(np.linalg.norm(w[:, 0] + w[:, 1], axis=-1), np.linalg.norm(w[:, 0] - w[:, 1], axis=-1))
+    gali = np.prod(np.linalg.svd(w, compute_uv=False), axis=-1)
+    return sali, gali
+
+def chaos_indicators(y0, dt, num_steps, integration_method=runge_kutta4, f=equations_motion, variational=variational_equations,
+                     n_vectors=2, renormalize_every=10, sali_threshold=1e-8, seed=0):
+    """
+    Compute chaos indicators for a batch of orbits by integrating the variational equations alongside the orbits.
+
+    Every orbit carries n_vectors deviation vectors, integrated with the tangent map and renormalized every
+    renormalize_every steps:
+    - the maximal Lyapunov exponent (mLCE) is the accumulated log-growth of the first vector divided by the time;
+    - the fast Lyapunov indicator (FLI) is the largest log-norm reached by the (unrenormalized) first vector;
+    - SALI is min(|u1 + u2|, |u1 - u2|) of the first two normalized vectors and GALI_k the volume spanned by all of them.
+    An orbit is classified as chaotic and retired from the batch as soon as its SALI drops below sali_threshold, so the
+    remaining steps only integrate the undecided orbits.
+
+    Parameters:
+        y0 (array): (N, 4) array of initial conditions (or a single state vector).
+        dt (float): Step size.
+        num_steps (int): Maximum number of steps.
+        integration_method (function): Single-step Runge-Kutta type method (euler, runge_kutta2, runge_kutta4, dormand_prince).
+        f (function): The function that defines the ODE dy/dt = f(t, y).
+        variational (function): Derivatives of the deviation vectors, variational(t, y, w) (see var.variational_equations).
+        n_vectors (int): Number of deviation vectors (at least 2).
+        renormalize_every (int): Number of steps between two renormalizations of the deviation vectors.
+        sali_threshold (float): SALI below which an orbit is classified as chaotic.
+        seed (int): Seed of the random initial deviation vectors (the same for every orbit).
+
+    Returns:
+        dict: Arrays of shape (N,) with 'mle', 'fli', 'sali', 'gali', 'chaotic' (bool) and 'time' (the time at which the
+              orbit was classified as chaotic, or the total time).
+    """
+    if n_vectors < 2:
+        raise ValueError("SALI and GALI need at least 2 deviation vectors")
+    y0 = np.atleast_2d(np.asarray(y0, dtype=float))
+    n_orbits = len(y0)
+
+    # Random orthonormal initial deviation vectors
+    q, _ = np.linalg.qr(np.random.default_rng(seed).normal(size=(4, n_vectors)))
+    w0 = np.broadcast_to(q.T, (n_orbits, n_vectors, 4))
+
+    f_ext = _extended_system(f, variational, n_vectors)
+    z = np.concatenate([y0, w0.reshape(n_orbits, -1)], axis=1)
+    orbit = np.arange(n_orbits)
+    log_growth = np.zeros(n_orbits)
+    fli = np.zeros(n_orbits)
+
+    results = {name: np.zeros(n_orbits) for name in ['mle', 'fli', 'sali', 'gali', 'time']}
+    results['chaotic'] = np.zeros(n_orbits, dtype=bool)
+
+    def record(lanes, sali, gali, t):
+        ids = orbit[lanes]
+        results['mle'][ids] = log_growth[lanes] / t
+        results['fli'][ids] = fli[lanes]
+        results['sali'][ids] = sali[lanes]
+        results['gali'][ids] = gali[lanes]
+        results['time'][ids] = t
+        results['chaotic'][ids] = sali[lanes] < sali_threshold
+
+    t = 0.0
+    for step in range(1, num_steps + 1):
+        z = integration_method(f_ext, t, z, dt)
+        t = step * dt
+        if step % renormalize_every != 0 and step != num_steps:
+            continue
+
+        w = z[:, 4:].reshape(len(z), n_vectors, 4)
+        norms = np.linalg.norm(w, axis=-1)
+        fli = np.maximum(fli, log_growth + np.log(norms[:, 0]))
+        log_growth = log_growth + np.log(norms[:, 0])
+        w = w / norms[..., np.newaxis]
+        z[:, 4:] = w.reshape(len(z), -1)
+        sali, gali = _alignment_indices(w)
+
+        if step == num_steps:
+            record(np.ones(len(z), dtype=bool), sali, gali, t)
+            break
+
+        # Retire the orbits whose classification is settled and compact the batch
+        settled = sali < sali_threshold
+        if settled.any():
+            record(settled, sali, gali, t)
+            keep = ~settled
+            z, orbit, log_growth, fli = z[keep], orbit[keep], log_growth[keep], fli[keep]
+            if len(z) == 0:
+                break
+
+    return results
+
+def chaos_map(energy, n_y, n_py, dt=0.01, num_steps=20000, **options):
+    """
+    Chaos indicators of a full (y, py) grid of the x = 0 section at the given energy.
+
+    Parameters:
+        energy (float): Total energy.
+        n_y, n_py (int): Size of the (y, py) grid (see initial_conditions.section_grid).
+        dt (float): Step size.
+        num_steps (int): Maximum number of steps of every orbit.
+        options: Further arguments of chaos_indicators.
+
+    Returns:
+        tuple: (initial_conditions, indicators) with the (N, 4) grid and the dictionary returned by chaos_indicators.
+    """
+    grid = section_grid(energy, n_y, n_py)
+    return grid, chaos_indicators(grid, dt, num_steps, **options)
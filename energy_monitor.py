@@ -0,0 +1,185 @@
+import warnings
+
+import numpy as np
+
+from var import equations_motion, hamiltonian
+
+class EnergyDivergence(RuntimeError):
+    """
+    Raised by EnergyMonitor to abort a run whose energy has diverged.
+
+    Attributes:
+        t (float): Time at which the run was aborted.
+        orbits (array): Indices of the diverged orbits.
+        drift (array): Relative energy drift of the diverged orbits.
+    """
+
+    def __init__(self, t, orbits, drift):
+        self.t = t
+        self.orbits = orbits
+        self.drift = drift
+        super().__init__(f"Energy diverged at t = {t:.6g} for {len(orbits)} orbit(s): relative drift {np.max(drift):.3e}")
+
+class EnergyMonitor:
+    """
+    Online energy diagnostics of a run, updated inside the integration loop in constant memory.
+
+    At every check the relative energy drift d = (E(t) - E(0)) / |E(0)| of every orbit is folded into running
+    statistics: its largest magnitude, its mean and variance (Welford's algorithm) and the least-squares secular trend
+    d ~ intercept + slope * (t - t0) (updated as running co-moments of t and d). Optionally:
+
+    - alert: a warning is issued the first time the drift of an orbit exceeds the alert threshold;
+    - abort: the run is stopped by an EnergyDivergence as soon as the drift of an orbit exceeds the abort threshold or
+      its energy is no longer finite, instead of integrating a diverged orbit to the end;
+    - project: the states whose drift exceeds the projection threshold are pulled back onto their initial energy shell
+      by Newton steps along the gradient of the Hamiltonian. The projection bounds the energy error of methods that
+      drift, at the price of a small perturbation of the trajectory (it is not part of a symplectic step). The
+      statistics are those of the states before their projection.
+
+    The monitor is passed as monitor= to integration_methods.henon_heiles or henon_heiles_stream, which call start()
+    with the initial state and then update() after every step.
+
+    Attributes:
+        initial (array): Initial energy of every orbit.
+        count (int): Number of checks.
+        max_drift (array): Largest |d| of every orbit.
+        mean_drift (array): Mean of d over the checks.
+        projections (array): Number of projections of every orbit.
+        alerted (array): Whether the drift of every orbit has exceeded the alert threshold.
+    """
+
+    def __init__(self, alert=None, abort=None, project=None, every=1, hamiltonian=hamiltonian, f=equations_motion):
+        """
+        Parameters:
+            alert (float): Relative drift above which a warning is issued (once per orbit), or None.
+            abort (float): Relative drift above which the run is aborted, or None to only abort on non-finite energies.
+            project (float): Relative drift above which the states are projected back onto their energy shell, or None.
+            every (int): Check the energy every this many steps only.
+            hamiltonian (function): Energy of the states (e.g. potential.PolynomialPotential.hamiltonian).
+            f (function): Right-hand side of the motion, whose components give the gradient of the Hamiltonian.
+        """
+        self.alert = alert
+        self.abort = abort
+        self.project = project
+        self.every = every
+        self.hamiltonian = hamiltonian
+        self.f = f
+        self.initial = None
+
+    def start(self, t, y):
+        """
+        Reset the statistics at the initial state of a run.
+        """
+        self.initial = np.asarray(self.hamiltonian(y), dtype=float)
+        self.count = 0
+        self.max_drift = np.zeros_like(self.initial)
+        self.mean_drift = np.zeros_like(self.initial)
+        self.projections = np.zeros(self.initial.shape, dtype=int)
+        self.alerted = np.zeros(self.initial.shape, dtype=bool)
+        self._steps = 0
+        self._t0 = t
+        self._mean_t = 0.0
+        self._m2_t = 0.0
+        self._m2_drift = np.zeros_like(self.initial)
+        self._co_moment = np.zeros_like(self.initial)
+
+    def _drift(self, y):
+        return (np.asarray(self.hamiltonian(y)) - self.initial) / np.abs(self.initial)
+
+    def update(self, t, y):
+        """
+        Check the state after a step.
+
+        Parameters:
+            t (float): Time of the state.
+            y (array): State of shape (4,) or (N, 4).
+
+        Returns:
+            array: The state, projected onto the energy shell where needed.
+
+        Raises:
+            EnergyDivergence: When the run is aborted.
+        """
+        self._steps += 1
+        if self._steps % self.every:
+            return y
+        with np.errstate(over='ignore', invalid='ignore'):
+            drift = self._drift(y)
+        magnitude = np.where(np.isfinite(drift), np.abs(drift), np.inf)
+
+        diverged = ~np.isfinite(drift) if self.abort is None else magnitude > self.abort
+        if np.any(diverged):
+            raise EnergyDivergence(t, np.flatnonzero(diverged), np.atleast_1d(magnitude)[np.atleast_1d(diverged)])
+
+        # Welford updates of the mean and variance of the drift and of its co-moment with the time, for the trend
+        self.count += 1
+        t = t - self._t0
+        delta_t, delta = t - self._mean_t, drift - self.mean_drift
+        self._mean_t += delta_t / self.count
+        self.mean_drift = self.mean_drift + delta / self.count
+        self._m2_t += delta_t * (t - self._mean_t)
+        self._m2_drift = self._m2_drift + delta * (drift - self.mean_drift)
+        self._co_moment = self._co_moment + delta_t * (drift - self.mean_drift)
+        self.max_drift = np.maximum(self.max_drift, magnitude)
+
+        if self.alert is not None:
+            new = (magnitude > self.alert) & ~self.alerted
+            if np.any(new):
+                self.alerted = self.alerted | new
+                warnings.warn(f"Relative energy drift above {self.alert:.1e} at t = {t + self._t0:.6g} for {np.sum(new)} orbit(s) "
+                              f"(largest {np.max(magnitude):.3e})", RuntimeWarning, stacklevel=2)
+
+        if self.project is not None and np.any(magnitude > self.project):
+            y = self._project(y, magnitude > self.project)
+        return y
+
+    def _project(self, y, lanes, iterations=2):
+        """
+        Pull the states of the given lanes back onto their initial energy shell by Newton steps along grad H.
+        """
+        y = np.array(y, dtype=float)
+        for _ in range(iterations):
+            # grad H = (V_x, V_y, px, py) = (-dpx/dt, -dpy/dt, dX/dt, dY/dt)
+            derivatives = np.asarray(self.f(0.0, y))
+            gradient = np.concatenate([-derivatives[..., 2:], derivatives[..., :2]], axis=-1)
+            residual = np.asarray(self.hamiltonian(y)) - self.initial
+            step = (residual / np.sum(gradient**2, axis=-1))[..., np.newaxis] * gradient
+            y = np.where(lanes[..., np.newaxis], y - step, y)
+        self.projections = self.projections + lanes
+        return y
+
+    @property
+    def std_drift(self):
+        """
+        Standard deviation of the drift over the checks.
+        """
+        return np.sqrt(self._m2_drift / max(self.count - 1, 1))
+
+    @property
+    def slope(self):
+        """
+        Secular trend of the drift per unit time (least-squares slope of d against t), 0 before two checks.
+        """
+        return self._co_moment / self._m2_t if self._m2_t > 0 else np.zeros_like(self.initial)
+
+    @property
+    def intercept(self):
+        return self.mean_drift - self.slope * self._mean_t
+
+    def summary(self):
+        """
+        Statistics of the run.
+
+        Returns:
+            dict: Arrays with one value per orbit: 'energy_initial', 'max_drift', 'mean_drift', 'std_drift',
+                  'drift_slope', 'drift_intercept' and 'projections'.
+        """
+        return {
+            'energy_initial': self.initial,
+            'max_drift': self.max_drift,
+            'mean_drift': self.mean_drift,
+            'std_drift': self.std_drift,
+            'drift_slope': self.slope,
+            'drift_intercept': self.intercept,
+            'projections': self.projections,
+        }
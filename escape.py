@@ -0,0 +1,162 @@
+import numpy as np
+
+from initial_conditions import section_grid
+from integration_methods import henon_heiles_stream, leap_frog, runge_kutta4
+from var import equations_motion
+
+# Exit channels of the potential: the directions of its three saddle points (0, 1) and (+-sqrt(3)/2, -1/2), all at
+# distance 1 from the origin and at the escape energy 1/6
+CHANNEL_ANGLES = np.array([90.0, 210.0, 330.0])
+_DIRECTIONS = np.stack([np.cos(np.radians(CHANNEL_ANGLES)), np.sin(np.radians(CHANNEL_ANGLES))], axis=-1)
+
+def exit_channel(y):
+    """
+    Exit channel of states (or of an (N, 4) batch of states): the index in CHANNEL_ANGLES of the saddle whose direction
+    is the closest to the position (x, y).
+    """
+    y = np.asarray(y)
+    return np.argmax(y[..., :2] @ _DIRECTIONS.T, axis=-1)
+
+def escape_criterion(y, radius=2.0, channels=True):
+    """
+    Escape test of states (or of an (N, 4) batch of states).
+
+    An orbit has escaped when it leaves the disc of the given radius, or (with channels) when it has passed the line
+    through a saddle point, perpendicular to its direction, while moving outwards: it has then gone over the saddle and
+    leaves the triangle of the potential. Non-finite states count as escaped.
+
+    Returns:
+        array: Boolean array with the shape of the batch.
+    """
+    y = np.asarray(y)
+    escaped = ~np.isfinite(y).all(axis=-1) | (y[..., 0]**2 + y[..., 1]**2 > radius**2)
+    if channels:
+        position = y[..., :2] @ _DIRECTIONS.T
+        momentum = y[..., 2:] @ _DIRECTIONS.T
+        escaped |= ((position > 1) & (momentum > 0)).any(axis=-1)
+    return escaped
+
+class EscapeMonitor:
+    """
+    Escape criterion checked inside the integration loop of an ensemble, which retires the escaped orbits.
+
+    The monitor is passed as escape= to integration_methods.henon_heiles_stream, which calls start() with the initial
+    state and then update() after every step: the escape criterion (see escape_criterion) is checked every check_every
+    steps (and after the last one), the escape time, exit channel and state of the escaped orbits are recorded, and the
+    stream compacts its batch so that the later steps only integrate the orbits that are still inside.
+
+    Attributes:
+        orbit (array): Indices of the orbits still inside, in the order of the compacted batch.
+        results (dict): Arrays of shape (N,) with 'escaped' (bool), 'time' (the escape time, nan for the orbits that
+                        did not escape), 'channel' (index in CHANNEL_ANGLES, -1 for the orbits that did not escape) and
+                        'state' of shape (N, 4) (the state at the escape, or at the end of the integration).
+    """
+
+    def __init__(self, radius=2.0, channels=True, check_every=1):
+        """
+        Parameters:
+            radius (float): Radius of the disc the orbits escape from.
+            channels (bool): Also detect the escapes as soon as the orbits pass a saddle line moving outwards.
+            check_every (int): Number of steps between two escape checks.
+        """
+        self.radius = radius
+        self.channels = channels
+        self.check_every = check_every
+        self.orbit = None
+        self.results = None
+
+    def start(self, t, y):
+        """
+        Reset the results at the initial state of a run.
+        """
+        y = np.asarray(y, dtype=float).reshape(-1, 4)
+        self.orbit = np.arange(len(y))
+        self.results = {
+            'escaped': np.zeros(len(y), dtype=bool),
+            'time': np.full(len(y), np.nan),
+            'channel': np.full(len(y), -1),
+            'state': y.copy(),
+        }
+        self._steps = 0
+
+    def update(self, t, y, last=False):
+        """
+        Check the orbits still inside after a step.
+
+        Parameters:
+            t (float): Time of the states.
+            y (array): (M, 4) states of the orbits still inside (see orbit).
+            last (bool): Whether this is the last step of the run, which is always checked.
+
+        Returns:
+            array: Mask of the orbits of y that are still inside, or None when no orbit has escaped.
+        """
+        self._steps += 1
+        if self._steps % self.check_every and not last:
+            return None
+        escaped = escape_criterion(y, self.radius, self.channels)
+        if not escaped.any():
+            return None
+        ids = self.orbit[escaped]
+        self.results['escaped'][ids] = True
+        self.results['time'][ids] = t
+        self.results['channel'][ids] = exit_channel(y[escaped])
+        self.results['state'][ids] = y[escaped]
+        self.orbit = self.orbit[~escaped]
+        return ~escaped
+
+    def finish(self, y):
+        """
+        Record the final states of the orbits still inside at the end of the run.
+        """
+        self.results['state'][self.orbit] = y
+
+def escape_times(y0, dt, num_steps, integration_method=runge_kutta4, f=equations_motion, radius=2.0, channels=True, check_every=1):
+    """
+    Integrate a batch of orbits until they escape, recording the escape time and exit channel of every orbit.
+
+    Above the escape energy 1/6 the orbits leave the triangle of the potential through one of its three openings and
+    then diverge. The orbits are streamed with an EscapeMonitor, which retires the escaped orbits and compacts the
+    batch, so that the later steps only integrate the orbits that are still inside; only the escape results are kept.
+
+    Parameters:
+        y0 (array): (N, 4) array of initial conditions (or a single state vector).
+        dt (float): Step size.
+        num_steps (int): Maximum number of steps.
+        integration_method (function): Single-step method (any of integration_methods except leap_frog).
+        f (function): The function that defines the ODE dy/dt = f(t, y).
+        radius (float): Radius of the disc the orbits escape from.
+        channels (bool): Also detect the escapes as soon as the orbits pass a saddle line moving outwards.
+        check_every (int): Number of steps between two escape checks.
+
+    Returns:
+        dict: Arrays of shape (N,) with 'escaped' (bool), 'time' (the escape time, nan for the orbits that did not
+              escape), 'channel' (index in CHANNEL_ANGLES, -1 for the orbits that did not escape) and 'state' of shape
+              (N, 4) (the state at the escape, or at the end of the integration).
+    """
+    if integration_method == leap_frog:
+        raise ValueError("leap_frog needs the previous state: use a single-step method")
+    monitor = EscapeMonitor(radius, channels, check_every)
+    # Only the first and last samples are kept: the stream is only run for its escapes
+    stream = henon_heiles_stream(integration_method, f, np.atleast_2d(y0), 0.0, dt, num_steps + 1, chunk_size=2,
+                                 stride=max(num_steps, 1), escape=monitor)
+    for _ in stream:
+        pass
+    return monitor.results
+
+def escape_map(energy, n_y, n_py, dt=0.01, num_steps=100000, **options):
+    """
+    Escape times and exit channels of a full (y, py) grid of the x = 0 section at the given energy (basins of escape).
+
+    Parameters:
+        energy (float): Total energy (above 1/6 for the orbits to escape).
+        n_y, n_py (int): Size of the (y, py) grid (see initial_conditions.section_grid).
+        dt (float): Step size.
+        num_steps (int): Maximum number of steps of every orbit.
+        options: Further arguments of escape_times.
+
+    Returns:
+        tuple: (initial_conditions, results) with the (N, 4) grid and the dictionary returned by escape_times.
+    """
+    grid = section_grid(energy, n_y, n_py)
+    return grid, escape_times(grid, dt, num_steps, **options)
@@ -0,0 +1,295 @@
+import numpy as np
+
+from initial_conditions import section_samples
+from integration_methods import henon_heiles_stream, runge_kutta4
+from var import equations_motion
+
+# Inverse of the golden ratio, for the golden-section search of the NAFF peaks
+_GOLDEN = (np.sqrt(5) - 1) / 2
+
+def _window(n, power):
+    """
+    Hann window of the given power on n samples (Laskar's window), normalized to a unit sum.
+    """
+    w = (1 + np.cos(np.linspace(-np.pi, np.pi, n)))**power
+    return w / w.sum()
+
+def _lanes(z):
+    """
+    Signals of shape (n,) or (n, ...) as an (n, lanes) array, with the trailing shape to restore the results.
+    """
+    z = np.asarray(z)
+    return z.reshape(len(z), -1), z.shape[1:]
+
+def signals(y):
+    """
+    Complex signals x - i px and y - i py of states of shape (n, 4) or (n, N, 4): for a harmonic oscillation of
+    frequency w they rotate as exp(i w t), so that the fundamental frequencies are found as positive frequencies.
+
+    Returns:
+        array: Signals of shape (n, 2) or (n, N, 2).
+    """
+    y = np.asarray(y)
+    return y[..., :2] - 1j * y[..., 2:]
+
+def windowed_fft(t, z, window_power=1):
+    """
+    Windowed FFT of a batch of signals sampled on a uniform time grid.
+
+    Parameters:
+        t (array): Uniform sampling times, of shape (n,).
+        z (array): Complex (or real) signals of shape (n,) or (n, ...), one per lane.
+        window_power (int): Power of the Hann window (0 for no window).
+
+    Returns:
+        tuple: (omega, spectrum) with the angular frequencies of shape (n,) and the windowed spectrum of shape (n, ...),
+               normalized so that a component a exp(i w t) shows up with a peak of modulus |a| at omega = w.
+    """
+    t = np.asarray(t)
+    z, shape = _lanes(z)
+    spectrum = np.fft.fft(_window(len(t), window_power)[:, np.newaxis] * z, axis=0)
+    omega = 2 * np.pi * np.fft.fftfreq(len(t), d=t[1] - t[0])
+    return omega, spectrum.reshape((len(t),) + shape)
+
+def _projection(t, z, window, omega):
+    """
+    Windowed projections sum_k window_k z_k exp(-i omega t_k) of every lane of z (n, lanes) on its own frequency omega (lanes,).
+    """
+    return np.einsum('kl,kl->l', window[:, np.newaxis] * z, np.exp(-1j * np.outer(t, omega)))
+
+def naff(t, z, n_frequencies=1, window_power=1, iterations=40):
+    """
+    Numerical analysis of fundamental frequencies (NAFF) of a batch of signals.
+
+    Every frequency is first located on the windowed FFT, then refined by a golden-section search of the maximum of the
+    windowed projection |<z, exp(i w t)>| within one FFT bin, on all the lanes at once. For a quasi-periodic signal the
+    error of the refined frequency decreases as 1/T^(2 window_power + 2) instead of the 1/T of the FFT bins. With
+    n_frequencies > 1 the component found is subtracted from the signal before the next one is searched.
+
+    Parameters:
+        t (array): Uniform sampling times, of shape (n,).
+        z (array): Complex signals of shape (n,) or (n, ...), one per lane.
+        n_frequencies (int): Number of frequencies extracted from every signal, by decreasing amplitude.
+        window_power (int): Power of the Hann window.
+        iterations (int): Number of golden-section iterations (each one shrinks the bracket by 0.618).
+
+    Returns:
+        tuple: (frequencies, amplitudes) of shape (..., n_frequencies): the angular frequencies and the complex
+               amplitudes (phase at t[0]) of the components.
+    """
+    t = np.asarray(t, dtype=float) - t[0]
+    z, shape = _lanes(z)
+    z = z.astype(complex)
+    window = _window(len(t), window_power)
+    bin_width = 2 * np.pi / (len(t) * (t[1] - t[0]))
+    lanes = np.arange(z.shape[1])
+
+    frequencies = np.zeros((z.shape[1], n_frequencies))
+    amplitudes = np.zeros((z.shape[1], n_frequencies), dtype=complex)
+    for j in range(n_frequencies):
+        omega, spectrum = windowed_fft(t, z, window_power)
+        peak = omega[np.argmax(np.abs(spectrum), axis=0)]
+
+        # Golden-section search of the maximum of the projection, within one bin of the FFT peak
+        a, b = peak - bin_width, peak + bin_width
+        c, d = b - _GOLDEN * (b - a), a + _GOLDEN * (b - a)
+        fc, fd = np.abs(_projection(t, z, window, c)), np.abs(_projection(t, z, window, d))
+        for _ in range(iterations):
+            # The maximum is in [a, d] for the lanes where fc > fd, in [c, b] for the others: one interior point is
+            # kept and only one new projection is needed per iteration
+            left = fc > fd
+            a, b = np.where(left, a, c), np.where(left, d, b)
+            c, d, fc, fd = (np.where(left, b - _GOLDEN * (b - a), d), np.where(left, c, a + _GOLDEN * (b - a)),
+                            np.where(left, fc, fd), np.where(left, fc, fd))
+            new = np.where(left, c, d)
+            f_new = np.abs(_projection(t, z, window, new))
+            fc, fd = np.where(left, f_new, fc), np.where(left, fd, f_new)
+
+        frequencies[:, j] = (a + b) / 2
+        amplitudes[:, j] = _projection(t, z, window, frequencies[:, j])
+        z = z - amplitudes[lanes, j] * np.exp(1j * np.outer(t, frequencies[:, j]))
+
+    return frequencies.reshape(shape + (n_frequencies,)), amplitudes.reshape(shape + (n_frequencies,))
+
+def fft_frequencies(t, z, window_power=1):
+    """
+    Dominant frequencies of a batch of signals from the windowed FFT alone, refined by a quadratic interpolation of the
+    log-spectrum around the peak: cheaper than naff, with an error of a fraction of a bin.
+
+    Returns:
+        array: Angular frequencies of shape z.shape[1:].
+    """
+    t = np.asarray(t)
+    z, shape = _lanes(z)
+    omega, spectrum = windowed_fft(t, z, window_power)
+    magnitude = np.log(np.abs(spectrum) + 1e-300)
+    peak = np.argmax(magnitude, axis=0)
+    lanes = np.arange(z.shape[1])
+    left, center, right = (magnitude[(peak + k) % len(t), lanes] for k in (-1, 0, 1))
+    denominator = left - 2 * center + right
+    offset = np.where(denominator != 0, 0.5 * (left - right) / np.where(denominator != 0, denominator, 1), 0)
+    return (omega[peak] + offset * 2 * np.pi / (len(t) * (t[1] - t[0]))).reshape(shape)
+
+def fundamental_frequencies(t, y, method='naff', window_power=1):
+    """
+    Fundamental frequencies (w_x, w_y) of a batch of orbits, from the signals x - i px and y - i py.
+
+    Parameters:
+        t (array): Uniform sampling times, of shape (n,).
+        y (array): States of shape (n, 4) or (n, N, 4).
+        method (str): 'naff' or 'fft' (see fft_frequencies).
+        window_power (int): Power of the Hann window.
+
+    Returns:
+        array: Angular frequencies of shape (2,) or (N, 2).
+    """
+    if method == 'naff':
+        return naff(t, signals(y), window_power=window_power)[0][..., 0]
+    if method == 'fft':
+        return fft_frequencies(t, signals(y), window_power=window_power)
+    raise ValueError(f"Unknown frequency analysis method {method!r}: expected 'naff' or 'fft'")
+
+def frequency_diffusion(t, y, method='naff', window_power=1):
+    """
+    Frequency diffusion index of a batch of orbits: the change of the fundamental frequencies between the first and the
+    second half of every orbit.
+
+    On a regular (quasi-periodic) orbit the frequencies are constant and the index is only limited by the accuracy of the
+    analysis, while the frequencies of a chaotic orbit wander: a diffusion index above about -4 (for orbits over a few
+    hundred periods) marks a chaotic orbit.
+
+    Parameters:
+        t (array): Uniform sampling times, of shape (n,).
+        y (array): States of shape (n, 4) or (n, N, 4).
+        method (str): 'naff' or 'fft' (see fundamental_frequencies).
+        window_power (int): Power of the Hann window.
+
+    Returns:
+        dict: 'frequencies' and 'frequencies_late' (the frequencies of the two halves, of shape (2,) or (N, 2)),
+              'ratio' (w_x / w_y of the first half) and 'diffusion' (log10 of the largest relative change of w_x and w_y).
+    """
+    half = len(t) // 2
+    early = fundamental_frequencies(t[:half], y[:half], method, window_power)
+    late = fundamental_frequencies(t[half:2*half], y[half:2*half], method, window_power)
+    change = np.max(np.abs(late - early) / np.abs(early), axis=-1)
+    return {
+        'frequencies': early,
+        'frequencies_late': late,
+        'ratio': early[..., 0] / early[..., 1],
+        'diffusion': np.log10(np.maximum(change, 1e-16)),
+    }
+
+def resonance(ratio, max_order=6, tolerance=1e-4):
+    """
+    Lowest-order resonance m:n (m w_y = n w_x, i.e. w_x / w_y = m / n) matched by frequency ratios.
+
+    In the Henon-Heiles potential the loop orbits are locked in the 1:1 resonance, the box orbits are not resonant, and
+    the resonant islands of the Poincaré sections show up as other low-order ratios.
+
+    Parameters:
+        ratio (array): Frequency ratios w_x / w_y.
+        max_order (int): Largest m + n considered.
+        tolerance (float): Largest relative mismatch |ratio - m/n| / (m/n).
+
+    Returns:
+        tuple: (m, n) integer arrays with the shape of ratio, 0 where no resonance matches.
+    """
+    ratio = np.abs(np.asarray(ratio, dtype=float))
+    m, n = np.zeros(ratio.shape, dtype=int), np.zeros(ratio.shape, dtype=int)
+    for order in range(2, max_order + 1):
+        for mm in range(1, order):
+            nn = order - mm
+            match = (m == 0) & (np.abs(ratio - mm / nn) <= tolerance * mm / nn)
+            m[match], n[match] = mm, nn
+    return m, n
+
+class FrequencySignals:
+    """
+    Reducer collecting the decimated complex signals of a streamed trajectory for frequency analysis.
+
+    Only every decimate-th sample of the stream (itself possibly decimated by its stride) is kept, and only as the two
+    complex signals x - i px and y - i py, so that long runs of large ensembles never store their trajectories. The
+    sampling interval must stay well below half the shortest period of the orbits (about 3 time units in the
+    Henon-Heiles potential) to avoid aliasing.
+
+    Attributes:
+        decimate (int): Keep every decimate-th streamed sample.
+        t (array): Times of the kept samples.
+        z (array): Signals of the kept samples, of shape (n, 2) or (n, N, 2).
+    """
+
+    def __init__(self, decimate=1):
+        self.decimate = decimate
+        self._t = []
+        self._z = []
+        self._seen = 0
+
+    def update(self, t_chunk, y_chunk):
+        """
+        Keep the decimated signals of a chunk of the trajectory.
+
+        Parameters:
+            t_chunk (array): Times of the samples in the chunk.
+            y_chunk (array): States of the samples in the chunk, of shape (n, 4) or (n, N, 4).
+        """
+        first = -self._seen % self.decimate
+        self._t.append(np.array(t_chunk[first::self.decimate]))
+        self._z.append(signals(y_chunk[first::self.decimate]))
+        self._seen += len(t_chunk)
+
+    @property
+    def t(self):
+        return np.concatenate(self._t) if self._t else np.empty(0)
+
+    @property
+    def z(self):
+        return np.concatenate(self._z) if self._z else np.empty((0, 2), dtype=complex)
+
+    def frequency_diffusion(self, method='naff', window_power=1):
+        """
+        Frequency diffusion of the collected signals (see frequency_diffusion).
+        """
+        t, z = self.t, self.z
+        # Back to states (x, y, px, py) for frequency_diffusion
+        y = np.concatenate([z.real, -z.imag], axis=-1)
+        return frequency_diffusion(t, y, method, window_power)
+
+def frequency_map(energy, n, sampling='grid', dt=0.01, num_steps=100001, decimate=10, integration_method=runge_kutta4,
+                  f=equations_motion, method='naff', batch_size=1000, chunk_size=10000):
+    """
+    Frequency diffusion of the orbits of a sampling of the x = 0 section at the given energy.
+
+    The orbits are integrated in batches with henon_heiles_stream, and only their decimated signals are kept (see
+    FrequencySignals).
+
+    Parameters:
+        energy (float): Total energy.
+        n (int or tuple): Number of sampled points (see initial_conditions.section_samples).
+        sampling (str): 'grid', 'halton', 'sobol' or 'boundary'.
+        dt (float): Step size.
+        num_steps (int): Number of time samples of every orbit.
+        decimate (int): Keep every decimate-th sample for the analysis.
+        integration_method (function): Single-step method (see henon_heiles_stream).
+        f (function): The function that defines the ODE dy/dt = f(t, y).
+        method (str): 'naff' or 'fft'.
+        batch_size (int): Number of orbits integrated together.
+        chunk_size (int): Number of samples per chunk of the stream.
+
+    Returns:
+        tuple: (initial_conditions, results) with the (N, 4) initial conditions and the dictionary returned by
+               frequency_diffusion, for all of them.
+
+    Raises:
+        ValueError: When the sampling of the section has no orbit.
+    """
+    samples = section_samples(energy, n, sampling)
+    if len(samples) == 0:
+        raise ValueError(f"The {sampling} sampling of the section at the energy {energy} has no orbit")
+    results = []
+    for start in range(0, len(samples), batch_size):
+        batch = samples[start:start + batch_size]
+        collector = FrequencySignals(decimate)
+        for _ in henon_heiles_stream(integration_method, f, batch, 0.0, dt, num_steps, chunk_size=chunk_size, reducers=[collector]):
+            pass
+        results.append(collector.frequency_diffusion(method))
+    return samples, {key: np.concatenate([result[key] for result in results]) for key in results[0]}
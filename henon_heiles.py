@@ -5,7 +5,15 @@ This script performs numerical integration of the Henon-Heiles system using vari
 and visualizes the trajectory.
 
 Usage:
-  henon_heiles.py (--rk2 | --rk4 | --leapfrog | --euler) (--outer | --torus | --hyperbolic)
+  henon_heiles.py (--rk2 | --rk4 | --leapfrog | --euler | --verlet | --yoshida4 | --yoshida6 | --yoshida8 | --dopri
+                   | --abm | --stormer | --auto TOL)
+                  (--outer | --torus | --hyperbolic | --all) [--kernel KERNEL]
+                  [--stream [--stride K] [--chunk-size N] [--escape [R]]] [--store DIR] [--cache] [--rtol RTOL] [--atol ATOL]
+                  [--precision PRECISION] [--energy E] [--periodic-orbits [K]] [--profile [FILE]]
+                  [--energy-alert TOL] [--energy-abort TOL] [--energy-project TOL]
+                  [--headless [--output FILE] | --raster [N]]
+  henon_heiles.py sweep --energies E [E ...] [sweep options]    (see sweep.py)
+  henon_heiles.py serve [--socket PATH | --host HOST --port PORT] [service options]    (see service.py)
 
 Options:
   -h, --help    Show this help message and exit.
@@ -13,22 +21,96 @@ Options:
   --rk4         Integrate equations of motion using Runge-Kutta 4.
   --leapfrog    Integrate equations of motion using LeapFrog.
   --euler       Integrate equations of motion using Euler.
+  --verlet      Integrate equations of motion using velocity Verlet (symplectic, 2nd order).
+  --yoshida4    Integrate equations of motion using Forest-Ruth/Yoshida (symplectic, 4th order).
+  --yoshida6    Integrate equations of motion using Yoshida (symplectic, 6th order).
+  --yoshida8    Integrate equations of motion using Yoshida (symplectic, 8th order).
+  --dopri       Integrate equations of motion using adaptive Dormand-Prince 5(4) with dense output.
+  --abm         Integrate equations of motion using Adams-Bashforth-Moulton (multistep, 4th order, 2 RHS calls per step).
+  --stormer     Integrate equations of motion using Stormer-Cowell (multistep, 4th order, 1 RHS call per step).
+  --auto TOL    Choose the cheapest method and step size keeping the relative energy error of the run below TOL,
+                from work-precision curves measured on short probe runs of the orbits (cached per method and orbit).
   --outer       Simulation of trajectory: outside separatrix.
   --torus       Simulation of trajectory: distorted torus.
   --hyperbolic  Simulation of trajectory: hyperbolic points (separatrices).
+  --all         Simulation of trajectory: all the initial conditions.
+  --kernel KERNEL
+                Stepping kernel: generic (any right-hand side), fused (the fastest fused kernel available:
+                numba when installed, otherwise the in-place NumPy kernel for ensembles and the generic
+                path for a lone orbit) or numba (JIT-compiled kernel, requires numba) [default: generic].
+  --stream      Integrate and plot the trajectory chunk by chunk in constant memory.
+  --stride K    With --stream or --store, keep every K-th step only [default: 1].
+  --chunk-size N
+                With --stream, number of kept samples per chunk [default: 10000].
+  --escape [R]  With --stream, retire the orbits that escape (leave the disc of radius R or pass a saddle of the
+                potential moving outwards) and only integrate the orbits still inside; their escape times and exit
+                channels are reported [default R: 2].
+  --store DIR   Integrate into an on-disk trajectory store with checkpoints, resuming an interrupted run.
+  --cache       Reuse trajectories already integrated with the same method, initial conditions and time grid.
+  --rtol RTOL   With --dopri, relative tolerance [default: 1e-8].
+  --atol ATOL   With --dopri, absolute tolerance [default: 1e-10].
+  --profile [FILE]
+                Report the wall time of every phase (integration, section, energy, plotting, rendering), the RHS
+                calls, the steps taken or rejected and the bytes allocated for the trajectory as JSON, to FILE or
+                to the standard output.
+  --precision PRECISION
+                Precision of the stored and integrated states: float64, or float32 (half the memory per orbit,
+                with compensated summation of the state updates and energy-error diagnostics) [default: float64].
+  --energy E    Move the initial conditions to the energy E: px is solved from H = E at the same (y, py)
+                on the x = 0 section, keeping its sign.
+  --energy-alert TOL
+                Monitor the energy inside the integration loop (running drift statistics and secular trend)
+                and warn when the relative energy drift of an orbit exceeds TOL.
+  --energy-abort TOL
+                Monitor the energy and abort the run with exit status 1 as soon as the relative energy drift
+                of an orbit exceeds TOL (or its energy is no longer finite).
+  --energy-project TOL
+                Monitor the energy and project the states back onto their initial energy shell whenever the
+                relative energy drift exceeds TOL.
+  --periodic-orbits [K]
+                Find the periodic orbits crossing the x = 0 section up to K times per period at the energy of
+                the initial conditions, report their stability and mark them on the Poincaré map (stable ones
+                as circles, unstable ones as crosses); the orbits are cached per energy [default K: 1].
+  --raster [N]  Draw the x-y plane and the section as N x N density images with one color channel per orbit, and
+                the energy as an envelope, filled chunk by chunk: the plotting cost does not depend on the
+                number of points [default N: 512].
+  --headless    Do not plot: matplotlib is never imported and the run ends without a window.
+  --output FILE With --headless, save the trajectory, the section points and the energy diagnostics to an
+                uncompressed .npz file, or write the .npz bytes to the standard output with "-" (the
+                messages then go to the standard error). With --stream only the section points and the
+                energy statistics are saved.
 
 Examples:
   python henon_heiles.py --rk4 --torus
+  python henon_heiles.py --rk4 --all --headless --output run.npz
+  python henon_heiles.py --auto 1e-8 --torus
+  python henon_heiles.py sweep --energies 1/12 1/8 1/6 --grid 30 30 --output sections.npz
+  python henon_heiles.py serve --socket /tmp/henon_heiles.sock --workers 4
 """
 
 import argparse
+import io
 import sys
+from contextlib import contextmanager, nullcontext, redirect_stdout
 import numpy as np
-import matplotlib.pyplot as plt
 
-from integration_methods import henon_heiles, runge_kutta2, runge_kutta4, leap_frog, euler
+from integration_methods import henon_heiles, henon_heiles_stream, runge_kutta2, runge_kutta4, leap_frog, euler
+from integration_methods import velocity_verlet, yoshida4, yoshida6, yoshida8, METHODS
+from adaptive import dormand_prince, dormand_prince_solve
+from multistep import adams_bashforth_moulton, stormer_cowell
 from var import equations_motion as var
-import poincare_maps as pm
+from var import hamiltonian
+from reducers import EnergyStats, SectionCrossings
+from sections import find_crossings
+from initial_conditions import on_energy_shell
+from periodic_orbits import periodic_orbits
+from raster import TrajectoryRasters
+from energy_monitor import EnergyDivergence, EnergyMonitor
+from escape import EscapeMonitor
+import cache
+import precision
+import profiling
+import store
 
 # Define time values
 t_values = np.linspace(0, 200, 200001) 
@@ -36,7 +118,45 @@ t_values = np.linspace(0, 200, 200001)
 # Choose a suitable step size
 dt = t_values[1] - t_values[0]
 
+def _write_output(path, data, stream=None):
+    """
+    Save the results of a headless run to an uncompressed .npz file, or write the .npz bytes to a binary stream.
+
+    Parameters:
+        path (str): Output file (ignored when stream is given).
+        data (dict): Arrays to save (trajectory, section points, energy diagnostics).
+        stream (file): Binary stream receiving the .npz bytes, such as sys.stdout.buffer.
+    """
+    if stream is not None:
+        buffer = io.BytesIO()
+        np.savez(buffer, **data)
+        stream.write(buffer.getvalue())
+        stream.flush()
+    else:
+        np.savez(path, **data)
+
+@contextmanager
+def _exit_on_divergence():
+    """
+    Turn the abort of a diverging run by the energy monitor into an error message and exit status 1.
+    """
+    try:
+        yield
+    except EnergyDivergence as error:
+        print(f"Error: {error}")
+        sys.exit(1)
+
 def main():
+    # The sweep and serve subcommands have their own options
+    if sys.argv[1:2] == ["sweep"]:
+        import sweep
+        sweep.main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["serve"]:
+        import service
+        service.main(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(description="Henon-Heiles System Integration")
     
     # Create a mutually exclusive group for the integration method options
@@ -45,6 +165,15 @@ def main():
     method_group.add_argument("--rk4", action="store_true", help="Integrate equations of motion using Runge-Kutta 4")
     method_group.add_argument("--leapfrog", action="store_true", help="Integrate equations of motion using LeapFrog")
     method_group.add_argument("--euler", action="store_true", help="Integrate equations of motion using Euler")
+    method_group.add_argument("--verlet", action="store_true", help="Integrate equations of motion using velocity Verlet (symplectic, 2nd order)")
+    method_group.add_argument("--yoshida4", action="store_true", help="Integrate equations of motion using Forest-Ruth/Yoshida (symplectic, 4th order)")
+    method_group.add_argument("--yoshida6", action="store_true", help="Integrate equations of motion using Yoshida (symplectic, 6th order)")
+    method_group.add_argument("--yoshida8", action="store_true", help="Integrate equations of motion using Yoshida (symplectic, 8th order)")
+    method_group.add_argument("--dopri", action="store_true", help="Integrate equations of motion using adaptive Dormand-Prince 5(4) with dense output")
+    method_group.add_argument("--abm", action="store_true", help="Integrate equations of motion using Adams-Bashforth-Moulton (multistep, 4th order)")
+    method_group.add_argument("--stormer", action="store_true", help="Integrate equations of motion using Stormer-Cowell (multistep, 4th order)")
+    method_group.add_argument("--auto", type=float, metavar="TOL",
+                              help="Choose the cheapest method and step size keeping the relative energy error below TOL")
 
 
     # Create a mutually exclusive group for the initial condition options
@@ -54,75 +183,324 @@ def main():
     traj_group.add_argument("--hyperbolic", action="store_true", help="Simulation of trajectory: hyperbolic points (separatrices)")
     traj_group.add_argument("--all", action="store_true", help="Simulation of trajectory: all the initial conditions")
 
+    parser.add_argument("--kernel", choices=["generic", "fused", "numba"], default="generic",
+                        help="Stepping kernel: generic (any right-hand side), fused (fastest fused kernel available) or numba (JIT-compiled kernel)")
+
+    parser.add_argument("--stream", action="store_true", help="Integrate and plot the trajectory chunk by chunk in constant memory")
+    parser.add_argument("--stride", type=int, default=1, help="With --stream or --store, keep every K-th step only")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="With --stream, number of kept samples per chunk")
+    parser.add_argument("--escape", type=float, nargs="?", const=2.0, metavar="R",
+                        help="With --stream, retire the orbits that escape the disc of radius R or pass a saddle, and report their escape times")
+    parser.add_argument("--store", metavar="DIR", help="Integrate into an on-disk trajectory store with checkpoints, resuming an interrupted run")
+    parser.add_argument("--cache", action="store_true", help="Reuse trajectories already integrated with the same method, initial conditions and time grid")
+    parser.add_argument("--rtol", type=float, default=1e-8, help="With --dopri, relative tolerance")
+    parser.add_argument("--atol", type=float, default=1e-10, help="With --dopri, absolute tolerance")
+    parser.add_argument("--profile", nargs="?", const="-", metavar="FILE",
+                        help="Report the time per phase, RHS calls, steps and allocated bytes as JSON (to FILE, or to the standard output)")
+    parser.add_argument("--periodic-orbits", type=int, nargs="?", const=1, metavar="K",
+                        help="Find and mark the periodic orbits crossing the section up to K times per period")
+    parser.add_argument("--raster", type=int, nargs="?", const=512, metavar="N", help="Draw the trajectories and the section as N x N density images")
+    parser.add_argument("--headless", action="store_true", help="Do not plot (matplotlib is never imported)")
+    parser.add_argument("--precision", choices=["float64", "float32"], default="float64",
+                        help="Precision of the states: float32 halves the memory, with compensated summation of the updates")
+    parser.add_argument("--energy", type=float, help="Move the initial conditions to this energy, solving for px at the same (y, py)")
+    parser.add_argument("--energy-alert", type=float, metavar="TOL", help="Monitor the energy and warn when its relative drift exceeds TOL")
+    parser.add_argument("--energy-abort", type=float, metavar="TOL", help="Monitor the energy and abort the run when its relative drift exceeds TOL")
+    parser.add_argument("--energy-project", type=float, metavar="TOL",
+                        help="Monitor the energy and project the states back onto their energy shell when the relative drift exceeds TOL")
+    parser.add_argument("--output", metavar="FILE",
+                        help="Save the trajectory, section points and energy diagnostics to a .npz file (- for the standard output)")
+
     args = parser.parse_args()
 
-    selected_traj_options = [args.outer, args.torus, args.hyperbolic, args.all]
-    if sum(selected_traj_options) != 1:
-        print("Error: You need to use exactly one of these three arguments: --outer, --torus, or --hyperbolic.")
-        sys.exit(1)  # Exit with an error code
+    if args.output and not args.headless:
+        parser.error("--output requires --headless")
+
+    if args.raster and args.headless:
+        parser.error("--raster draws the plots: it cannot be used with --headless")
+
+    # With --output -, the data is written to the standard output and the messages go to the standard error
+    data_output = sys.stdout.buffer if args.output == "-" else None
+    with redirect_stdout(sys.stderr) if data_output is not None else nullcontext():
+        if args.stream and args.kernel != "generic":
+            parser.error("--stream only supports the generic kernel")
+
+        if args.escape is not None and not args.stream:
+            parser.error("--escape requires --stream")
+
+        selected_traj_options = [args.outer, args.torus, args.hyperbolic, args.all]
+        if sum(selected_traj_options) != 1:
+            print("Error: You need to use exactly one of these three arguments: --outer, --torus, or --hyperbolic.")
+            sys.exit(1)  # Exit with an error code
     
-    selected_method_options = [args.rk2, args.rk4, args.leapfrog, args.euler]
-    if sum(selected_method_options) != 1:
-        print("Error: You need to use exactly one of these four arguments: --rk2, --rk4, --leapfrog, or --euler.")
-        sys.exit(1)  # Exit with an error code
-
-    # Define initial conditions
-    if args.outer:
-        initial_conditions =  np.array([[0, 0, -0.0428, -0.3438]])
-        color = ['tab:blue']
-        title='Outside separatrix (E = 0.06)'
-        print("Simulation of trajectory: outside separatrix")
+        selected_method_options = [args.rk2, args.rk4, args.leapfrog, args.euler, args.verlet, args.yoshida4, args.yoshida6, args.yoshida8, args.dopri,
+                                   args.abm, args.stormer, args.auto is not None]
+        if sum(selected_method_options) != 1:
+            print("Error: You need to use exactly one of these arguments: --rk2, --rk4, --leapfrog, --euler, --verlet, --yoshida4, --yoshida6, --yoshida8, --dopri, --abm, --stormer or --auto.")
+            sys.exit(1)  # Exit with an error code
+
+        # Define initial conditions
+        if args.outer:
+            initial_conditions =  np.array([[0, 0, -0.0428, -0.3438]])
+            color = ['tab:blue']
+            title='Outside separatrix (E = 0.06)'
+            print("Simulation of trajectory: outside separatrix")
         
-    if args.torus:
-        initial_conditions =  np.array([[0, -0.1475, 0.3101, 0]])
-        color = ['tab:orange']
-        title = 'Distorted torus (E = 0.06)'
-        print("Simulation of trajectory: distorted torus")
+        if args.torus:
+            initial_conditions =  np.array([[0, -0.1475, 0.3101, 0]])
+            color = ['tab:orange']
+            title = 'Distorted torus (E = 0.06)'
+            print("Simulation of trajectory: distorted torus")
         
-    if args.hyperbolic:
-        initial_conditions =  np.array([[0, 0.1563, 0.18876, -0.25]])
-        color = ['tab:green']
-        title = 'Hyperbolic points (E = 0.06): separatrices'
-        print("Simulation of trajectory: separatrices")
+        if args.hyperbolic:
+            initial_conditions =  np.array([[0, 0.1563, 0.18876, -0.25]])
+            color = ['tab:green']
+            title = 'Hyperbolic points (E = 0.06): separatrices'
+            print("Simulation of trajectory: separatrices")
     
-    if args.all:
-        initial_conditions = np.array([[0, 0, -0.0428, -0.3438],[0, -0.1475, 0.3101, 0],[0, 0.1563, 0.18876, -0.25]])
-        color = ['tab:blue','tab:orange','tab:green']
-        title = 'All the 3 main initial conditions for E = 0.06'
-        print('All the 3 main initial conditions for E = 0.06')
+        if args.all:
+            initial_conditions = np.array([[0, 0, -0.0428, -0.3438],[0, -0.1475, 0.3101, 0],[0, 0.1563, 0.18876, -0.25]])
+            color = ['tab:blue','tab:orange','tab:green']
+            title = 'All the 3 main initial conditions for E = 0.06'
+            print('All the 3 main initial conditions for E = 0.06')
     
-    # Choose the integration algorithm
-    if args.rk2:
-        print("Integrate equations of motion using Runge-Kutta 2")
-        fig, axs = plt.subplots(1, 3, figsize=(15, 6), sharex=False, sharey=False)
-        for i in range(0,int(len(initial_conditions)),1):
-            result = henon_heiles(runge_kutta2,var,initial_conditions[i], t_values, dt)
-            pm.plot_henon_heiles(t_values,x=result[:,0], y=result[:,1], px=result[:,2], py=result[:,3],color=color[i],title=title,axs=axs)
-        plt.show()
-
-    if args.rk4:
-        print("Integrate equations of motion using Runge-Kutta 4")
-        fig, axs = plt.subplots(1, 3, figsize=(15, 6), sharex=False, sharey=False)
-        for i in range(0,int(len(initial_conditions)),1):
-            result = henon_heiles(runge_kutta4,var,initial_conditions[i], t_values, dt)
-            pm.plot_henon_heiles(t_values,x=result[:,0], y=result[:,1], px=result[:,2], py=result[:,3],color=color[i],title=title,axs=axs)
-        plt.show()
+        if args.energy is not None:
+            # Keep the (y, py) of the initial conditions on the x = 0 section and solve for px on the new energy shell
+            shell = on_energy_shell(args.energy, initial_conditions[:,1], initial_conditions[:,3], px_sign=initial_conditions[:,2])
+            if len(shell) != len(initial_conditions):
+                parser.error(f"The initial conditions have no real px at the energy {args.energy}")
+            initial_conditions = shell
+            title = title.replace('E = 0.06', f'E = {args.energy:.4g}')
+            print(f"Initial conditions moved to the energy {args.energy:.6g}")
+
+        # The energy monitor runs inside the loop of the generic single-step integration
+        monitored = args.energy_alert is not None or args.energy_abort is not None or args.energy_project is not None
+
+        times, time_step = t_values, dt
+        if args.auto is not None:
+            if args.kernel != "generic" or args.precision == "float32":
+                parser.error("--auto calibrates the generic float64 integration: it does not support --kernel or --precision float32")
+            import autoselect
+            # The multistep methods are not candidates when the options do not support them (see the checks below)
+            multistep_unsupported = args.stream or args.store or monitored
+            methods = [name for name in autoselect.AUTO_METHODS if not (name in ("abm", "stormer") and multistep_unsupported)]
+            duration = times[-1] - times[0]
+            choice = autoselect.select_method(initial_conditions, args.auto, duration, methods=methods)
+            time_step = choice['dt']
+            times = times[0] + np.arange(choice['num_steps'] + 1) * time_step
+            print(f"Automatic selection for a relative energy error of {args.auto:.1e}: --{choice['method']} with dt = {time_step:.4g} "
+                  f"({choice['num_steps']} steps, predicted error {choice['predicted_error']:.2e}, predicted time {choice['predicted_seconds']:.2f} s)")
+            if not choice['met']:
+                print("Warning: no method is predicted to meet the tolerance, using the most accurate one")
+            setattr(args, choice['method'], True)
+
+        # Choose the integration algorithm
+        if args.rk2:
+            print("Integrate equations of motion using Runge-Kutta 2")
+            integration_method = runge_kutta2
+
+        if args.rk4:
+            print("Integrate equations of motion using Runge-Kutta 4")
+            integration_method = runge_kutta4
     
-    if args.leapfrog:
-        print("Integrate equations of motion using Leap-Frog")
-        fig, axs = plt.subplots(1, 3, figsize=(15, 6), sharex=False, sharey=False)
-        for i in range(0,int(len(initial_conditions)),1):
-            result = henon_heiles(leap_frog,var,initial_conditions[i], t_values, dt)
-            pm.plot_henon_heiles(t_values,x=result[:,0], y=result[:,1], px=result[:,2], py=result[:,3],color=color[i],title=title,axs=axs)
-        plt.show()
+        if args.leapfrog:
+            print("Integrate equations of motion using Leap-Frog")
+            integration_method = leap_frog
     
-    if args.euler:
-        print("Integrate equations of motion using Euler")
-        fig, axs = plt.subplots(1, 3, figsize=(15, 6), sharex=False, sharey=False)
-        for i in range(0,int(len(initial_conditions)),1):
-            result = henon_heiles(euler,var,initial_conditions[i], t_values, dt)
-            pm.plot_henon_heiles(t_values,x=result[:,0], y=result[:,1], px=result[:,2], py=result[:,3],color=color[i],title=title,axs=axs)
-        plt.show()
+        if args.euler:
+            print("Integrate equations of motion using Euler")
+            integration_method = euler
+
+        if args.verlet:
+            print("Integrate equations of motion using velocity Verlet")
+            integration_method = velocity_verlet
+
+        if args.yoshida4:
+            print("Integrate equations of motion using Forest-Ruth/Yoshida 4")
+            integration_method = yoshida4
+
+        if args.yoshida6:
+            print("Integrate equations of motion using Yoshida 6")
+            integration_method = yoshida6
+
+        if args.yoshida8:
+            print("Integrate equations of motion using Yoshida 8")
+            integration_method = yoshida8
+
+        if args.dopri:
+            print("Integrate equations of motion using adaptive Dormand-Prince 5(4)")
+            integration_method = dormand_prince
+
+        if args.abm:
+            print("Integrate equations of motion using Adams-Bashforth-Moulton 4")
+            integration_method = adams_bashforth_moulton
+
+        if args.stormer:
+            print("Integrate equations of motion using Stormer-Cowell 4")
+            integration_method = stormer_cowell
+
+        if args.stream and integration_method == dormand_prince:
+            parser.error("--stream does not support the adaptive --dopri")
+
+        # The multistep methods keep a history of the integration, which the chunked and per-step paths do not carry
+        multistep = integration_method in (adams_bashforth_moulton, stormer_cowell)
+        if multistep and (args.stream or args.store or args.kernel != "generic" or args.precision == "float32"):
+            parser.error("--abm and --stormer do not support --stream, --store, --kernel or --precision float32")
+
+        if args.precision == "float32" and (args.stream or args.store or args.cache or args.kernel != "generic"
+                                            or integration_method in (leap_frog, dormand_prince)):
+            parser.error("--precision float32 does not support --stream, --store, --cache, --kernel, --leapfrog or --dopri")
+
+        if args.store and (args.stream or args.kernel != "generic" or integration_method == dormand_prince):
+            parser.error("--store does not support --stream, --kernel or --dopri")
+
+        if monitored and (args.store or args.cache or args.kernel != "generic" or args.precision == "float32"
+                          or multistep or integration_method == dormand_prince):
+            parser.error("--energy-alert, --energy-abort and --energy-project do not support --store, --cache, --kernel, "
+                         "--precision float32, --dopri, --abm or --stormer")
+        monitor = EnergyMonitor(alert=args.energy_alert, abort=args.energy_abort, project=args.energy_project) if monitored else None
+
+        if args.escape is not None and monitored:
+            parser.error("--escape does not support --energy-alert, --energy-abort or --energy-project")
+        escape_monitor = EscapeMonitor(radius=args.escape) if args.escape is not None else None
+
+        if args.kernel != "generic":
+            # The kernels module compiles its numba loops at import time
+            from kernels import henon_heiles_fused, FUSED_METHODS
+            if integration_method not in FUSED_METHODS:
+                parser.error(f"--kernel {args.kernel} is only available for --rk2, --rk4, --leapfrog and --euler")
+
+        if not args.headless:
+            import matplotlib.pyplot as plt
+            import poincare_maps as pm
+
+        # Integrate all the initial conditions together as a single ensemble
+        # (a lone orbit is integrated as a plain state vector, which is faster than a batch of one)
+        y0 = initial_conditions[0] if len(initial_conditions) == 1 else initial_conditions
+
+        with profiling.profile() if args.profile else nullcontext() as profiler, _exit_on_divergence():
+            if not args.headless:
+                fig, axs = plt.subplots(1, 3, figsize=(15, 6), sharex=False, sharey=False)
+
+            if args.stream:
+                if args.headless:
+                    # Only the running summaries of the stream are kept, in constant memory
+                    energy, section = EnergyStats(), SectionCrossings()
+                    stream = henon_heiles_stream(integration_method, var, y0, times[0], time_step, len(times), chunk_size=args.chunk_size,
+                                                 stride=args.stride, reducers=[energy, section], monitor=monitor,
+                                                 escape=escape_monitor)
+                    for _ in profiling.timed_iter(stream, 'integration'):
+                        pass
+                    data = {'section_t': section.t, 'section_points': section.points, 'section_orbit': section.orbit,
+                            'energy_initial': energy.initial, 'energy_drift': energy.max_relative_drift}
+                elif args.raster:
+                    # The chunks are binned as they arrive: the plot does not depend on the length of the run
+                    rasters = TrajectoryRasters(np.max(hamiltonian(initial_conditions)), len(initial_conditions), (times[0], times[-1]),
+                                                resolution=args.raster)
+                    stream = henon_heiles_stream(integration_method, var, y0, times[0], time_step, len(times), chunk_size=args.chunk_size,
+                                                 stride=args.stride, reducers=[rasters], monitor=monitor,
+                                                 escape=escape_monitor)
+                    for _ in profiling.timed_iter(stream, 'integration'):
+                        pass
+                    pm.plot_henon_heiles_raster(rasters, colors=color, title=title, axs=axs)
+                else:
+                    stream = henon_heiles_stream(integration_method, var, y0, times[0], time_step, len(times), chunk_size=args.chunk_size, stride=args.stride,
+                                                 monitor=monitor, escape=escape_monitor)
+                    pm.plot_henon_heiles_stream(stream, colors=color, title=title, axs=axs)
+            else:
+                t_plot = times
+                with profiling.phase('integration'):
+                    if args.store:
+                        method_name = next(name for name, method in METHODS.items() if method == integration_method)
+                        checkpoint = store.integrate_to_store(args.store, method_name, y0, times[0], time_step, len(times), stride=args.stride)
+                        print(f"Trajectory stored in {args.store} (step {checkpoint['step']} of {len(times) - 1})")
+                        t_plot, result = store.load_trajectory(args.store)
+                    elif integration_method == dormand_prince:
+                        result, stats = dormand_prince_solve(var, y0, times, time_step, rtol=args.rtol, atol=args.atol)
+                        print(f"Accepted steps: {stats['accepted']}, rejected steps: {stats['rejected']}, RHS evaluations: {stats['rhs_evaluations']}")
+                    elif args.precision == "float32":
+                        result, diagnostics = precision.henon_heiles_mixed(integration_method, var, y0, times, time_step)
+                        print(f"Mixed precision (float32, compensated): maximum relative energy error {np.max(diagnostics['energy_drift']):.3e}")
+                    elif args.kernel == "generic":
+                        if args.cache:
+                            result = cache.cached_henon_heiles(integration_method, var, y0, times, time_step)
+                        else:
+                            result = henon_heiles(integration_method,var,y0, times, time_step, monitor=monitor)
+                    else:
+                        backend = "auto" if args.kernel == "fused" else "numba"
+                        if args.cache:
+                            result = cache.cached(henon_heiles_fused, integration_method, y0, times, time_step, backend=backend)
+                        else:
+                            result = henon_heiles_fused(integration_method, y0, times, time_step, backend=backend)
+                result = result.reshape(len(t_plot), -1, 4)
+
+                if args.headless:
+                    with profiling.phase('section'):
+                        t_cross, points, orbit = find_crossings(t_plot, result)
+                    with profiling.phase('energy'):
+                        energy = hamiltonian(result)
+                    data = {'t': t_plot, 'trajectory': result, 'section_t': t_cross, 'section_points': points, 'section_orbit': orbit,
+                            'energy': energy, 'energy_drift': np.max(np.abs(energy / energy[0] - 1), axis=0)}
+                elif args.raster:
+                    rasters = TrajectoryRasters(np.max(hamiltonian(initial_conditions)), len(initial_conditions), (t_plot[0], t_plot[-1]),
+                                                resolution=args.raster)
+                    with profiling.phase('rasterizing'):
+                        rasters.update(t_plot, result)
+                    pm.plot_henon_heiles_raster(rasters, colors=color, title=title, axs=axs)
+                else:
+                    for i in range(0,int(len(initial_conditions)),1):
+                        pm.plot_henon_heiles(t_plot,x=result[:,i,0], y=result[:,i,1], px=result[:,i,2], py=result[:,i,3],color=color[i],title=title,axs=axs)
+
+            if args.periodic_orbits:
+                energy = np.mean(hamiltonian(initial_conditions))
+                with profiling.phase('periodic_orbits'):
+                    orbits = periodic_orbits(energy, multiplicities=tuple(range(1, args.periodic_orbits + 1)))
+                print(f"Periodic orbits at E = {energy:.6g}: {len(orbits['period'])} ({np.sum(orbits['stable'])} stable, "
+                      f"{np.sum(~orbits['stable'])} unstable)")
+                if args.headless:
+                    data.update({'periodic_points': orbits['section_points'], 'periodic_orbit': orbits['section_orbit'],
+                                 'periodic_period': orbits['period'], 'periodic_stable': orbits['stable']})
+                else:
+                    pm.plot_periodic_orbits(axs[1], orbits)
+
+            if escape_monitor is not None:
+                escapes = escape_monitor.results
+                print(f"Escapes: {np.sum(escapes['escaped'])} of {len(escapes['escaped'])} orbits"
+                      + (f", first at t = {np.nanmin(escapes['time']):.6g}" if escapes['escaped'].any() else ""))
+                if args.headless:
+                    data.update({f'escape_{name}': value for name, value in escapes.items()})
+
+            if monitor is not None:
+                summary = monitor.summary()
+                print(f"Energy monitor: maximum relative drift {np.max(summary['max_drift']):.3e}, mean {np.max(np.abs(summary['mean_drift'])):.3e}, "
+                      f"trend {np.max(np.abs(summary['drift_slope'])):.3e} per unit time, {np.sum(summary['projections'])} projections")
+                if args.headless:
+                    data.update({f'monitor_{name}': value for name, value in summary.items()})
+
+            if args.cache:
+                stats = cache.cache_stats()
+                print(f"Cache: {stats['memory_hits']} memory hits, {stats['disk_hits']} disk hits, {stats['misses']} misses")
+
+            if args.headless:
+                print(f"Section points: {len(data['section_t'])}, maximum relative energy drift: {np.max(data['energy_drift']):.3e}")
+                if args.output:
+                    with profiling.phase('output'):
+                        _write_output(args.output, data, data_output)
+            elif profiler is not None:
+                # Matplotlib only renders the artists when the figure is drawn
+                with profiling.phase('rendering'):
+                    fig.canvas.draw()
+
+        if profiler is not None:
+            if args.profile == "-":
+                print(profiler.to_json())
+            else:
+                with open(args.profile, "w") as file:
+                    file.write(profiler.to_json())
+                print(f"Profile saved to {args.profile}")
+
+        if not args.headless:
+            plt.show()
 
 if __name__ == "__main__":
     main()
@@ -1,14 +1,44 @@
-import numpy as np
+import asyncio
+import importlib.util
 import io
+import json
+import os
+import subprocess
 import sys
-import matplotlib
+import tempfile
+import time
 import unittest
-from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import AsyncMock, MagicMock, patch
 
-from henon_heiles import main
-from henon_heiles import henon_heiles as hh
+import matplotlib
+import numpy as np
+
+import adaptive
+import autoselect
+import benchmarks
+import cache
+import chaos
+import energy_monitor
+import escape
+import frequency
+import initial_conditions
 import integration_methods as im
-from var import equations_motion
+import kernels
+import multistep
+import periodic_orbits
+import potential
+import precision
+import profiling
+import raster
+import reducers
+import sections
+import service
+import store
+import sweep
+from henon_heiles import henon_heiles as hh
+from henon_heiles import main
+from var import equations_motion, hamiltonian, variational_equations
 
 matplotlib.use('Agg')
     
@@ -180,13 +210,9 @@ class TestSymplecticity(unittest.TestCase):
         """
         # Integrate using your chosen method (e.g., Runge-Kutta 4)
         result = hh(im.runge_kutta4, equations_motion, self.y0, self.t_values, self.dt)
-        x = result[:,0]
-        y = result[:,1]
-        px = result[:,2]
-        py = result[:,3]
 
         # Calculate total energy
-        H = (px**2) / 2 + (py**2) / 2 + (x**2) / 2 + (y**2) / 2 + x**2 * y - (1/3) * y**3
+        H = hamiltonian(result)
 
         # Check if the energy is within the desired range
         self.assertTrue((H >= 0).all() and (H <= 1/6).all())
@@ -208,17 +234,13 @@ class TestSymplecticity(unittest.TestCase):
         None
         """
         # Calculate the initial energy of the system
-        initial_energy = (self.y0[2]**2) / 2 + (self.y0[3]**2) / 2 + (self.y0[0]**2) / 2 + (self.y0[1]**2) / 2 + self.y0[0]**2 * self.y0[1] - (1/3) * self.y0[1]**3
+        initial_energy = hamiltonian(self.y0)
 
         # Perform Leap-Frog integration
         result = hh(im.leap_frog, equations_motion, self.y0, self.t_values, self.dt)
-        x = result[:,0]
-        y = result[:,1]
-        px = result[:,2]
-        py = result[:,3]
 
         # Calculate the energy at each step and compare to the initial energy
-        energy = (px**2) / 2 + (py**2) / 2 + (x**2) / 2 + (y**2) / 2 + x**2 * y - (1/3) * y**3
+        energy = hamiltonian(result)
         self.assertAlmostEqual(initial_energy, energy[-1], places=8)
         
     def test_double_time_duration(self):
@@ -243,17 +265,13 @@ class TestSymplecticity(unittest.TestCase):
         """
         
         # Calculate the initial energy of the system
-        initial_energy = (self.y0[2]**2) / 2 + (self.y0[3]**2) / 2 + (self.y0[0]**2) / 2 + (self.y0[1]**2) / 2 + self.y0[0]**2 * self.y0[1] - (1/3) * self.y0[1]**3
+        initial_energy = hamiltonian(self.y0)
 
         # Perform Leap-Frog integration
         result = hh(im.leap_frog, equations_motion, self.y0, self.t_values_double, self.dt_double)
-        x = result[:,0]
-        y = result[:,1]
-        px = result[:,2]
-        py = result[:,3]
 
         # Calculate the energy at each step and compare to the initial energy
-        energy = (px**2) / 2 + (py**2) / 2 + (x**2) / 2 + (y**2) / 2 + x**2 * y - (1/3) * y**3
+        energy = hamiltonian(result)
         self.assertAlmostEqual(initial_energy, energy[-1], places=7)
         
     def test_double_step_size(self):
@@ -276,18 +294,1403 @@ class TestSymplecticity(unittest.TestCase):
             None
         """
         # Calculate the initial energy of the system
-        initial_energy = (self.y0[2]**2) / 2 + (self.y0[3]**2) / 2 + (self.y0[0]**2) / 2 + (self.y0[1]**2) / 2 + self.y0[0]**2 * self.y0[1] - (1/3) * self.y0[1]**3
+        initial_energy = hamiltonian(self.y0)
 
         # Perform Leap-Frog integration
         result = hh(im.leap_frog, equations_motion, self.y0, self.t_values_half, self.dt_half)
-        x = result[:,0]
-        y = result[:,1]
-        px = result[:,2]
-        py = result[:,3]
 
         # Calculate the energy at each step and compare to the initial energy
-        energy = (px**2) / 2 + (py**2) / 2 + (x**2) / 2 + (y**2) / 2 + x**2 * y - (1/3) * y**3
+        energy = hamiltonian(result)
         self.assertAlmostEqual(initial_energy, energy[-1], places=7)
 
+class TestEnsemble(unittest.TestCase):
+    def setUp(self):
+        self.initial_conditions = np.array([[0, 0, -0.0428, -0.3438],[0, -0.1475, 0.3101, 0],[0, 0.1563, 0.18876, -0.25]])
+        self.t_values = np.linspace(0, 1, 1001)
+        self.dt = self.t_values[1] - self.t_values[0]
+
+    def test_batched_equations_motion(self):
+        """
+        Test that the batched equations of motion match the single-orbit ones row by row.
+        """
+        derivatives = equations_motion(0.0, self.initial_conditions)
+        self.assertEqual(derivatives.shape, self.initial_conditions.shape)
+        for i in range(len(self.initial_conditions)):
+            np.testing.assert_allclose(derivatives[i], equations_motion(0.0, self.initial_conditions[i]))
+
+    def test_ensemble_matches_single_orbits(self):
+        """
+        Test that integrating an ensemble of orbits in one pass gives the same trajectories as integrating them one at a time.
+        """
+        for method in [im.runge_kutta2, im.runge_kutta4, im.leap_frog, im.euler]:
+            result = hh(method, equations_motion, self.initial_conditions, self.t_values, self.dt)
+            self.assertEqual(result.shape, (len(self.t_values),) + self.initial_conditions.shape)
+            for i in range(len(self.initial_conditions)):
+                single = hh(method, equations_motion, self.initial_conditions[i], self.t_values, self.dt)
+                np.testing.assert_allclose(result[:,i], single, rtol=1e-12, atol=1e-14)
+
+class TestFusedKernels(unittest.TestCase):
+    def setUp(self):
+        self.initial_conditions = np.array([[0, 0, -0.0428, -0.3438],[0, -0.1475, 0.3101, 0],[0, 0.1563, 0.18876, -0.25]])
+        self.t_values = np.linspace(0, 1, 1001)
+        self.dt = self.t_values[1] - self.t_values[0]
+
+    def test_fused_matches_generic(self):
+        """
+        Test that the allocation-free kernels reproduce the generic integration path for every method.
+        """
+        for method in [im.runge_kutta2, im.runge_kutta4, im.leap_frog, im.euler]:
+            for y0 in [self.initial_conditions[1], self.initial_conditions]:
+                expected = hh(method, equations_motion, y0, self.t_values, self.dt)
+                for backend in ['numpy', 'auto']:
+                    result = kernels.henon_heiles_fused(method, y0, self.t_values, self.dt, backend=backend)
+                    np.testing.assert_allclose(result, expected, rtol=1e-12, atol=1e-14)
+
+    def test_fused_resume(self):
+        """
+        Test that a Leap-Frog run resumed from its last two states continues the uninterrupted run.
+        """
+        expected = kernels.henon_heiles_fused(im.leap_frog, self.initial_conditions, self.t_values, self.dt, backend='numpy')
+        for backend in ['numpy', 'auto']:
+            for y0 in [self.initial_conditions[1], self.initial_conditions]:
+                full = kernels.henon_heiles_fused(im.leap_frog, y0, self.t_values, self.dt, backend=backend)
+                resumed = kernels.henon_heiles_fused(im.leap_frog, full[500], self.t_values[500:], self.dt, backend=backend,
+                                                     y_prev=full[499])
+                np.testing.assert_allclose(resumed, full[500:], rtol=1e-12, atol=1e-14)
+        np.testing.assert_allclose(full, expected, rtol=1e-12, atol=1e-14)
+
+    def test_auto_backend(self):
+        """
+        Test the path taken by the 'auto' backend: numba when it is installed, otherwise the NumPy kernels for an
+        ensemble and the generic path for a lone orbit (on which the NumPy kernels are slower).
+        """
+        cases = [(MagicMock(), self.initial_conditions[1], '_compiled_loops'), (MagicMock(), self.initial_conditions, '_compiled_loops'),
+                 (None, self.initial_conditions, '_henon_heiles_numpy'), (None, self.initial_conditions[1], 'henon_heiles')]
+        for numba, y0, path in cases:
+            with patch.object(kernels, 'numba', numba), patch.object(kernels, path) as taken:
+                kernels.henon_heiles_fused(im.runge_kutta4, y0, self.t_values[:10], self.dt)
+            self.assertTrue(taken.called or taken.__getitem__.called, f"{path} (numba: {numba is not None}, shape {y0.shape})")
+
+    @unittest.skipIf(kernels.numba is None, "numba is not installed")
+    def test_numba_matches_generic(self):
+        """
+        Test that the JIT-compiled kernels reproduce the generic integration path for every method.
+        """
+        for method in [im.runge_kutta2, im.runge_kutta4, im.leap_frog, im.euler]:
+            expected = hh(method, equations_motion, self.initial_conditions, self.t_values, self.dt)
+            result = kernels.henon_heiles_fused(method, self.initial_conditions, self.t_values, self.dt, backend='numba')
+            np.testing.assert_allclose(result, expected, rtol=1e-12, atol=1e-14)
+
+    def test_equations_motion_into(self):
+        """
+        Test that the in-place right-hand side matches equations_motion.
+        """
+        out = np.empty_like(self.initial_conditions)
+        kernels.equations_motion_into(self.initial_conditions, out)
+        np.testing.assert_allclose(out, equations_motion(0.0, self.initial_conditions))
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.initial_conditions = np.array([[0, 0, -0.0428, -0.3438],[0, -0.1475, 0.3101, 0],[0, 0.1563, 0.18876, -0.25]])
+        self.t_values = np.linspace(0, 10, 10001)
+        self.dt = self.t_values[1] - self.t_values[0]
+
+    def test_stream_matches_henon_heiles(self):
+        """
+        Test that the concatenated chunks reproduce the full trajectory, with and without decimation.
+        """
+        for method in [im.runge_kutta4, im.leap_frog]:
+            expected = hh(method, equations_motion, self.initial_conditions, self.t_values, self.dt)
+            for stride in [1, 7]:
+                chunks = list(im.henon_heiles_stream(method, equations_motion, self.initial_conditions, 0.0, self.dt, len(self.t_values), chunk_size=333, stride=stride))
+                self.assertTrue(all(len(t) <= 333 for t, _ in chunks))
+                t = np.concatenate([t for t, _ in chunks])
+                y = np.concatenate([y for _, y in chunks])
+                np.testing.assert_allclose(t, self.t_values[::stride], atol=1e-12)
+                np.testing.assert_allclose(y, expected[::stride], rtol=1e-9, atol=1e-12)
+
+    def test_reducers(self):
+        """
+        Test the running energy statistics and the section crossings collected from the stream.
+        """
+        energy = reducers.EnergyStats()
+        section = reducers.SectionCrossings()
+        for _ in im.henon_heiles_stream(im.runge_kutta4, equations_motion, self.initial_conditions, 0.0, self.dt, len(self.t_values), chunk_size=1000, reducers=[energy, section]):
+            pass
+
+        result = hh(im.runge_kutta4, equations_motion, self.initial_conditions, self.t_values, self.dt)
+        H = hamiltonian(result)
+        np.testing.assert_allclose(energy.mean, H.mean(axis=0))
+        np.testing.assert_allclose(energy.maximum, H.max(axis=0))
+        self.assertEqual(energy.count, len(self.t_values))
+        self.assertTrue((energy.max_relative_drift < 1e-8).all())
+
+        # Every crossing lies on the x = 0 plane and is counted once per sign change of x
+        np.testing.assert_allclose(section.points[:,0], 0, atol=1e-12)
+        x = result[..., 0]
+        self.assertEqual(len(section.t), ((x[:-1] < 0) & (x[1:] >= 0)).sum())
+        self.assertTrue((section.points[:,2] > 0).all())
+
+class TestSections(unittest.TestCase):
+    def setUp(self):
+        self.y0 = np.array([0.0, -0.1475, 0.3101, 0.0])
+        self.t_fine = np.linspace(0, 50, 100001)
+        self.t_coarse = np.linspace(0, 50, 1001)
+
+    def test_crossings_on_coarse_grid(self):
+        """
+        Test that the interpolated crossings of a coarse trajectory match those of a fine one.
+        """
+        fine = hh(im.runge_kutta4, equations_motion, self.y0, self.t_fine, self.t_fine[1])
+        t_ref, points_ref, _ = sections.find_crossings(self.t_fine, fine, method='henon')
+
+        coarse = hh(im.runge_kutta4, equations_motion, self.y0, self.t_coarse, self.t_coarse[1])
+        for method in ['hermite', 'henon']:
+            t_cross, points, orbit = sections.find_crossings(self.t_coarse, coarse, method=method)
+            self.assertEqual(len(t_cross), len(t_ref))
+            np.testing.assert_allclose(points[:,0], 0)
+            np.testing.assert_allclose(t_cross, t_ref, atol=1e-4)
+            np.testing.assert_allclose(points, points_ref, atol=1e-5)
+            self.assertTrue((points[:,2] > 0).all())
+            self.assertTrue((orbit == 0).all())
+
+    def test_direction_filter(self):
+        """
+        Test that the direction filter keeps the crossings with the requested sign of px.
+        """
+        coarse = hh(im.runge_kutta4, equations_motion, self.y0, self.t_coarse, self.t_coarse[1])
+        _, forward, _ = sections.find_crossings(self.t_coarse, coarse, direction=1)
+        _, backward, _ = sections.find_crossings(self.t_coarse, coarse, direction=-1)
+        _, both, _ = sections.find_crossings(self.t_coarse, coarse, direction=0)
+        self.assertTrue((forward[:,2] > 0).all())
+        self.assertTrue((backward[:,2] < 0).all())
+        self.assertEqual(len(both), len(forward) + len(backward))
+
+    def test_section_during_integration(self):
+        """
+        Test that the event-driven section of an ensemble matches the section of each stored trajectory.
+        """
+        ensemble = np.array([self.y0, [0, 0, -0.0428, -0.3438]])
+        t_cross, points, orbit = sections.henon_heiles_section(im.runge_kutta4, equations_motion, ensemble, 0.0, self.t_coarse[1], len(self.t_coarse), chunk_size=100)
+        for i in range(len(ensemble)):
+            trajectory = hh(im.runge_kutta4, equations_motion, ensemble[i], self.t_coarse, self.t_coarse[1])
+            expected_t, expected_points, _ = sections.find_crossings(self.t_coarse, trajectory, method='henon')
+            np.testing.assert_allclose(t_cross[orbit == i], expected_t)
+            np.testing.assert_allclose(points[orbit == i], expected_points)
+
+class TestSplittingIntegrators(unittest.TestCase):
+    def setUp(self):
+        self.y0 = np.array([0.0, -0.1475, 0.3101, 0.0])
+        self.methods = {im.velocity_verlet: 2, im.yoshida4: 4, im.yoshida6: 6, im.yoshida8: 8}
+
+    def test_order_of_convergence(self):
+        """
+        Test the order of the splitting integrators by Richardson extrapolation on successively halved step sizes.
+        """
+        for method, order in self.methods.items():
+            final = []
+            for n in [20, 40, 80]:
+                t_values = np.linspace(0, 10, n + 1)
+                final.append(hh(method, equations_motion, self.y0, t_values, t_values[1])[-1])
+            ratio = np.abs(final[0] - final[1]).max() / np.abs(final[1] - final[2]).max()
+            self.assertAlmostEqual(np.log2(ratio), order, delta=0.6)
+
+    def test_bounded_energy_error_at_large_step(self):
+        """
+        Test that the symplectic integrators keep the energy error bounded over a long run with a large step, where
+        Runge-Kutta 4 drifts.
+        """
+        t_values = np.linspace(0, 2000, 20001)
+        energy_error = {}
+        for method in [im.runge_kutta4, im.yoshida4, im.yoshida6]:
+            H = hamiltonian(hh(method, equations_motion, self.y0, t_values, t_values[1]))
+            energy_error[method] = np.abs(H / H[0] - 1)
+        self.assertLess(energy_error[im.yoshida4].max(), 1e-5)
+        self.assertLess(energy_error[im.yoshida6].max(), 1e-7)
+        self.assertGreater(energy_error[im.runge_kutta4][-1], 10 * energy_error[im.yoshida4].max())
+
+    def test_force_only(self):
+        """
+        Test that the splitting integrators only use the force components of the right-hand side.
+        """
+        def force_only(t, y):
+            derivatives = equations_motion(t, y)
+            derivatives[..., :2] = np.nan
+            return derivatives
+
+        for method in self.methods:
+            expected = method(equations_motion, 0.0, self.y0, 0.1)
+            np.testing.assert_allclose(method(force_only, 0.0, self.y0, 0.1), expected)
+
+class TestAdaptive(unittest.TestCase):
+    def setUp(self):
+        self.y0 = np.array([0.0, -0.1475, 0.3101, 0.0])
+        self.t_values = np.linspace(0, 50, 20001)
+        self.reference = hh(im.runge_kutta4, equations_motion, self.y0, self.t_values, self.t_values[1])
+
+    def test_tolerance_control(self):
+        """
+        Test that the dense output meets the requested tolerance and that tighter tolerances take more steps.
+        """
+        t_values = self.t_values[::40]
+        previous_steps = 0
+        for rtol in [1e-6, 1e-9]:
+            result, stats = adaptive.dormand_prince_solve(equations_motion, self.y0, t_values, 0.01, rtol=rtol, atol=rtol*1e-2)
+            self.assertLess(np.abs(result - self.reference[::40]).max(), 100 * rtol)
+            self.assertGreater(stats['accepted'], previous_steps)
+            self.assertGreater(stats['rhs_evaluations'], 6 * stats['accepted'])
+            previous_steps = stats['accepted']
+
+    def test_henon_heiles_entry_point(self):
+        """
+        Test that henon_heiles dispatches to the adaptive integration for dormand_prince, for orbits and ensembles.
+        """
+        t_values = self.t_values[::400]
+        result = hh(adaptive.dormand_prince, equations_motion, np.array([self.y0, self.y0]), t_values, 0.01, rtol=1e-10, atol=1e-12)
+        self.assertEqual(result.shape, (len(t_values), 2, 4))
+        np.testing.assert_allclose(result[:,1], self.reference[::400], atol=1e-8)
+
+    def test_dense_section(self):
+        """
+        Test that the section crossings located on the dense output match those of a fine fixed-step trajectory.
+        """
+        t_ref, points_ref, _ = sections.find_crossings(self.t_values, self.reference, method='henon')
+        t_cross, points, orbit = adaptive.dormand_prince_section(equations_motion, self.y0, 0, 50, 0.01, rtol=1e-10, atol=1e-12)
+        self.assertEqual(len(t_cross), len(t_ref))
+        np.testing.assert_allclose(t_cross, t_ref, atol=1e-7)
+        np.testing.assert_allclose(points, points_ref, atol=1e-7)
+
+class TestSweep(unittest.TestCase):
+    def test_section_grid_on_energy_shell(self):
+        """
+        Test that the grid initial conditions lie on the x = 0 section and on the energy shell.
+        """
+        for energy in [1/12, 1/8, 1/6]:
+            grid = initial_conditions.section_grid(energy, 15, 15)
+            self.assertGreater(len(grid), 0)
+            self.assertLessEqual(len(grid), 15 * 15)
+            np.testing.assert_allclose(grid[:,0], 0)
+            self.assertTrue((grid[:,2] >= 0).all())
+            np.testing.assert_allclose(hamiltonian(grid), energy)
+
+    def test_quasi_random_samplings(self):
+        """
+        Test the Halton and boundary-refined samplings of the section: points on the energy shell, chunked generation
+        identical to the whole sample, and cached per energy.
+        """
+        np.testing.assert_allclose(initial_conditions.halton(0, 4), [[1/2, 1/3], [1/4, 2/3], [3/4, 1/9], [1/8, 4/9]])
+        for sampling in ['halton', 'boundary']:
+            samples = initial_conditions.section_samples(1/8, 500, sampling)
+            np.testing.assert_allclose(samples[:,0], 0)
+            np.testing.assert_allclose(hamiltonian(samples), 1/8)
+            chunks = list(initial_conditions.section_chunks(1/8, 500, sampling, chunk_size=64))
+            self.assertEqual(len(chunks), 8)
+            np.testing.assert_array_equal(np.concatenate(chunks), samples)
+            self.assertIs(initial_conditions.section_samples(1/8, 500, sampling), samples)
+            self.assertFalse(samples.flags.writeable)
+
+        # The boundary-refined sampling keeps every point, with smaller px on average than a uniform sampling
+        boundary = initial_conditions.section_samples(1/8, 500, 'boundary')
+        self.assertEqual(len(boundary), 500)
+        self.assertLess(np.median(boundary[:,2]), np.median(initial_conditions.section_samples(1/8, 500, 'halton')[:,2]))
+
+    @unittest.skipUnless(importlib.util.find_spec('scipy'), "requires scipy")
+    def test_sobol_sampling(self):
+        """
+        Test the Sobol sampling of the section.
+        """
+        samples = initial_conditions.section_samples(1/8, 512, 'sobol', seed=1)
+        np.testing.assert_allclose(hamiltonian(samples), 1/8)
+
+    def test_energy_option(self):
+        """
+        Test that --energy moves the initial conditions to the requested energy shell, keeping the sign of px.
+        """
+        shell = initial_conditions.on_energy_shell(0.1, np.array([0, -0.1475]), np.array([-0.3438, 0]), px_sign=np.array([-0.0428, 0.3101]))
+        np.testing.assert_allclose(hamiltonian(shell), 0.1)
+        self.assertTrue(shell[0, 2] < 0 < shell[1, 2])
+        with patch.object(sys.modules['henon_heiles'], 't_values', np.linspace(0, 1, 1001)):
+            output = run_henon_heiles(["--outer", "--rk4", "--energy", "0.1", "--headless"])
+        self.assertIn("Initial conditions moved to the energy 0.1", output)
+        self.assertIn("maximum relative energy drift", output)
+
+    def test_parallel_sweep_matches_serial(self):
+        """
+        Test that the sections collected from the process pool match the section of each orbit integrated serially.
+        """
+        energies = [1/12, 1/8]
+        results = sweep.sweep(energies, 3, 3, method='rk4', dt=0.05, t_end=20, workers=2, chunk_size=2)
+        self.assertEqual(list(results), energies)
+        for energy in energies:
+            points, orbit = results[energy]
+            grid = initial_conditions.section_grid(energy, 3, 3)
+            for i in range(len(grid)):
+                _, expected, _ = sections.henon_heiles_section(im.runge_kutta4, equations_motion, grid[i], 0.0, 0.05, 401)
+                np.testing.assert_allclose(points[orbit == i], expected[:, [1, 3]])
+
+    def test_sweep_subcommand(self):
+        """
+        Test that the sweep subcommand of the command line runs and reports every energy.
+        """
+        output = run_henon_heiles(["sweep", "--energies", "1/12", "0.1", "--grid", "2", "2", "--time", "5", "--workers", "1"])
+        self.assertIn("E = 0.0833333", output)
+        self.assertIn("E = 0.1:", output)
+
+class TestStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+        self.y0 = np.array([[0, -0.1475, 0.3101, 0],[0, 0, -0.0428, -0.3438]])
+        self.t_values = np.linspace(0, 10, 1001)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_resume_after_interruption(self):
+        """
+        Test that a run interrupted after a checkpoint resumes exactly where it stopped, for one-step and two-step methods.
+        """
+        for method in ['rk4', 'leapfrog']:
+            path = f'{self.path}/{method}'
+            expected = hh(im.METHODS[method], equations_motion, self.y0, self.t_values, 0.01)
+
+            # Interrupt the run right after its third checkpoint
+            write_checkpoint = store._write_checkpoint
+            calls = []
+            def interrupt(path, checkpoint):
+                write_checkpoint(path, checkpoint)
+                calls.append(checkpoint['step'])
+                if len(calls) == 3:
+                    raise KeyboardInterrupt
+            with patch.object(store, '_write_checkpoint', interrupt):
+                with self.assertRaises(KeyboardInterrupt):
+                    store.integrate_to_store(path, method, self.y0, 0.0, 0.01, len(self.t_values), stride=3, chunk_size=70)
+            self.assertFalse(store.load_checkpoint(path)['done'])
+
+            checkpoint = store.integrate_to_store(path, method, self.y0, 0.0, 0.01, len(self.t_values), stride=3, chunk_size=70)
+            self.assertTrue(checkpoint['done'])
+            t, y = store.load_trajectory(path)
+            np.testing.assert_allclose(t, self.t_values[::3], atol=1e-12)
+            np.testing.assert_array_equal(y, expected[::3])
+
+            t_cross, points, orbit = store.load_section(path)
+            expected_t, expected_points, expected_orbit = sections.find_crossings(self.t_values, expected)
+            order = np.lexsort((t_cross, orbit))
+            expected_order = np.lexsort((expected_t, expected_orbit))
+            np.testing.assert_allclose(points[order], expected_points[expected_order])
+
+    def test_time_window(self):
+        """
+        Test that a time window of the stored trajectory is a memory-mapped view of the requested samples.
+        """
+        store.integrate_to_store(self.path, 'rk4', self.y0[0], 0.0, 0.01, len(self.t_values))
+        t, y = store.load_trajectory(self.path, 2.0, 3.0)
+        self.assertIsInstance(y, np.memmap)
+        np.testing.assert_allclose(t, self.t_values[200:301])
+        np.testing.assert_allclose(y, hh(im.runge_kutta4, equations_motion, self.y0[0], self.t_values, 0.01)[200:301])
+
+    def test_different_run_rejected(self):
+        """
+        Test that a store cannot be resumed with different run parameters.
+        """
+        store.integrate_to_store(self.path, 'rk4', self.y0[0], 0.0, 0.01, 101)
+        with self.assertRaises(ValueError):
+            store.integrate_to_store(self.path, 'rk2', self.y0[0], 0.0, 0.01, 101)
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.environment = patch.dict(os.environ, {'HENON_HEILES_CACHE': self.directory.name})
+        self.environment.start()
+        cache.clear_cache()
+        self.y0 = np.array([0, -0.1475, 0.3101, 0])
+        self.t_values = np.linspace(0, 1, 1001)
+
+    def tearDown(self):
+        cache.clear_cache()
+        self.environment.stop()
+        self.directory.cleanup()
+
+    def test_memory_and_disk_layers(self):
+        """
+        Test that repeated integrations are served from memory, then from disk once the process layer is cleared.
+        """
+        expected = hh(im.runge_kutta4, equations_motion, self.y0, self.t_values, 0.001)
+        first = cache.cached_henon_heiles(im.runge_kutta4, equations_motion, self.y0, self.t_values, 0.001)
+        second = cache.cached_henon_heiles(im.runge_kutta4, equations_motion, self.y0, self.t_values, 0.001)
+        self.assertIs(first, second)
+        self.assertFalse(second.flags.writeable)
+        np.testing.assert_array_equal(first, expected)
+        self.assertEqual(cache.cache_stats(), {'memory_hits': 1, 'disk_hits': 0, 'misses': 1})
+
+        cache.clear_cache()
+        third = cache.cached_henon_heiles(im.runge_kutta4, equations_motion, list(self.y0), self.t_values, 0.001)
+        np.testing.assert_array_equal(third, expected)
+        self.assertEqual(cache.cache_stats(), {'memory_hits': 0, 'disk_hits': 1, 'misses': 0})
+
+    def test_key_depends_on_every_input(self):
+        """
+        Test that changing the method, the initial conditions, the time grid or the step size is a cache miss.
+        """
+        cache.cached_henon_heiles(im.runge_kutta4, equations_motion, self.y0, self.t_values, 0.001)
+        cache.cached_henon_heiles(im.runge_kutta2, equations_motion, self.y0, self.t_values, 0.001)
+        cache.cached_henon_heiles(im.runge_kutta4, equations_motion, self.y0 * 0.5, self.t_values, 0.001)
+        cache.cached_henon_heiles(im.runge_kutta4, equations_motion, self.y0, self.t_values[:500], 0.001)
+        cache.cached_henon_heiles(im.runge_kutta4, equations_motion, self.y0, self.t_values, 0.002)
+        self.assertEqual(cache.cache_stats()['misses'], 5)
+
+    def test_key_depends_on_source(self):
+        """
+        Test that the keys change with the cache version, with the source of the module of a cached function (its
+        helpers and constants, not only its bytecode) and with the source of the numerical core.
+        """
+        key = cache.cache_key(im.yoshida4, self.y0)
+        with patch.object(cache, 'CACHE_VERSION', cache.CACHE_VERSION + 1):
+            self.assertNotEqual(cache.cache_key(im.yoshida4, self.y0), key)
+
+        digests = {'integration_methods': 'edited', 'var': cache._module_digest('var')}
+        with patch.object(cache, '_module_digest', lambda name: digests.get(name, '')):
+            self.assertNotEqual(cache.cache_key(im.yoshida4, self.y0), key)
+
+        with open(os.path.join(self.directory.name, 'cached_module.py'), 'w') as file:
+            file.write("WEIGHT = 1.0\ndef scaled(x):\n    return WEIGHT * x\n")
+        sys.path.insert(0, self.directory.name)
+        try:
+            import cached_module
+            before = cache.cache_key(cached_module.scaled)
+            with open(cached_module.__file__, 'w') as file:
+                file.write("WEIGHT = 2.0\ndef scaled(x):\n    return WEIGHT * x\n")
+            cache._module_digest.cache_clear()
+            self.assertNotEqual(cache.cache_key(cached_module.scaled), before)
+        finally:
+            sys.path.remove(self.directory.name)
+            sys.modules.pop('cached_module', None)
+            cache._module_digest.cache_clear()
+
+    def test_disk_eviction(self):
+        """
+        Test that the on-disk layer evicts the least recently used entries beyond its size limit.
+        """
+        with patch.object(cache, 'DISK_LIMIT', 100000):
+            for i in range(5):
+                cache.cached_henon_heiles(im.euler, equations_motion, self.y0 * (1 + i), self.t_values, 0.001)
+        sizes = [os.path.getsize(os.path.join(self.directory.name, name)) for name in os.listdir(self.directory.name)]
+        self.assertLessEqual(sum(sizes), 100000)
+        self.assertGreater(len(sizes), 0)
+
+    def test_cli_reports_hits(self):
+        """
+        Test that a repeated command line run is served from the cache and reports it.
+        """
+        with patch.object(sys.modules['henon_heiles'], 't_values', self.t_values):
+            output = run_henon_heiles(["--torus", "--euler", "--cache"])
+            self.assertIn("Cache: 0 memory hits, 0 disk hits, 1 misses", output)
+            output = run_henon_heiles(["--torus", "--euler", "--cache"])
+            self.assertIn("Cache: 1 memory hits, 0 disk hits, 1 misses", output)
+
+class TestChaosIndicators(unittest.TestCase):
+    def test_variational_equations(self):
+        """
+        Test the tangent map against finite differences of the equations of motion.
+        """
+        y = np.array([[0.1, -0.2, 0.3, 0.05], [0.0, 0.4, -0.1, 0.2]])
+        w = np.random.default_rng(1).normal(size=(2, 3, 4))
+        eps = 1e-7
+        expected = (equations_motion(0.0, y[:, np.newaxis] + eps * w) - equations_motion(0.0, y[:, np.newaxis] - eps * w)) / (2 * eps)
+        np.testing.assert_allclose(variational_equations(0.0, y, w), expected, atol=1e-7)
+
+    def test_regular_and_chaotic_orbits(self):
+        """
+        Test that a chaotic orbit above the escape energy is retired early with a positive Lyapunov exponent, while a
+        regular orbit runs to the end with a non-vanishing SALI.
+        """
+        y0 = initial_conditions.on_energy_shell(1/6, np.array([-0.1, 0.5]), np.array([0.0, 0.0]))
+        result = chaos.chaos_indicators(y0, 0.05, 5000)
+        chaotic, regular = 0, 1
+        self.assertTrue(result['chaotic'][chaotic])
+        self.assertLess(result['time'][chaotic], 250)
+        self.assertLess(result['sali'][chaotic], 1e-8)
+        self.assertGreater(result['mle'][chaotic], 0.05)
+        self.assertGreater(result['fli'][chaotic], 15)
+
+        self.assertFalse(result['chaotic'][regular])
+        self.assertEqual(result['time'][regular], 250)
+        self.assertGreater(result['sali'][regular], 1e-2)
+        self.assertLess(result['mle'][regular], 0.02)
+
+class TestBenchmarks(unittest.TestCase):
+    def test_throughput_metrics(self):
+        """
+        Test that the throughputs count the right number of right-hand side evaluations per step.
+        """
+        results = benchmarks.benchmark_methods(num_steps=200, repeat=1, methods=['rk4', 'leapfrog', 'yoshida4', 'dopri'])
+        self.assertAlmostEqual(results['rk4']['rhs_per_second'] / results['rk4']['steps_per_second'], 4)
+        self.assertAlmostEqual(results['leapfrog']['rhs_per_second'] / results['leapfrog']['steps_per_second'], 1)
+        self.assertAlmostEqual(results['yoshida4']['rhs_per_second'] / results['yoshida4']['steps_per_second'], 4)
+        self.assertGreater(results['dopri']['rhs_per_second'] / results['dopri']['steps_per_second'], 6)
+
+    def test_memory_baseline(self):
+        """
+        Test the peak memory of the integration against the committed baseline (the memory, unlike the timings, does not
+        depend on the host).
+        """
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks_baseline.json')) as file:
+            baseline = json.load(file)
+        # The baseline is saved with --quick
+        results = {'memory': benchmarks.benchmark_memory(num_steps=2000)}
+        self.assertEqual(benchmarks.compare_to_baseline(results, baseline), [])
+
+    @unittest.skipUnless(os.environ.get('HENON_HEILES_BENCHMARK_CHECK'), "set HENON_HEILES_BENCHMARK_CHECK to check the timings")
+    def test_check_baseline(self):
+        """
+        Test the whole suite against the committed baseline with --check, on the host the baseline was saved on.
+        """
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks_baseline.json')
+        with patch.object(sys, 'stdout', io.StringIO()) as output:
+            status = benchmarks.main(['--quick', '--repeat', '5', '--check', path, '--threshold', '0.5'])
+        self.assertEqual(status, 0, output.getvalue())
+
+    def test_memory_is_the_trajectory(self):
+        """
+        Test that henon_heiles allocates little beyond the stored trajectory.
+        """
+        results = benchmarks.benchmark_memory(num_steps=2000, sizes=(1, 10))
+        for size in ['1', '10']:
+            self.assertLess(results[size]['peak_bytes_per_sample'], 1.5)
+
+    @unittest.skipUnless(os.environ.get('HENON_HEILES_BENCHMARK_CHECK'), "set HENON_HEILES_BENCHMARK_CHECK to check the timings")
+    def test_fused_not_slower(self):
+        """
+        Test that the fused kernels (--kernel fused) are not slower than the generic path, for a lone orbit and for an
+        ensemble, with and without numba (up to the timing noise).
+        """
+        for numba in {kernels.numba, None}:
+            with patch.object(kernels, 'numba', numba):
+                results = benchmarks.benchmark_kernels(num_steps=2000, sizes=(1, 20), repeat=7)
+            for case, metrics in results.items():
+                self.assertGreater(metrics['fused_orbit_steps_per_second'], 0.7 * metrics['generic_orbit_steps_per_second'],
+                                   f"{case} (numba: {numba is not None})")
+
+    def test_compare_to_baseline(self):
+        """
+        Test that throughput drops and memory growth beyond the threshold are reported as regressions.
+        """
+        baseline = {
+            'machine': {'python': '3'},
+            'methods': {'rk4': {'steps_per_second': 1000.0, 'rhs_per_second': 4000.0}},
+            'memory': {'1': {'peak_bytes': 1000}},
+        }
+        results = {
+            'methods': {'rk4': {'steps_per_second': 850.0, 'rhs_per_second': 3000.0}},
+            'memory': {'1': {'peak_bytes': 1300}},
+        }
+        regressions = benchmarks.compare_to_baseline(results, baseline, threshold=0.2)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('methods/rk4/rhs_per_second'))
+        self.assertTrue(regressions[1].startswith('memory/1/peak_bytes'))
+        self.assertEqual(benchmarks.compare_to_baseline(results, baseline, threshold=0.5), [])
+
+class TestProfiling(unittest.TestCase):
+    def test_disabled_by_default(self):
+        """
+        Test that the instrumentation leaves the hot path untouched when profiling is disabled.
+        """
+        self.assertFalse(profiling.enabled())
+        self.assertIs(profiling.counted(equations_motion), equations_motion)
+        self.assertIs(profiling.phase('integration'), profiling.phase('plotting'))
+        profiling.count('steps')
+
+    def test_counters_and_hooks(self):
+        """
+        Test the RHS calls, steps, allocated bytes and phase hooks of a profiled integration.
+        """
+        t_values = np.linspace(0, 1, 101)
+        ended = []
+        with profiling.profile(hooks=[lambda name, seconds: ended.append(name)]) as profiler:
+            with profiling.phase('integration'):
+                hh(im.runge_kutta4, equations_motion, np.array([0, -0.1475, 0.3101, 0]), t_values, 0.01)
+            adaptive.dormand_prince_solve(equations_motion, np.array([0, -0.1475, 0.3101, 0]), t_values, 0.01)
+        self.assertFalse(profiling.enabled())
+
+        summary = profiler.summary()
+        _, stats = adaptive.dormand_prince_solve(equations_motion, np.array([0, -0.1475, 0.3101, 0]), t_values, 0.01)
+        self.assertEqual(summary['counters']['steps'], 100 + stats['accepted'])
+        self.assertEqual(summary['counters'].get('rejected_steps', 0), stats['rejected'])
+        self.assertEqual(summary['counters']['rhs_calls'], 400 + stats['rhs_evaluations'])
+        self.assertEqual(summary['allocated_bytes']['trajectory'], 2 * 101 * 4 * 8)
+        self.assertEqual(summary['phases']['integration']['calls'], 1)
+        self.assertEqual(ended, ['integration'])
+
+    def test_cli_profile(self):
+        """
+        Test that --profile writes a JSON summary with the phases of the run.
+        """
+        with tempfile.TemporaryDirectory() as directory, patch.object(sys.modules['henon_heiles'], 't_values', np.linspace(0, 1, 1001)):
+            path = os.path.join(directory, 'profile.json')
+            run_henon_heiles(["--torus", "--rk4", "--profile", path])
+            with open(path) as file:
+                summary = json.load(file)
+        self.assertEqual(set(summary['phases']), {'integration', 'section', 'energy', 'plotting', 'rendering'})
+        self.assertEqual(summary['counters'], {'steps': 1000, 'rhs_calls': 4000})
+
+class TestHeadless(unittest.TestCase):
+    def test_no_plotting_imports(self):
+        """
+        Test that a headless run in a fresh interpreter never imports matplotlib, and writes the .npz to the standard output.
+        """
+        script = (
+            "import sys, numpy as np, henon_heiles\n"
+            "henon_heiles.t_values = np.linspace(0, 1, 1001)\n"
+            "sys.argv = ['henon_heiles.py', '--rk4', '--all', '--headless', '--output', '-']\n"
+            "henon_heiles.main()\n"
+            "sys.stderr.write('matplotlib imported: %s' % ('matplotlib' in sys.modules))\n"
+        )
+        process = subprocess.run([sys.executable, "-c", script], capture_output=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(process.returncode, 0, process.stderr.decode())
+        self.assertIn("matplotlib imported: False", process.stderr.decode())
+        self.assertIn("Integrate equations of motion using Runge-Kutta 4", process.stderr.decode())
+        with np.load(io.BytesIO(process.stdout)) as data:
+            self.assertEqual(data['trajectory'].shape, (1001, 3, 4))
+
+    def test_output_file(self):
+        """
+        Test the content of the .npz file written by a headless run.
+        """
+        t_values = np.linspace(0, 10, 10001)
+        with tempfile.TemporaryDirectory() as directory, patch.object(sys.modules['henon_heiles'], 't_values', t_values):
+            path = os.path.join(directory, 'run.npz')
+            output = run_henon_heiles(["--torus", "--rk4", "--headless", "--output", path])
+            self.assertIn("Section points: ", output)
+            with np.load(path) as data:
+                expected = hh(im.runge_kutta4, equations_motion, np.array([0, -0.1475, 0.3101, 0]), t_values, 0.001)
+                np.testing.assert_array_equal(data['trajectory'][:, 0], expected)
+                _, points, _ = sections.find_crossings(t_values, expected)
+                self.assertGreater(len(points), 0)
+                np.testing.assert_array_equal(data['section_points'], points)
+                np.testing.assert_allclose(data['energy'][:, 0], hamiltonian(expected))
+                self.assertLess(data['energy_drift'][0], 1e-8)
+
+    def test_output_requires_headless(self):
+        """
+        Test that --output without --headless is rejected.
+        """
+        with patch.object(sys, 'stderr', io.StringIO()), self.assertRaises(SystemExit):
+            run_henon_heiles(["--torus", "--rk4", "--output", "run.npz"])
+        sys.stdout = sys.__stdout__
+
+class TestEscape(unittest.TestCase):
+    def test_exit_channels(self):
+        """
+        Test that an orbit launched towards the top saddle escapes through it, and its rotations by 120 degrees through
+        the other two channels (the potential has the symmetry of the triangle).
+        """
+        y0 = np.array([0, 0, 0, np.sqrt(0.4)])
+        rotations = [np.radians(angle) for angle in (0, 120, 240)]
+        batch = np.array([[np.cos(a) * y0[0] - np.sin(a) * y0[1], np.sin(a) * y0[0] + np.cos(a) * y0[1],
+                           np.cos(a) * y0[2] - np.sin(a) * y0[3], np.sin(a) * y0[2] + np.cos(a) * y0[3]] for a in rotations])
+        result = escape.escape_times(batch, 0.01, 2000)
+        self.assertTrue(result['escaped'].all())
+        np.testing.assert_array_equal(result['channel'], [0, 1, 2])
+        np.testing.assert_allclose(result['time'], result['time'][0])
+        np.testing.assert_allclose(hamiltonian(result['state']), 0.2)
+
+    def test_bound_orbits_do_not_escape(self):
+        """
+        Test that no orbit escapes below the escape energy 1/6.
+        """
+        result = escape.escape_times(initial_conditions.section_grid(0.1, 4, 4), 0.05, 2000)
+        self.assertFalse(result['escaped'].any())
+        self.assertTrue(np.isnan(result['time']).all())
+        np.testing.assert_allclose(hamiltonian(result['state']), 0.1, rtol=1e-5)
+
+    def test_compaction_matches_single_orbits(self):
+        """
+        Test that retiring the escaped orbits from the batch does not change the results of the others.
+        """
+        grid, result = escape.escape_map(0.2, 4, 4, dt=0.02, num_steps=5000)
+        self.assertTrue(result['escaped'].any())
+        for i in range(len(grid)):
+            single = escape.escape_times(grid[i], 0.02, 5000)
+            self.assertEqual(single['channel'][0], result['channel'][i])
+            np.testing.assert_array_equal(single['time'][0], result['time'][i])
+            np.testing.assert_allclose(single['state'][0], result['state'][i], rtol=1e-10, atol=1e-12)
+
+    def test_stream_retires_escaped_orbits(self):
+        """
+        Test that an escape criterion in the stream gives the results of escape_times, leaves the orbits still inside
+        unchanged, and marks the samples of the escaped orbits after their escape as nan.
+        """
+        grid = escape.escape_map(0.2, 3, 3, dt=0.02, num_steps=3000)[0]
+        expected = escape.escape_times(grid, 0.02, 3000)
+        self.assertTrue(expected['escaped'].any() and not expected['escaped'].all())
+
+        monitor, energy = escape.EscapeMonitor(), reducers.EnergyStats()
+        chunks = list(im.henon_heiles_stream(im.runge_kutta4, equations_motion, grid, 0.0, 0.02, 3001, chunk_size=700,
+                                             reducers=[energy], escape=monitor))
+        t = np.concatenate([t_chunk for t_chunk, _ in chunks])
+        y = np.concatenate([y_chunk for _, y_chunk in chunks])
+        for name in expected:
+            np.testing.assert_array_equal(monitor.results[name], expected[name])
+
+        inside = ~expected['escaped']
+        reference = im.henon_heiles(im.runge_kutta4, equations_motion, grid[inside], t, 0.02)
+        np.testing.assert_allclose(y[:, inside], reference, rtol=1e-12, atol=1e-14)
+        for i in np.flatnonzero(expected['escaped']):
+            escaped = t > expected['time'][i] + 1e-9
+            self.assertTrue(np.isnan(y[escaped, i]).all())
+            self.assertFalse(np.isnan(y[~escaped, i]).any())
+        np.testing.assert_allclose(energy.mean, 0.2, rtol=1e-6)
+        self.assertLess(np.max(energy.max_relative_drift), 1e-6)
+
+    def test_escape_option(self):
+        """
+        Test that --escape reports the escapes of the orbits moved above the escape energy and saves their escape times.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'run.npz')
+            output = run_henon_heiles(["--all", "--rk4", "--stream", "--escape", "--energy", "0.2", "--headless", "--output", path])
+            self.assertIn("Escapes: 3 of 3 orbits", output)
+            with np.load(path) as data:
+                self.assertTrue(data['escape_escaped'].all())
+                np.testing.assert_allclose(hamiltonian(data['escape_state']), 0.2, rtol=1e-6)
+
+class TestMixedPrecision(unittest.TestCase):
+    def setUp(self):
+        self.y0 = np.array(initial_conditions.section_samples(0.1, 64, 'halton'))
+        self.t_values = np.arange(5001) * 0.01
+
+    def test_compensated_summation(self):
+        """
+        Test that float32 states with compensated updates keep the energy error well below that of plain float32 updates.
+        """
+        for method in [im.runge_kutta4, im.yoshida4]:
+            with self.subTest(method=method.__name__):
+                compensated, diagnostics = precision.henon_heiles_mixed(method, equations_motion, self.y0, self.t_values, 0.01)
+                _, plain = precision.henon_heiles_mixed(method, equations_motion, self.y0, self.t_values, 0.01, compensated=False,
+                                                              energy_tolerance=np.inf)
+                self.assertEqual(compensated.dtype, np.float32)
+                self.assertEqual(compensated.nbytes, hh(method, equations_motion, self.y0, self.t_values[:2], 0.01).nbytes * 5001 // 4)
+                self.assertLess(diagnostics['energy_drift'].max(), 1e-6)
+                self.assertLess(5 * diagnostics['energy_drift'].max(), plain['energy_drift'].max())
+                self.assertFalse(diagnostics['insufficient'].any())
+
+    def test_insufficient_precision(self):
+        """
+        Test that an energy error above the tolerance is reported, and that leap_frog is rejected.
+        """
+        with self.assertWarns(RuntimeWarning):
+            _, diagnostics = precision.henon_heiles_mixed(im.runge_kutta4, equations_motion, self.y0, self.t_values[:1001], 0.01,
+                                                          energy_tolerance=1e-10)
+        self.assertTrue(diagnostics['insufficient'].all())
+        with self.assertRaises(ValueError):
+            precision.henon_heiles_mixed(im.leap_frog, equations_motion, self.y0, self.t_values, 0.01)
+
+    def test_cli_precision(self):
+        """
+        Test the float32 mode of the command line.
+        """
+        with patch.object(sys.modules['henon_heiles'], 't_values', np.linspace(0, 1, 1001)):
+            output = run_henon_heiles(["--all", "--rk4", "--precision", "float32", "--headless"])
+        self.assertIn("Mixed precision (float32, compensated)", output)
+
+class TestMultistep(unittest.TestCase):
+    def setUp(self):
+        self.y0 = np.array([0.0, -0.1475, 0.3101, 0.0])
+        # Reference at T = 20 from a fine RK4 integration
+        self.reference = hh(im.runge_kutta4, equations_motion, self.y0, np.arange(40001) * 0.0005, 0.0005)[-1]
+
+    def test_convergence_order(self):
+        """
+        Test that the error of every order of both methods decreases at least as dt^order.
+        """
+        for solve in [multistep.adams_bashforth_moulton_solve, multistep.stormer_cowell_solve]:
+            for order in range(2, 7):
+                with self.subTest(method=solve.__name__, order=order):
+                    errors = [np.abs(solve(equations_motion, self.y0, np.arange(n + 1) * dt, dt, order)[-1] - self.reference).max()
+                              for n, dt in [(500, 0.04), (1000, 0.02)]]
+                    self.assertGreater(np.log2(errors[0] / errors[1]), order - 0.3)
+
+    def test_rhs_calls_per_step(self):
+        """
+        Test that Adams-Bashforth-Moulton evaluates the right-hand side twice per step and Stormer-Cowell once.
+        """
+        t_values = np.arange(2001) * 0.01
+        for method, calls in [(multistep.adams_bashforth_moulton, 2), (multistep.stormer_cowell, 1)]:
+            with profiling.profile() as profiler:
+                hh(method, equations_motion, self.y0, t_values, 0.01)
+            counters = profiler.summary()['counters']
+            self.assertEqual(counters['steps'], 2000)
+            self.assertAlmostEqual(counters['rhs_calls'] / counters['steps'], calls, delta=0.1)
+
+    def test_ensemble(self):
+        """
+        Test that an ensemble matches the orbits integrated one by one.
+        """
+        y0 = np.array([self.y0, [0, 0, -0.0428, -0.3438], [0, 0.1563, 0.18876, -0.25]])
+        t_values = np.arange(1001) * 0.01
+        for method in [multistep.adams_bashforth_moulton, multistep.stormer_cowell]:
+            result = hh(method, equations_motion, y0, t_values, 0.01)
+            self.assertEqual(result.shape, (1001, 3, 4))
+            for i in range(3):
+                np.testing.assert_allclose(result[:,i], hh(method, equations_motion, y0[i], t_values, 0.01), rtol=1e-12, atol=1e-14)
+
+    def test_ring_buffer(self):
+        """
+        Test that the rotated weights always apply to the newest values first, and that invalid orders are rejected.
+        """
+        history = multistep.RingBuffer(3, (2,))
+        weights = history.rotations([1.0, 10.0, 100.0])
+        for value in range(1, 6):
+            history.push([value, -value])
+        np.testing.assert_allclose(history.combine(weights), [5 + 40 + 300, -345])
+        with self.assertRaises(ValueError):
+            multistep.adams_bashforth_moulton_solve(equations_motion, self.y0, np.arange(10) * 0.01, 0.01, order=7)
+
+    def test_cli_multistep(self):
+        """
+        Test the multistep methods of the command line, and that the chunked paths are rejected.
+        """
+        with patch.object(sys.modules['henon_heiles'], 't_values', np.linspace(0, 1, 1001)):
+            output = run_henon_heiles(["--torus", "--stormer", "--headless"])
+        self.assertIn("Stormer-Cowell", output)
+        with patch.object(sys, 'stderr', io.StringIO()), self.assertRaises(SystemExit):
+            run_henon_heiles(["--torus", "--abm", "--stream"])
+        sys.stdout = sys.__stdout__
+
+class TestFrequencyAnalysis(unittest.TestCase):
+    def test_naff_accuracy(self):
+        """
+        Test that NAFF recovers the frequencies and amplitudes of a batch of quasi-periodic signals far below the FFT bin width.
+        """
+        t = np.arange(20000) * 0.05
+        z = np.stack([np.exp(1j * w * t + 0.2j) + 0.3 * np.exp(2.7j * w * t) for w in [1.0, 1.1]], axis=1)
+        frequencies, amplitudes = frequency.naff(t, z, n_frequencies=2)
+        self.assertEqual(frequencies.shape, (2, 2))
+        np.testing.assert_allclose(frequencies, [[1.0, 2.7], [1.1, 2.97]], atol=1e-8)
+        np.testing.assert_allclose(np.abs(amplitudes), [[1.0, 0.3], [1.0, 0.3]], atol=1e-6)
+        np.testing.assert_allclose(frequency.fft_frequencies(t, z[:, 0]), 1.0, atol=1e-3)
+
+    def test_regular_and_chaotic_orbits(self):
+        """
+        Test that the diffusion index separates a chaotic orbit from a regular one, and that the regular loop orbit is
+        found in the 1:1 resonance.
+        """
+        y0 = initial_conditions.on_energy_shell(1/8, np.array([-0.1, 0.5]), np.array([0.0, 0.0]))
+        t_values = np.arange(20001) * 0.05
+        y = hh(im.runge_kutta4, equations_motion, y0, t_values, 0.05)
+        result = frequency.frequency_diffusion(t_values[::4], y[::4])
+        chaotic, regular = 0, 1
+        self.assertGreater(result['diffusion'][chaotic], -2)
+        self.assertLess(result['diffusion'][regular], -5)
+        m, n = frequency.resonance(result['ratio'], tolerance=1e-3)
+        self.assertEqual((m[regular], n[regular]), (1, 1))
+        with self.assertRaises(ValueError):
+            frequency.fundamental_frequencies(t_values, y, method='wavelet')
+
+    def test_streamed_signals(self):
+        """
+        Test that the decimated signals collected from a stream give the same analysis as the stored trajectory.
+        """
+        y0 = initial_conditions.on_energy_shell(1/8, np.array([-0.1, 0.5]), np.array([0.0, 0.0]))
+        t_values = np.arange(4001) * 0.05
+        collector = frequency.FrequencySignals(decimate=4)
+        for _ in im.henon_heiles_stream(im.runge_kutta4, equations_motion, y0, 0.0, 0.05, len(t_values), chunk_size=777,
+                                        reducers=[collector]):
+            pass
+        self.assertEqual(collector.z.shape, (1001, 2, 2))
+        y = hh(im.runge_kutta4, equations_motion, y0, t_values, 0.05)
+        expected = frequency.frequency_diffusion(t_values[::4], y[::4])
+        streamed = collector.frequency_diffusion()
+        np.testing.assert_allclose(collector.t, t_values[::4])
+        np.testing.assert_allclose(streamed['frequencies'], expected['frequencies'], rtol=1e-12)
+        np.testing.assert_allclose(streamed['diffusion'], expected['diffusion'], rtol=1e-6)
+
+    def test_empty_frequency_map(self):
+        """
+        Test that a frequency map of a section sampling without any orbit is rejected.
+        """
+        with self.assertRaises(ValueError):
+            frequency.frequency_map(0.0001, 2)
+
+class TestRaster(unittest.TestCase):
+    def setUp(self):
+        self.y0 = np.array([[0, 0, -0.0428, -0.3438], [0, -0.1475, 0.3101, 0], [0, 0.1563, 0.18876, -0.25]])
+        self.t_values = np.arange(20001) * 0.01
+        self.y = hh(im.runge_kutta4, equations_motion, self.y0, self.t_values, 0.01)
+
+    def test_density_raster(self):
+        """
+        Test that the incremental binning matches np.histogram2d, per channel, and counts the points outside the extent.
+        """
+        density = raster.DensityRaster((-0.5, 0.5, -0.5, 0.5), (40, 30), n_channels=3)
+        for chunk in np.array_split(np.arange(len(self.t_values)), 7):
+            density.update(self.y[chunk, :, 0], self.y[chunk, :, 1], np.arange(3))
+        for i in range(3):
+            expected, _, _ = np.histogram2d(self.y[:, i, 1], self.y[:, i, 0], bins=(30, 40), range=[(-0.5, 0.5), (-0.5, 0.5)])
+            np.testing.assert_array_equal(density.counts[i], expected)
+        density.update([np.nan, 2.0], [0.0, 0.0])
+        self.assertEqual(density.outside, 2)
+
+    def test_streamed_rasters(self):
+        """
+        Test that rasters fed chunk by chunk match the rasters of the whole trajectory, and that all the orbits stay in
+        the extents set by the energy.
+        """
+        energy = np.max(hamiltonian(self.y0))
+        whole = raster.TrajectoryRasters(energy, 3, (0, 200), resolution=64, energy_bins=50)
+        whole.update(self.t_values, self.y)
+        streamed = raster.TrajectoryRasters(energy, 3, (0, 200), resolution=64, energy_bins=50)
+        for _ in im.henon_heiles_stream(im.runge_kutta4, equations_motion, self.y0, 0.0, 0.01, len(self.t_values), chunk_size=999,
+                                        reducers=[streamed]):
+            pass
+        np.testing.assert_array_equal(streamed.plane.counts, whole.plane.counts)
+        np.testing.assert_array_equal(streamed.section.counts, whole.section.counts)
+        np.testing.assert_allclose(streamed.energy_max, whole.energy_max)
+        self.assertEqual(whole.plane.counts.sum(), 3 * len(self.t_values))
+        self.assertEqual(whole.plane.outside + whole.section.outside, 0)
+        self.assertEqual(whole.section.counts.sum(), len(sections.find_crossings(self.t_values, self.y)[0]))
+
+        image = raster.composite(whole.plane.counts, np.eye(3))
+        self.assertEqual(image.shape, (64, 64, 4))
+        self.assertTrue(np.all((image >= 0) & (image <= 1)))
+
+    def test_cli_raster(self):
+        """
+        Test the raster rendering of the command line, with and without streaming.
+        """
+        with patch.object(sys.modules['henon_heiles'], 't_values', np.linspace(0, 10, 10001)):
+            for args in [[], ["--stream", "--chunk-size", "1000"]]:
+                output = run_henon_heiles(["--all", "--rk4", "--raster", "64"] + args)
+                self.assertIn("All the 3 main initial conditions", output)
+        with patch.object(sys, 'stderr', io.StringIO()), self.assertRaises(SystemExit):
+            run_henon_heiles(["--torus", "--rk4", "--raster", "--headless"])
+        sys.stdout = sys.__stdout__
+
+class TestPotential(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.y = 0.3 * rng.normal(size=(100, 4))
+        self.w = rng.normal(size=(100, 3, 4))
+
+    def test_henon_heiles_potential(self):
+        """
+        Test that the default potential reproduces the hand-written equations of motion, energy and tangent map.
+        """
+        henon_heiles = potential.HENON_HEILES
+        np.testing.assert_allclose(henon_heiles.equations_motion(0.0, self.y), equations_motion(0.0, self.y), atol=1e-15)
+        np.testing.assert_allclose(henon_heiles.equations_motion(0.0, self.y[0]), equations_motion(0.0, self.y[0]), atol=1e-15)
+        np.testing.assert_allclose(henon_heiles.hamiltonian(self.y), hamiltonian(self.y), atol=1e-15)
+        np.testing.assert_allclose(henon_heiles.variational_equations(0.0, self.y, self.w), variational_equations(0.0, self.y, self.w),
+                                   atol=1e-14)
+
+    def test_derivatives(self):
+        """
+        Test the derived force and Hessian of a quartic potential with per-lane coefficients against finite differences.
+        """
+        quartic = potential.henon_heiles_potential(coupling=np.linspace(0, 2, 100), cubic=0.5, quartic=0.1)
+        self.assertEqual(quartic.coefficients.shape, (100, 7))
+        q, eps = self.y[:, :2], 1e-6
+        for axis in range(2):
+            step = eps * np.eye(2)[axis]
+            np.testing.assert_allclose(-(quartic.potential(q + step) - quartic.potential(q - step)) / (2 * eps),
+                                       quartic.force(q)[:, axis], atol=1e-8)
+            np.testing.assert_allclose(-(quartic.force(q + step) - quartic.force(q - step)) / (2 * eps),
+                                       quartic.hessian(q)[:, axis], atol=1e-8)
+
+    def test_coupling_sweep(self):
+        """
+        Test that a sweep over the coupling strength runs as one batch: every lane stays on its energy shell, the lanes
+        without coupling are harmonic oscillators and the unit coupling reproduces the Henon-Heiles orbits.
+        """
+        henon_heiles, y0, coupling = potential.coupling_sweep([0.0, 0.5, 1.0], 0.1, np.array([0.0, 0.1, 0.9]), np.array([0.0, 0.1, 0.0]))
+        self.assertEqual(len(y0), 6)
+        t_values = np.arange(2001) * 0.01
+        result = hh(im.runge_kutta4, henon_heiles.equations_motion, y0, t_values, 0.01)
+        np.testing.assert_allclose(henon_heiles.hamiltonian(result), 0.1, atol=1e-9)
+
+        harmonic = coupling == 0
+        np.testing.assert_allclose(result[-1, harmonic, 2], y0[harmonic, 2] * np.cos(t_values[-1]), atol=1e-8)
+        full = coupling == 1
+        np.testing.assert_allclose(result[:, full], hh(im.runge_kutta4, equations_motion, y0[full], t_values, 0.01), atol=1e-12)
+
+class TestPeriodicOrbits(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.environment = patch.dict(os.environ, {'HENON_HEILES_CACHE': self.directory.name})
+        self.environment.start()
+        cache.clear_cache()
+
+    def tearDown(self):
+        cache.clear_cache()
+        self.environment.stop()
+        self.directory.cleanup()
+
+    def test_return_map_jacobian(self):
+        """
+        Test the Jacobian of the return map given by the variational equations against finite differences.
+        """
+        point, eps = np.array([0.1, 0.05]), 1e-6
+        mapped = periodic_orbits.return_map(1/12, point, multiplicity=2)
+        self.assertEqual(mapped['points'].shape, (1, 2, 2))
+        for axis in range(2):
+            step = eps * np.eye(2)[axis]
+            shifted = periodic_orbits.return_map(1/12, np.array([point + step, point - step]), multiplicity=2)['points'][:, -1]
+            np.testing.assert_allclose((shifted[0] - shifted[1]) / (2 * eps), mapped['jacobian'][0, :, axis], atol=1e-6)
+
+    def test_return_map_other_potential(self):
+        """
+        Test the Jacobian of the return map of another potential, whose energy shell differs from the Henon-Heiles one,
+        against finite differences.
+        """
+        system = potential.henon_heiles_potential(coupling=0.8, cubic=0.25, omega_y=1.2)
+        kwargs = {'f': system.equations_motion, 'variational': system.variational_equations, 'hamiltonian': system.hamiltonian}
+        point, eps = np.array([0.1, 0.05]), 1e-6
+        mapped = periodic_orbits.return_map(1/12, point, **kwargs)
+        for axis in range(2):
+            step = eps * np.eye(2)[axis]
+            shifted = periodic_orbits.return_map(1/12, np.array([point + step, point - step]), **kwargs)['points'][:, -1]
+            np.testing.assert_allclose((shifted[0] - shifted[1]) / (2 * eps), mapped['jacobian'][0, :, axis], atol=1e-6)
+
+    def test_fixed_points(self):
+        """
+        Test that the orbits found at a low energy are the 4 stable and 3 unstable fixed points of the section map, that
+        they are fixed points with area-preserving monodromy matrices, and that duplicated seeds give a single orbit.
+        """
+        orbits = periodic_orbits.find_periodic_orbits(1/12, n_seeds=30)
+        self.assertEqual(len(orbits['period']), 7)
+        self.assertEqual(np.sum(orbits['stable']), 4)
+        mapped = periodic_orbits.return_map(1/12, orbits['points'])
+        np.testing.assert_allclose(mapped['points'][:, 0], orbits['points'], atol=1e-8)
+        np.testing.assert_allclose(np.prod(orbits['eigenvalues'], axis=1), 1, atol=1e-6)
+        np.testing.assert_allclose(np.abs(orbits['eigenvalues'][orbits['stable']]), 1, atol=1e-6)
+
+        seeds = np.repeat(orbits['points'][:1] + 1e-3, 3, axis=0)
+        self.assertEqual(len(periodic_orbits.find_periodic_orbits(1/12, seeds)['period']), 1)
+
+    def test_singular_lanes(self):
+        """
+        Test that a seed whose J - I is singular is dropped unconverged instead of aborting the whole batch.
+        """
+        return_map = periodic_orbits.return_map
+        calls = []
+
+        def singular_first_lane(energy, points, *args, **kwargs):
+            # J - I = 0 for the first seed at the first iteration
+            mapped = return_map(energy, points, *args, **kwargs)
+            if not calls:
+                mapped['jacobian'][0] = np.eye(2)
+            calls.append(len(points))
+            return mapped
+
+        seeds = np.array([[0.3, 0.01], [0.0, 0.3]])
+        with patch.object(periodic_orbits, 'return_map', singular_first_lane):
+            orbits = periodic_orbits.find_periodic_orbits(1/12, seeds)
+        self.assertEqual(calls[1], 1)
+        self.assertEqual(len(orbits['period']), 1)
+        self.assertTrue(np.all(np.isfinite(orbits['points'])))
+        self.assertEqual(len(periodic_orbits.find_periodic_orbits(1/12, np.empty((0, 2)))['period']), 0)
+
+    def test_cached_orbits(self):
+        """
+        Test that the orbits of an energy are computed once and then served by the cache.
+        """
+        first = periodic_orbits.periodic_orbits(1/12, n_seeds=10)
+        second = periodic_orbits.periodic_orbits(1/12, n_seeds=10)
+        self.assertEqual(cache.cache_stats()['memory_hits'], 1)
+        np.testing.assert_array_equal(first['section_points'], second['section_points'])
+
+        with patch.object(sys.modules['henon_heiles'], 't_values', np.linspace(0, 1, 1001)):
+            output = run_henon_heiles(["--torus", "--rk4", "--headless", "--periodic-orbits"])
+        self.assertIn("Periodic orbits at E = 0.0600288: 7 (4 stable, 3 unstable)", output)
+
+class TestService(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.socket = os.path.join(self.directory.name, 'service.sock')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def serve(self, *specs):
+        """
+        Start a service, submit the job specifications concurrently and return the events of every job.
+        """
+        async def session():
+            jobs = service.JobService(workers=2, batch_size=2, segment_time=5.0)
+            server = asyncio.create_task(jobs.serve(socket_path=self.socket))
+            try:
+                while not os.path.exists(self.socket):
+                    await asyncio.sleep(0.01)
+                async def collect(spec):
+                    return [event async for event in service.request(spec, self.socket)]
+                return await asyncio.gather(*(collect(spec) for spec in specs))
+            finally:
+                server.cancel()
+                jobs.close()
+        return asyncio.run(session())
+
+    def test_section_points(self):
+        """
+        Test that the streamed section points of a job are those of sections.henon_heiles_section, that identical
+        in-flight jobs share a single run and that the progress reaches 1.
+        """
+        y0 = [[0, 0, -0.0428, -0.3438], [0, -0.1475, 0.3101, 0], [0, 0.1563, 0.18876, -0.25]]
+        spec = {'method': 'rk4', 'initial_conditions': y0, 'time': 30}
+        first, second = self.serve(spec, spec)
+
+        self.assertEqual(first[0]['deduplicated'] + second[0]['deduplicated'], 1)
+        self.assertEqual([event for event in first if event['event'] != 'accepted'],
+                         [event for event in second if event['event'] != 'accepted'])
+        self.assertEqual([event['fraction'] for event in first if event['event'] == 'progress'][-1], 1.0)
+        self.assertEqual(first[-1]['event'], 'done')
+
+        points = np.array([p for event in first if event['event'] == 'section' for p in event['points']])
+        orbit = np.array([o for event in first if event['event'] == 'section' for o in event['orbit']])
+        _, expected, expected_orbit = sections.henon_heiles_section(im.runge_kutta4, equations_motion, np.array(y0), 0.0, 0.01, 3001)
+        self.assertEqual(first[-1]['section_points'], len(expected))
+        for i in range(3):
+            np.testing.assert_allclose(np.sort(points[orbit == i], axis=0), np.sort(expected[expected_orbit == i][:, [1, 3]], axis=0), atol=1e-12)
+
+    def test_invalid_jobs(self):
+        """
+        Test that invalid job specifications (including JSON lines that are not objects) are rejected with an error event,
+        and that the section jobs are validated.
+        """
+        [events] = self.serve({'method': 'dopri', 'initial_conditions': [[0, 0.1, 0.3, 0]]})
+        self.assertEqual([event['event'] for event in events], ['error'])
+        self.assertIn('dopri', events[0]['message'])
+
+        # Valid JSON lines that are not job objects
+        events = self.serve([1], 'x', {'section': [0.1]})
+        for [event] in events:
+            self.assertEqual(event['event'], 'error')
+            self.assertIn('JSON object', event['message'])
+
+        with self.assertRaises(ValueError):
+            service.job_spec({'section': {'energy': 0.1, 'sampling': 'nope'}})
+        with self.assertRaises(ValueError):
+            service.job_spec({'initial_conditions': [[0, 0.1]]})
+        spec = service.job_spec({'section': {'energy': 0.1, 'n': 10}})
+        self.assertEqual((spec['method'], spec['time'], spec['dt']), ('rk4', 200.0, 0.01))
+        np.testing.assert_array_equal(spec['initial_conditions'], initial_conditions.section_samples(0.1, 10))
+
+    def test_failed_batch(self):
+        """
+        Test that a failing batch stops the other batches of its job, and that no event is published after the error.
+        """
+        integrate_segment, calls = service._integrate_segment, []
+
+        def failing_segment(method, y0, *args):
+            calls.append(y0[0, 1])
+            if y0[0, 1] == 0.1:
+                raise RuntimeError("segment failed")
+            time.sleep(0.05)
+            return integrate_segment(method, y0, *args)
+
+        async def session():
+            jobs = service.JobService(workers=1, batch_size=1, segment_time=1.0)
+            jobs.pool.shutdown()
+            # Threads, so that the patched segments run in this process
+            jobs.pool = ThreadPoolExecutor(max_workers=2)
+            try:
+                job, _ = jobs.submit({'initial_conditions': [[0, 0.1, 0.3, 0], [0, 0.2, 0.2, 0]], 'time': 10})
+                events = [event async for event in job.subscribe()]
+                await asyncio.sleep(0.3)
+                return job, events
+            finally:
+                jobs.close()
+
+        with patch.object(service, '_integrate_segment', failing_segment):
+            job, events = asyncio.run(session())
+        self.assertEqual(events[-1], {'event': 'error', 'message': 'segment failed', 'job': job.key})
+        self.assertEqual(job.events, events)
+        self.assertLess(calls.count(0.2), 3)
+
+    def test_cancelled_connection(self):
+        """
+        Test that cancelling a connection handler (as the server does when it shuts down) propagates the cancellation
+        after closing the connection, while the job keeps running.
+        """
+        async def session():
+            jobs = service.JobService(workers=1, batch_size=2, segment_time=5.0)
+            try:
+                reader, writer = asyncio.StreamReader(), MagicMock(drain=AsyncMock())
+                reader.feed_data((json.dumps({'initial_conditions': [[0, 0.1, 0.3, 0]], 'time': 1000}) + '\n').encode())
+                handler = asyncio.create_task(jobs.handle(reader, writer))
+                while not writer.write.called:
+                    await asyncio.sleep(0.01)
+                handler.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await handler
+                self.assertTrue(handler.cancelled())
+                writer.close.assert_called_once()
+                self.assertEqual(len(jobs.jobs), 1)
+            finally:
+                jobs.close()
+        asyncio.run(session())
+
+    def test_fused_segments(self):
+        """
+        Test that the workers integrating the segments with the compiled kernels (run here as plain Python loops in
+        place of numba) give the segments and crossings of the streamed path, across consecutive segments.
+        """
+        y0 = np.array([[0, -0.1475, 0.3101, 0], [0, 0.1563, 0.18876, -0.25]])
+        energy = hamiltonian(y0)
+        for method in ['rk4', 'leapfrog']:
+            expected = [service._integrate_segment(method, y0, None, 0.0, 0.01, 801, energy)]
+            expected.append(service._integrate_segment(method, expected[0]['state'], expected[0]['previous'], 8.0, 0.01, 801, energy))
+            with patch.object(kernels, 'numba', MagicMock()):
+                first = service._integrate_segment(method, y0, None, 0.0, 0.01, 801, energy)
+                second = service._integrate_segment(method, first['state'], first['previous'], 8.0, 0.01, 801, energy)
+            for result, reference in zip([first, second], expected):
+                self.assertGreater(len(reference['t']), 0)
+                for name in ['state', 'previous', 't', 'points', 'orbit', 'energy_drift']:
+                    np.testing.assert_allclose(result[name], reference[name], rtol=1e-10, atol=1e-12, err_msg=f"{method} {name}")
+
+class TestAutoSelect(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.environment = patch.dict(os.environ, {'HENON_HEILES_CACHE': self.directory.name})
+        self.environment.start()
+        cache.clear_cache()
+        self.y0 = np.array([[0, 0, -0.0428, -0.3438], [0, -0.1475, 0.3101, 0], [0, 0.1563, 0.18876, -0.25]])
+
+    def tearDown(self):
+        cache.clear_cache()
+        self.environment.stop()
+        self.directory.cleanup()
+
+    def test_calibration(self):
+        """
+        Test that the work-precision curve of RK4 shows its 4th order, that a diverging Euler run has an infinite error
+        kept finite in the curve, and that the calibrations are cached per host.
+        """
+        curve = autoselect.calibration('rk4', self.y0, dts=(0.1, 0.05), probe_time=10.0)
+        self.assertGreater(np.log2(curve['error'][0] / curve['error'][1]), 3.5)
+        self.assertTrue(np.all(curve['seconds_per_step'] > 0))
+        autoselect.calibration('rk4', self.y0, dts=(0.1, 0.05), probe_time=10.0)
+        self.assertEqual(cache.cache_stats()['memory_hits'], 1)
+        # The costs measured on another host are not reused
+        other_host = dict(benchmarks.machine_info(), cpu_count=-1)
+        with patch.object(autoselect, 'machine_info', return_value=other_host):
+            autoselect.calibration('rk4', self.y0, dts=(0.1, 0.05), probe_time=10.0)
+        self.assertEqual(cache.cache_stats()['memory_hits'], 1)
+
+        diverged = autoselect.calibrate('euler', [0, 0.1, 0.5, 0], dts=(0.5,), probe_time=200.0)
+        self.assertEqual(diverged['error'][0], 1e300)
+        self.assertGreater(autoselect.predict_error(diverged, 0.5, 200.0, 200.0), 1e299)
+        self.assertEqual(autoselect.predict_error(diverged, 1.0, 200.0, 200.0), np.inf)
+
+    def test_selection(self):
+        """
+        Test that the selected method and step size meet the tolerance over the whole run, and that Euler is never chosen.
+        """
+        for tolerance in (1e-4, 1e-7):
+            choice = autoselect.select_method(self.y0, tolerance, 100.0, methods=['euler', 'rk4', 'yoshida4', 'stormer'],
+                                              dts=(0.1, 0.05, 0.02), probe_time=10.0)
+            self.assertTrue(choice['met'])
+            self.assertNotEqual(choice['method'], 'euler')
+            self.assertEqual(len(choice['candidates']), 4)
+            self.assertLessEqual(choice['predicted_error'], tolerance)
+            t_values = np.arange(choice['num_steps'] + 1) * choice['dt']
+            self.assertAlmostEqual(t_values[-1], 100.0)
+            y = im.henon_heiles(autoselect.AUTO_METHODS[choice['method']], equations_motion, self.y0, t_values, choice['dt'])
+            self.assertLess(np.max(np.abs(hamiltonian(y) / hamiltonian(self.y0) - 1)), tolerance)
+
+    def test_auto_option(self):
+        """
+        Test that --auto reports its choice and integrates with the chosen method and step size.
+        """
+        with patch.object(sys.modules['henon_heiles'], 't_values', np.linspace(0, 5, 501)):
+            output = run_henon_heiles(["--auto", "1e-6", "--torus", "--headless"])
+        self.assertIn("Automatic selection for a relative energy error of 1.0e-06: --", output)
+        self.assertIn("Integrate equations of motion using", output)
+        drift = float(output.split("maximum relative energy drift: ")[1].split()[0])
+        self.assertLess(drift, 1e-6)
+
+    def test_auto_with_energy_monitor(self):
+        """
+        Test that --auto only selects methods supported by the energy monitor: the multistep methods are not candidates.
+        """
+        with patch.object(sys.modules['henon_heiles'], 't_values', np.linspace(0, 5, 501)):
+            output = run_henon_heiles(["--auto", "1e-3", "--torus", "--headless", "--energy-alert", "1e-2"])
+        self.assertIn("Automatic selection for a relative energy error of 1.0e-03: --", output)
+        self.assertNotIn("--abm", output)
+        self.assertNotIn("--stormer", output)
+        self.assertIn("Energy monitor: maximum relative drift", output)
+
+class TestEnergyMonitor(unittest.TestCase):
+    def setUp(self):
+        self.y0 = np.array([[0, 0, -0.0428, -0.3438], [0, -0.1475, 0.3101, 0], [0, 0.1563, 0.18876, -0.25]])
+        self.t_values = np.linspace(0, 50, 5001)
+        self.dt = self.t_values[1] - self.t_values[0]
+
+    def test_statistics(self):
+        """
+        Test the online drift statistics and secular trend against the same quantities computed on the stored
+        trajectory, for the in-memory and the streamed integrations.
+        """
+        monitor = energy_monitor.EnergyMonitor()
+        y = im.henon_heiles(im.runge_kutta2, equations_motion, self.y0, self.t_values, self.dt, monitor=monitor)
+        drift = (hamiltonian(y) - hamiltonian(self.y0)) / np.abs(hamiltonian(self.y0))
+        summary = monitor.summary()
+        self.assertEqual(monitor.count, len(self.t_values) - 1)
+        np.testing.assert_allclose(summary['max_drift'], np.abs(drift).max(axis=0))
+        np.testing.assert_allclose(summary['mean_drift'], drift[1:].mean(axis=0))
+        np.testing.assert_allclose(summary['std_drift'], drift[1:].std(axis=0, ddof=1))
+        slope, intercept = np.polyfit(self.t_values[1:], drift[1:], 1)
+        np.testing.assert_allclose(summary['drift_slope'], slope, rtol=1e-6)
+        np.testing.assert_allclose(summary['drift_intercept'], intercept, rtol=1e-6, atol=1e-12)
+
+        streamed = energy_monitor.EnergyMonitor()
+        for _ in im.henon_heiles_stream(im.runge_kutta2, equations_motion, self.y0, 0.0, self.dt, len(self.t_values),
+                                        chunk_size=700, stride=10, monitor=streamed):
+            pass
+        np.testing.assert_allclose(streamed.summary()['drift_slope'], slope, rtol=1e-6)
+
+        with self.assertRaises(ValueError):
+            im.henon_heiles(multistep.stormer_cowell, equations_motion, self.y0, self.t_values, self.dt, monitor=monitor)
+
+    def test_projection(self):
+        """
+        Test that the projection keeps the energy of a drifting method on its shell, for the generic Henon-Heiles and
+        for a polynomial potential.
+        """
+        monitor = energy_monitor.EnergyMonitor(project=1e-9)
+        y = im.henon_heiles(im.runge_kutta2, equations_motion, self.y0, self.t_values, self.dt, monitor=monitor)
+        self.assertLess(np.max(np.abs(hamiltonian(y) / hamiltonian(self.y0) - 1)), 1.01e-9)
+        self.assertTrue(np.all(monitor.projections > 0))
+
+        quartic = potential.henon_heiles_potential(quartic=0.1)
+        monitor = energy_monitor.EnergyMonitor(project=1e-9, hamiltonian=quartic.hamiltonian, f=quartic.equations_motion)
+        y = im.henon_heiles(im.runge_kutta2, quartic.equations_motion, self.y0, self.t_values, self.dt, monitor=monitor)
+        self.assertLess(np.max(np.abs(quartic.hamiltonian(y) / quartic.hamiltonian(self.y0) - 1)), 1.01e-9)
+
+    def test_alert_and_abort(self):
+        """
+        Test that a diverging Euler run warns once per orbit and is aborted early, also from the command line.
+        """
+        monitor = energy_monitor.EnergyMonitor(alert=1e-3, abort=0.1)
+        t_values = np.linspace(0, 200, 2001)
+        with self.assertWarns(RuntimeWarning), self.assertRaises(energy_monitor.EnergyDivergence) as raised:
+            im.henon_heiles(im.euler, equations_motion, self.y0, t_values, 0.1, monitor=monitor)
+        self.assertLess(raised.exception.t, 5)
+        self.assertGreater(np.min(raised.exception.drift), 0.1)
+        self.assertTrue(monitor.alerted.any())
+
+        with self.assertRaises(energy_monitor.EnergyDivergence):
+            im.henon_heiles(im.euler, equations_motion, self.y0[0], np.linspace(0, 1000, 2001), 0.5,
+                            monitor=energy_monitor.EnergyMonitor(every=10))
+
+        with patch.object(sys.modules['henon_heiles'], 't_values', np.linspace(0, 100, 10001)), self.assertRaises(SystemExit):
+            run_henon_heiles(["--euler", "--torus", "--headless", "--energy-abort", "1e-2"])
+        output = sys.stdout.getvalue()
+        sys.stdout = sys.__stdout__
+        self.assertIn("Error: Energy diverged at t = ", output)
+
+        with patch.object(sys.modules['henon_heiles'], 't_values', np.linspace(0, 10, 1001)):
+            output = run_henon_heiles(["--rk2", "--torus", "--headless", "--energy-project", "1e-9"])
+        self.assertIn("Energy monitor: maximum relative drift", output)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,182 @@
+from functools import lru_cache
+
+import numpy as np
+
+# Sampling schemes of the x = 0 section
+SAMPLINGS = ('grid', 'halton', 'sobol', 'boundary')
+
+def section_potential(y):
+    """
+    Potential energy of the Henon-Heiles system on the x = 0 section: V(0, y) = y^2/2 - y^3/3.
+
+    Parameters:
+        y (array): y-coordinate values.
+
+    Returns:
+        array: Potential energy at (0, y).
+    """
+    return y**2 / 2 - y**3 / 3
+
+def section_bounds(energy):
+    """
+    Bounds of the region of the x = 0 section accessible at the given energy.
+
+    The y range is bounded by the roots of V(0, y) = E around the origin. Above the escape energy 1/6 there is no upper
+    root and the range is cut at the saddle height y = 1.
+
+    Parameters:
+        energy (float): Total energy.
+
+    Returns:
+        tuple: ((y_min, y_max), py_max) with the y range and the largest |py|.
+    """
+    roots = np.roots([-1/3, 1/2, 0, -energy])
+    roots = roots[np.abs(roots.imag) < 1e-12].real
+    y_min = roots[roots <= 0].max()
+    positive = roots[(roots > 0) & (roots <= 1)]
+    y_max = positive.min() if len(positive) else 1.0
+    return (y_min, y_max), np.sqrt(2 * energy)
+
+def on_energy_shell(energy, y, py, px_sign=1):
+    """
+    Complete points (y, py) of the x = 0 section into initial conditions on the energy shell.
+
+    px is solved from H(0, y, px, py) = E with px >= 0 (crossings with increasing x), in one vectorized pass; the
+    points outside the energy curve, where no real px exists, are dropped.
+
+    Parameters:
+        energy (float): Total energy.
+        y (array): y-coordinate values.
+        py (array): Momentum in the y-direction.
+        px_sign (float or array): Sign of px, +1 by default (one value per point, or the same for all).
+
+    Returns:
+        array: Initial conditions [0, y, px, py] of shape (N, 4).
+    """
+    y = np.ravel(y)
+    py = np.ravel(py)
+    px_squared = 2 * (energy - section_potential(y)) - py**2
+    inside = px_squared >= 0
+    px = np.sqrt(px_squared[inside]) * np.where(np.broadcast_to(np.ravel(px_sign), y.shape)[inside] < 0, -1, 1)
+    return np.stack([np.zeros(inside.sum()), y[inside], px, py[inside]], axis=-1)
+
+def halton(start, stop, bases=(2, 3)):
+    """
+    Points start to stop - 1 of the Halton sequence in the unit square (radical inverses of the indices in the bases).
+
+    Returns:
+        array: Points of shape (stop - start, len(bases)).
+    """
+    points = np.zeros((stop - start, len(bases)))
+    for j, base in enumerate(bases):
+        index = np.arange(start + 1, stop + 1)
+        scale = 1.0
+        while index.any():
+            scale /= base
+            index, digit = np.divmod(index, base)
+            points[:, j] += digit * scale
+    return points
+
+def _unit_points(sampling, n, start, stop, seed, sobol=None):
+    """
+    Points start to stop - 1 of a sampling of the unit square with n points in total.
+    """
+    if sampling == 'grid':
+        n_y, n_py = n
+        index = np.arange(start, stop)
+        return np.stack([np.linspace(0, 1, n_y)[index // n_py], np.linspace(0, 1, n_py)[index % n_py]], axis=-1)
+    if sampling == 'sobol':
+        return sobol.random(stop - start)
+    # Halton points, shifted by a random offset (Cranley-Patterson rotation) when a seed is given
+    points = halton(start, stop)
+    if seed is not None:
+        points = (points + np.random.default_rng(seed).random(2)) % 1
+    return points
+
+def _to_section(energy, sampling, u):
+    """
+    Map points of the unit square to (y, py) points of the x = 0 section.
+
+    The 'boundary' sampling uses y = center + half-width * sin(pi (u - 1/2)) and py = py_max(y) sin(pi (v - 1/2)),
+    with py_max(y) the largest |py| of the energy curve at y: every point is inside the curve, and the points are
+    denser near its boundary, where px is small and the orbits are the most sensitive. The other samplings fill the
+    bounding box of the accessible region uniformly.
+    """
+    (y_min, y_max), py_max = section_bounds(energy)
+    if sampling == 'boundary':
+        y = (y_min + y_max) / 2 + (y_max - y_min) / 2 * np.sin(np.pi * (u[:, 0] - 0.5))
+        return y, np.sqrt(np.maximum(2 * (energy - section_potential(y)), 0)) * np.sin(np.pi * (u[:, 1] - 0.5))
+    return y_min + (y_max - y_min) * u[:, 0], py_max * (2 * u[:, 1] - 1)
+
+def _sobol_engine(seed):
+    try:
+        from scipy.stats import qmc
+    except ImportError:
+        raise ImportError("The sobol sampling requires scipy: pip install scipy") from None
+    return qmc.Sobol(d=2, scramble=seed is not None, seed=seed)
+
+def section_chunks(energy, n, sampling='grid', chunk_size=100000, seed=None):
+    """
+    Generate initial conditions of the x = 0 section on the energy shell chunk by chunk, for section fills too large
+    to hold in memory at once.
+
+    Parameters:
+        energy (float): Total energy.
+        n (int or tuple): Number of sampled points (n_y, n_py for the 'grid' sampling, or n for an n x n grid).
+        sampling (str): 'grid' (regular grid), 'halton' or 'sobol' (quasi-random, the latter requires scipy) or
+                        'boundary' (quasi-random, refined near the energy curve).
+        chunk_size (int): Number of sampled points per chunk.
+        seed (int): Seed of the randomization of the quasi-random sequences (not randomized by default).
+
+    Yields:
+        array: Initial conditions [0, y, px, py] of shape (M, 4) with M <= chunk_size (the points outside the energy
+               curve are dropped).
+    """
+    if sampling not in SAMPLINGS:
+        raise ValueError(f"Unknown sampling {sampling!r}: expected one of {', '.join(SAMPLINGS)}")
+    if sampling == 'grid':
+        n = (n, n) if np.isscalar(n) else tuple(n)
+    total = n[0] * n[1] if sampling == 'grid' else n
+    sobol = _sobol_engine(seed) if sampling == 'sobol' else None
+    for start in range(0, total, chunk_size):
+        stop = min(start + chunk_size, total)
+        y, py = _to_section(energy, sampling, _unit_points(sampling, n, start, stop, seed, sobol))
+        yield on_energy_shell(energy, y, py)
+
+@lru_cache(maxsize=32)
+def _section_samples(energy, n, sampling, seed):
+    samples = np.concatenate(list(section_chunks(energy, n, sampling, seed=seed)) or [np.empty((0, 4))])
+    samples.flags.writeable = False
+    return samples
+
+def section_samples(energy, n, sampling='grid', seed=None):
+    """
+    Initial conditions of the x = 0 section on the energy shell, for a sampling of the (y, py) plane.
+
+    px is solved in one vectorized pass for all the points, the points outside the energy curve are dropped, and the
+    result is cached per energy and sampling (it is read-only; copy it before modifying it).
+
+    Parameters:
+        energy (float): Total energy.
+        n (int or tuple): Number of sampled points (n_y, n_py for the 'grid' sampling, or n for an n x n grid).
+        sampling (str): 'grid', 'halton', 'sobol' or 'boundary' (see section_chunks).
+        seed (int): Seed of the randomization of the quasi-random sequences (not randomized by default).
+
+    Returns:
+        array: Initial conditions [0, y, px, py] of shape (N, 4).
+    """
+    return _section_samples(float(energy), n if np.isscalar(n) else tuple(n), sampling, seed)
+
+def section_grid(energy, n_y, n_py):
+    """
+    Initial conditions on a regular (y, py) grid of the x = 0 section, filling the energy shell.
+
+    Parameters:
+        energy (float): Total energy.
+        n_y (int): Number of grid points along y.
+        n_py (int): Number of grid points along py.
+
+    Returns:
+        array: Read-only initial conditions [0, y, px, py] of shape (N, 4), with N <= n_y * n_py.
+    """
+    return section_samples(energy, (n_y, n_py), 'grid')
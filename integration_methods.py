@@ -1,32 +1,69 @@
 import numpy as np
 
-def henon_heiles(integration_method,f, y0, t_values, dt):
+import profiling
+from adaptive import dormand_prince, dormand_prince_solve
+from multistep import MULTISTEP_SOLVERS
+
+def henon_heiles(integration_method,f, y0, t_values, dt, rtol=1e-8, atol=1e-10, monitor=None):
     '''
     The henon_heiles function is designed to perform numerical integration of a dynamical system using various integration methods. 
     In particular, it can be used to simulate the Henon-Heiles system, a simple Hamiltonian system used in celestial mechanics and quantum mechanics. 
+
+    An ensemble of orbits can be integrated in a single vectorized pass by passing an (N, 4) array of initial conditions:
+    every step then advances all the N trajectories together, provided that f accepts batched states (as var.equations_motion does).
+
+    With integration_method = dormand_prince the integration is adaptive: dt is only the initial step size, the steps are
+    chosen by the embedded error estimate to meet rtol/atol, and the solution is sampled at t_values with the dense output.
+    The multistep adams_bashforth_moulton and stormer_cowell keep a history of past derivatives and are dispatched to their
+    solvers in the multistep module.
+
+    A monitor (energy_monitor.EnergyMonitor) checks the energy after every step of the single-step methods: it keeps
+    running drift statistics, can project the states back onto their energy shell, and aborts a diverging run.
     
     Parameters:
-        integration_method (string): this parameters allow you to choose between four integration methods: euler, runge_kutta4, runge_kutta2, leap-frog.
+        integration_method (string): this parameters allow you to choose between the integration methods: euler, runge_kutta4, runge_kutta2, leap-frog,
+                                     the symplectic velocity_verlet, yoshida4, yoshida6, yoshida8, the adaptive dormand_prince
+                                     and the multistep adams_bashforth_moulton and stormer_cowell.
         f  (function): The function that defines the ODE dy/dt = f(t, y).
-        y0  (array): Initial conditions for the state vector (x, y, px and py).
+        y0  (array): Initial conditions for the state vector (x, y, px and py), or an (N, 4) array of initial conditions.
         t  (array): Simulation time.
-        dt (float): Step size.
+        dt (float): Step size (initial step size for dormand_prince).
+        rtol, atol (float): Relative and absolute tolerances of the adaptive dormand_prince integration.
+        monitor (EnergyMonitor): Online energy monitor, for the single-step methods only.
 
     Returns:
-        array: State vector after the whole simulation time.
+        array: State vector after the whole simulation time, of shape (len(t), 4) or (len(t), N, 4) for an ensemble.
     
     '''
+    f = profiling.counted(f)
+    if monitor is not None and (integration_method == dormand_prince or integration_method in MULTISTEP_SOLVERS):
+        raise ValueError("The energy monitor needs a single-step method: the adaptive and multistep solvers are not supported")
+    if integration_method == dormand_prince:
+        return dormand_prince_solve(f, y0, t_values, dt, rtol=rtol, atol=atol)[0]
+    if integration_method in MULTISTEP_SOLVERS:
+        return MULTISTEP_SOLVERS[integration_method](f, y0, t_values, dt)
+
     num_steps = len(t_values)
-    y_values = np.zeros((num_steps, len(y0)))
+    y_values = np.zeros((num_steps,) + np.shape(y0))
     y_values[0] = y0
+    profiling.record_allocation('trajectory', y_values.nbytes)
+    profiling.count('steps', max(num_steps - 1, 0))
+    if monitor is not None:
+        monitor.start(t_values[0], y_values[0])
     
     if integration_method == leap_frog:
         y_values[1] = y_values[0] + dt*np.array(f(t_values[0], y_values[0]))
+        if monitor is not None and num_steps > 1:
+            y_values[1] = monitor.update(t_values[1], y_values[1])
         for i in range(2, num_steps):
             y_values[i] = leap_frog(f, t_values[i-1], y_values[i-1], y_values[i-2], dt)
+            if monitor is not None:
+                y_values[i] = monitor.update(t_values[i], y_values[i])
     else:
         for i in range(1, num_steps):
             y_values[i] = integration_method(f, t_values[i-1], y_values[i-1], dt)
+            if monitor is not None:
+                y_values[i] = monitor.update(t_values[i], y_values[i])
     
     return y_values
 
@@ -37,7 +74,7 @@ def runge_kutta2(f, t, y, dt):
     Parameters:
         f  (function): The function that defines the ODE dy/dt = f(t, y).
         t  (float): Current time.
-        y  (array-like): Current state vector.
+        y  (array-like): Current state vector, or an (N, 4) batch of state vectors.
         dt (float): Step size.
 
     Returns:
@@ -58,7 +95,7 @@ def runge_kutta4(f, t, y, dt):
     Parameters:
         f  (function): The function that defines the ODE dy/dt = f(t, y).
         t  (float): Current time.
-        y  (array-like): Current state vector.
+        y  (array-like): Current state vector, or an (N, 4) batch of state vectors.
         dt (float): Step size.
 
     Returns:
@@ -81,7 +118,7 @@ def leap_frog(f, t, y, y_prev, dt):
     Parameters:
         f      (function): The function that defines the ODE dy/dt = f(t, y).
         t      (float): Current time.
-        y      (array-like): Current state vector.
+        y      (array-like): Current state vector, or an (N, 4) batch of state vectors.
         y_prev (array-like): Previous state vector.
         dt     (float): Step size.
 
@@ -102,7 +139,7 @@ def euler(f, t, y0, dt):
     Parameters:
         f  (function): The function that defines the ODE dy/dt = f(t, y).
         t  (float): Current time.
-        y0 (array-like): Initial state vector.
+        y0 (array-like): Initial state vector, or an (N, 4) batch of state vectors.
         dt (float): Step size.
 
     Returns:
@@ -115,3 +152,214 @@ def euler(f, t, y0, dt):
     # Return the results
     return y
 
+
+def _symplectic_composition(f, t, y, dt, weights):
+    """
+    Composition of kick-drift-kick velocity Verlet steps of sizes w*dt for the separable Hamiltonian H = T(p) + V(q).
+
+    Only the force is used: the momentum components (dpx/dt, dpy/dt) of f(t, y), which depend on the positions alone.
+    The force at the end of each substep is reused as the first kick of the next one.
+
+    Parameters:
+        f       (function): The function that defines the ODE dy/dt = f(t, y).
+        t       (float): Current time.
+        y       (array-like): Current state vector, or an (N, 4) batch of state vectors.
+        dt      (float): Step size.
+        weights (list): Relative sizes of the Verlet substeps, summing to 1.
+
+    Returns:
+        array-like: New state vector after one time step.
+    """
+    y = np.array(y, dtype=float)
+    q = y[..., :2]
+    p = y[..., 2:]
+    force = np.array(f(t, y))[..., 2:]
+
+    for w in weights:
+        p = p + 0.5 * w * dt * force
+        q = q + w * dt * p
+        t = t + w * dt
+        force = np.array(f(t, np.concatenate([q, p], axis=-1)))[..., 2:]
+        p = p + 0.5 * w * dt * force
+
+    return np.concatenate([q, p], axis=-1)
+
+# Forest-Ruth / Yoshida 4th order: triple jump of velocity Verlet
+_FOREST_RUTH_W = 1 / (2 - 2**(1/3))
+_YOSHIDA4 = [_FOREST_RUTH_W, 1 - 2*_FOREST_RUTH_W, _FOREST_RUTH_W]
+
+# Yoshida (1990) 6th order, solution A, and 8th order, solution D: symmetric compositions w_m ... w_1 w_0 w_1 ... w_m
+_YOSHIDA6_W = [-1.17767998417887, 0.235573213359357, 0.784513610477560]
+_YOSHIDA8_W = [0.102799849391985, -1.96061023297549, 1.93813913762276, -0.158240635368243,
+               -1.44485223686048, 0.253693336566229, 0.914844246229740]
+
+_YOSHIDA6 = _YOSHIDA6_W[::-1] + [1 - 2*sum(_YOSHIDA6_W)] + _YOSHIDA6_W
+_YOSHIDA8 = _YOSHIDA8_W[::-1] + [1 - 2*sum(_YOSHIDA8_W)] + _YOSHIDA8_W
+
+def velocity_verlet(f, t, y, dt):
+    """
+    Velocity Verlet (kick-drift-kick leap-frog) 2nd order symplectic integration method for separable Hamiltonians.
+
+    Parameters:
+        f  (function): The function that defines the ODE dy/dt = f(t, y); only its force components are used.
+        t  (float): Current time.
+        y  (array-like): Current state vector, or an (N, 4) batch of state vectors.
+        dt (float): Step size.
+
+    Returns:
+        array-like: New state vector after one time step.
+    """
+    return _symplectic_composition(f, t, y, dt, [1.0])
+
+def yoshida4(f, t, y, dt):
+    """
+    Forest-Ruth / Yoshida 4th order symplectic integration method for separable Hamiltonians (three Verlet substeps).
+
+    Parameters:
+        f  (function): The function that defines the ODE dy/dt = f(t, y); only its force components are used.
+        t  (float): Current time.
+        y  (array-like): Current state vector, or an (N, 4) batch of state vectors.
+        dt (float): Step size.
+
+    Returns:
+        array-like: New state vector after one time step.
+    """
+    return _symplectic_composition(f, t, y, dt, _YOSHIDA4)
+
+def yoshida6(f, t, y, dt):
+    """
+    Yoshida 6th order symplectic integration method for separable Hamiltonians (seven Verlet substeps).
+
+    Parameters:
+        f  (function): The function that defines the ODE dy/dt = f(t, y); only its force components are used.
+        t  (float): Current time.
+        y  (array-like): Current state vector, or an (N, 4) batch of state vectors.
+        dt (float): Step size.
+
+    Returns:
+        array-like: New state vector after one time step.
+    """
+    return _symplectic_composition(f, t, y, dt, _YOSHIDA6)
+
+def yoshida8(f, t, y, dt):
+    """
+    Yoshida 8th order symplectic integration method for separable Hamiltonians (fifteen Verlet substeps).
+
+    Parameters:
+        f  (function): The function that defines the ODE dy/dt = f(t, y); only its force components are used.
+        t  (float): Current time.
+        y  (array-like): Current state vector, or an (N, 4) batch of state vectors.
+        dt (float): Step size.
+
+    Returns:
+        array-like: New state vector after one time step.
+    """
+    return _symplectic_composition(f, t, y, dt, _YOSHIDA8)
+
+def henon_heiles_stream(integration_method, f, y0, t0, dt, num_steps, chunk_size=10000, stride=1, reducers=None, y_prev=None,
+                        monitor=None, escape=None):
+    '''
+    Streaming version of henon_heiles: the trajectory is integrated lazily and yielded in fixed-size chunks,
+    so that the whole history never has to be held in memory and runs of any length proceed in constant memory.
+
+    Parameters:
+        integration_method (function): One of euler, runge_kutta4, runge_kutta2, leap_frog.
+        f  (function): The function that defines the ODE dy/dt = f(t, y).
+        y0  (array): Initial conditions for the state vector (x, y, px and py), or an (N, 4) array of initial conditions.
+        t0 (float): Initial time.
+        dt (float): Step size.
+        num_steps (int): Number of time samples, including the initial condition (the len(t_values) of henon_heiles).
+        chunk_size (int): Maximum number of kept samples per chunk.
+        stride (int): Keep every stride-th step only (decimation); the integration itself still uses every step.
+        reducers (list): Objects with an update(t_chunk, y_chunk) method (see the reducers module), fed with every chunk
+                         before it is yielded, so that summaries can be computed without keeping the chunks.
+        y_prev (array): For leap_frog, the state one step before y0, to resume an interrupted run exactly
+                        (by default the first step is bootstrapped with Euler).
+        monitor (EnergyMonitor): Online energy monitor checking every step, including the dropped ones (see henon_heiles).
+        escape (EscapeMonitor): Escape criterion of an ensemble (see escape.EscapeMonitor). The escaped orbits are retired
+                                and only the orbits still inside are integrated; their samples after the escape are nan,
+                                and the stream ends early once every orbit has escaped.
+
+    Yields:
+        tuple: (t_chunk, y_chunk) with the kept times and the states at those times, of shape (n,) and (n, 4) or (n, N, 4).
+    '''
+    reducers = reducers or []
+    f = profiling.counted(f)
+    y = np.array(y0, dtype=float)
+    shape = y.shape
+    if y_prev is not None:
+        y_prev = np.array(y_prev, dtype=float)
+
+    def new_chunk():
+        profiling.record_allocation('stream_chunks', chunk_size * (1 + np.prod(shape, dtype=int)) * 8)
+        return np.empty(chunk_size), np.empty((chunk_size,) + shape)
+
+    t_chunk, y_chunk = new_chunk()
+    n = 0
+    if monitor is not None:
+        monitor.start(t0, y)
+    if escape is not None:
+        if monitor is not None:
+            raise ValueError("The energy monitor does not support the escape criterion, which retires the escaped orbits")
+        escape.start(t0, y)
+        # The batch is compacted as the orbits escape: only the orbits still inside are integrated
+        y = y.reshape(-1, 4)
+        if y_prev is not None:
+            y_prev = y_prev.reshape(-1, 4)
+    for i in range(num_steps):
+        if i > 0:
+            t = t0 + (i-1)*dt
+            if integration_method == leap_frog:
+                # The first Leap-Frog step is bootstrapped with Euler, as in henon_heiles
+                y_new = y + dt*np.array(f(t, y)) if y_prev is None else leap_frog(f, t, y, y_prev, dt)
+                y_prev = y
+                y = y_new
+            else:
+                y = integration_method(f, t, y, dt)
+            if monitor is not None:
+                y = monitor.update(t + dt, y)
+            profiling.count('steps')
+
+        if i % stride == 0:
+            t_chunk[n] = t0 + i*dt
+            if escape is None:
+                y_chunk[n] = y
+            else:
+                y_chunk[n] = np.nan
+                y_chunk[n].reshape(-1, 4)[escape.orbit] = y
+            n += 1
+            if n == chunk_size:
+                for reducer in reducers:
+                    reducer.update(t_chunk, y_chunk)
+                yield t_chunk, y_chunk
+                t_chunk, y_chunk = new_chunk()
+                n = 0
+
+        if escape is not None and i > 0:
+            inside = escape.update(t0 + i*dt, y, last=i == num_steps - 1)
+            if inside is not None:
+                y = y[inside]
+                if y_prev is not None:
+                    y_prev = y_prev[inside]
+                if len(y) == 0:
+                    break
+
+    if escape is not None:
+        escape.finish(y)
+    if n > 0:
+        for reducer in reducers:
+            reducer.update(t_chunk[:n], y_chunk[:n])
+        yield t_chunk[:n], y_chunk[:n]
+
+# Integration methods by name, as selected on the command line
+METHODS = {
+    'rk2': runge_kutta2,
+    'rk4': runge_kutta4,
+    'leapfrog': leap_frog,
+    'euler': euler,
+    'verlet': velocity_verlet,
+    'yoshida4': yoshida4,
+    'yoshida6': yoshida6,
+    'yoshida8': yoshida8,
+    'dopri': dormand_prince,
+}
@@ -0,0 +1,275 @@
+import numpy as np
+
+from integration_methods import henon_heiles, runge_kutta2, runge_kutta4, leap_frog, euler
+import profiling
+from var import equations_motion, equations_motion_into
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Integration methods with a fused kernel
+FUSED_METHODS = (euler, runge_kutta2, runge_kutta4, leap_frog)
+
+# Evaluations of the right-hand side per step of the fused kernels
+_RHS_PER_STEP = {euler: 1, runge_kutta2: 2, runge_kutta4: 4, leap_frog: 1}
+
+def euler_into(y, dt, out, k):
+    """
+    Euler step of the Henon-Heiles system written into a preallocated buffer.
+
+    Parameters:
+        y   (numpy.ndarray): Current state vector, or an (N, 4) batch of state vectors.
+        dt  (float): Step size.
+        out (numpy.ndarray): Buffer receiving the new state vector.
+        k   (numpy.ndarray): Scratch buffer for the derivatives, with the same shape as y.
+
+    Returns:
+        numpy.ndarray: The out array.
+    """
+    equations_motion_into(y, k)
+    np.multiply(k, dt, out=k)
+    return np.add(y, k, out=out)
+
+def runge_kutta2_into(y, dt, out, k1, k2, tmp):
+    """
+    Runge-Kutta 2nd order step of the Henon-Heiles system written into a preallocated buffer.
+
+    Parameters:
+        y   (numpy.ndarray): Current state vector, or an (N, 4) batch of state vectors.
+        dt  (float): Step size.
+        out (numpy.ndarray): Buffer receiving the new state vector.
+        k1, k2, tmp (numpy.ndarray): Scratch buffers for the stages, with the same shape as y.
+
+    Returns:
+        numpy.ndarray: The out array.
+    """
+    equations_motion_into(y, k1)
+    np.multiply(k1, dt, out=tmp)
+    np.add(y, tmp, out=tmp)
+    equations_motion_into(tmp, k2)
+
+    np.add(k1, k2, out=k1)
+    np.multiply(k1, 0.5 * dt, out=k1)
+    return np.add(y, k1, out=out)
+
+def runge_kutta4_into(y, dt, out, k1, k2, k3, k4, tmp):
+    """
+    Runge-Kutta 4th order step of the Henon-Heiles system written into a preallocated buffer.
+
+    Parameters:
+        y   (numpy.ndarray): Current state vector, or an (N, 4) batch of state vectors.
+        dt  (float): Step size.
+        out (numpy.ndarray): Buffer receiving the new state vector.
+        k1, k2, k3, k4, tmp (numpy.ndarray): Scratch buffers for the stages, with the same shape as y.
+
+    Returns:
+        numpy.ndarray: The out array.
+    """
+    equations_motion_into(y, k1)
+    np.multiply(k1, dt/2, out=tmp)
+    np.add(y, tmp, out=tmp)
+    equations_motion_into(tmp, k2)
+    np.multiply(k2, dt/2, out=tmp)
+    np.add(y, tmp, out=tmp)
+    equations_motion_into(tmp, k3)
+    np.multiply(k3, dt, out=tmp)
+    np.add(y, tmp, out=tmp)
+    equations_motion_into(tmp, k4)
+
+    # k1 + 2*k2 + 2*k3 + k4, accumulated into k2
+    np.add(k2, k3, out=k2)
+    np.multiply(k2, 2, out=k2)
+    np.add(k2, k1, out=k2)
+    np.add(k2, k4, out=k2)
+    np.multiply(k2, dt/6, out=k2)
+    return np.add(y, k2, out=out)
+
+def leap_frog_into(y, y_prev, dt, out, k):
+    """
+    Leap-Frog step of the Henon-Heiles system written into a preallocated buffer.
+
+    Parameters:
+        y      (numpy.ndarray): Current state vector, or an (N, 4) batch of state vectors.
+        y_prev (numpy.ndarray): Previous state vector.
+        dt     (float): Step size.
+        out    (numpy.ndarray): Buffer receiving the new state vector.
+        k      (numpy.ndarray): Scratch buffer for the derivatives, with the same shape as y.
+
+    Returns:
+        numpy.ndarray: The out array.
+    """
+    equations_motion_into(y, k)
+    np.multiply(k, 2*dt, out=k)
+    return np.add(y_prev, k, out=out)
+
+def _henon_heiles_numpy(integration_method, y_values, dt, resume=False):
+    """
+    Fill y_values[1:] in place with the fused NumPy kernels, reusing the same scratch buffers at every step.
+    With resume, the Leap-Frog steps start from the two given samples y_values[0] and y_values[1].
+    """
+    shape = y_values.shape[1:]
+    scratch = [np.empty(shape) for _ in range(5)]
+    num_steps = len(y_values)
+
+    if integration_method == leap_frog:
+        if not resume:
+            euler_into(y_values[0], dt, y_values[1], scratch[0])
+        for i in range(2, num_steps):
+            leap_frog_into(y_values[i-1], y_values[i-2], dt, y_values[i], scratch[0])
+    elif integration_method == euler:
+        for i in range(1, num_steps):
+            euler_into(y_values[i-1], dt, y_values[i], scratch[0])
+    elif integration_method == runge_kutta2:
+        for i in range(1, num_steps):
+            runge_kutta2_into(y_values[i-1], dt, y_values[i], *scratch[:3])
+    else:
+        for i in range(1, num_steps):
+            runge_kutta4_into(y_values[i-1], dt, y_values[i], *scratch)
+
+def _jit(function):
+    """
+    Compile function with numba when it is installed (compilation is deferred to the first call), otherwise return it unchanged.
+    """
+    if numba is None:
+        return function
+    return numba.njit(cache=True)(function)
+
+@_jit
+def _rhs(X, Y, px, py):
+    """
+    Scalar right-hand side of the Henon-Heiles system, shared by the JIT-compiled loops.
+    """
+    return px, py, -X * (1 + 2 * Y), Y * (Y - 1) - X**2
+
+@_jit
+def _euler_loop(y_values, dt):
+    """
+    Euler integration over a (T, N, 4) trajectory buffer with scalar arithmetic only.
+    """
+    for i in range(1, y_values.shape[0]):
+        for n in range(y_values.shape[1]):
+            X, Y, px, py = y_values[i-1, n, 0], y_values[i-1, n, 1], y_values[i-1, n, 2], y_values[i-1, n, 3]
+            k = _rhs(X, Y, px, py)
+            y_values[i, n, 0] = X + dt * k[0]
+            y_values[i, n, 1] = Y + dt * k[1]
+            y_values[i, n, 2] = px + dt * k[2]
+            y_values[i, n, 3] = py + dt * k[3]
+
+@_jit
+def _runge_kutta2_loop(y_values, dt):
+    """
+    Runge-Kutta 2nd order integration over a (T, N, 4) trajectory buffer with scalar arithmetic only.
+    """
+    for i in range(1, y_values.shape[0]):
+        for n in range(y_values.shape[1]):
+            X, Y, px, py = y_values[i-1, n, 0], y_values[i-1, n, 1], y_values[i-1, n, 2], y_values[i-1, n, 3]
+            k1 = _rhs(X, Y, px, py)
+            k2 = _rhs(X + dt*k1[0], Y + dt*k1[1], px + dt*k1[2], py + dt*k1[3])
+            y_values[i, n, 0] = X + 0.5 * dt * (k1[0] + k2[0])
+            y_values[i, n, 1] = Y + 0.5 * dt * (k1[1] + k2[1])
+            y_values[i, n, 2] = px + 0.5 * dt * (k1[2] + k2[2])
+            y_values[i, n, 3] = py + 0.5 * dt * (k1[3] + k2[3])
+
+@_jit
+def _runge_kutta4_loop(y_values, dt):
+    """
+    Runge-Kutta 4th order integration over a (T, N, 4) trajectory buffer with scalar arithmetic only.
+    """
+    for i in range(1, y_values.shape[0]):
+        for n in range(y_values.shape[1]):
+            X, Y, px, py = y_values[i-1, n, 0], y_values[i-1, n, 1], y_values[i-1, n, 2], y_values[i-1, n, 3]
+            k1 = _rhs(X, Y, px, py)
+            k2 = _rhs(X + dt/2*k1[0], Y + dt/2*k1[1], px + dt/2*k1[2], py + dt/2*k1[3])
+            k3 = _rhs(X + dt/2*k2[0], Y + dt/2*k2[1], px + dt/2*k2[2], py + dt/2*k2[3])
+            k4 = _rhs(X + dt*k3[0], Y + dt*k3[1], px + dt*k3[2], py + dt*k3[3])
+            y_values[i, n, 0] = X + dt/6 * (k1[0] + 2*k2[0] + 2*k3[0] + k4[0])
+            y_values[i, n, 1] = Y + dt/6 * (k1[1] + 2*k2[1] + 2*k3[1] + k4[1])
+            y_values[i, n, 2] = px + dt/6 * (k1[2] + 2*k2[2] + 2*k3[2] + k4[2])
+            y_values[i, n, 3] = py + dt/6 * (k1[3] + 2*k2[3] + 2*k3[3] + k4[3])
+
+@_jit
+def _leap_frog_loop(y_values, dt):
+    """
+    Leap-Frog integration over a (T, N, 4) trajectory buffer, bootstrapped with one Euler step.
+    """
+    _euler_loop(y_values[:2], dt)
+    _leap_frog_resume_loop(y_values, dt)
+
+@_jit
+def _leap_frog_resume_loop(y_values, dt):
+    """
+    Leap-Frog integration over a (T, N, 4) trajectory buffer whose first two samples are given.
+    """
+    for i in range(2, y_values.shape[0]):
+        for n in range(y_values.shape[1]):
+            k = _rhs(y_values[i-1, n, 0], y_values[i-1, n, 1], y_values[i-1, n, 2], y_values[i-1, n, 3])
+            y_values[i, n, 0] = y_values[i-2, n, 0] + 2 * dt * k[0]
+            y_values[i, n, 1] = y_values[i-2, n, 1] + 2 * dt * k[1]
+            y_values[i, n, 2] = y_values[i-2, n, 2] + 2 * dt * k[2]
+            y_values[i, n, 3] = y_values[i-2, n, 3] + 2 * dt * k[3]
+
+_compiled_loops = {
+    euler: _euler_loop,
+    runge_kutta2: _runge_kutta2_loop,
+    runge_kutta4: _runge_kutta4_loop,
+    leap_frog: _leap_frog_loop,
+}
+
+def henon_heiles_fused(integration_method, y0, t_values, dt, backend='auto', y_prev=None):
+    """
+    Integrate the Henon-Heiles system with a fused, allocation-free stepping kernel.
+
+    This is a specialized fast path for var.equations_motion: every step is written in place into the preallocated
+    trajectory, and the intermediate stages reuse a fixed set of scratch buffers instead of allocating new arrays.
+    The generic henon_heiles() in integration_methods remains the entry point for arbitrary right-hand sides.
+
+    The 'numpy' backend pays off for ensembles, where each in-place operation covers all the orbits; for a lone orbit
+    the per-call overhead of the many small in-place operations dominates, and it is slower than the generic path. The
+    'auto' backend therefore uses the 'numba' backend when numba is installed, the 'numpy' backend for ensembles
+    otherwise, and the generic henon_heiles() for a lone orbit.
+
+    Parameters:
+        integration_method (function): One of euler, runge_kutta2, runge_kutta4, leap_frog from integration_methods.
+        y0       (array): Initial conditions for the state vector (x, y, px and py), or an (N, 4) array of initial conditions.
+        t_values (array): Simulation time.
+        dt       (float): Step size.
+        backend  (str): 'numpy' for the in-place NumPy kernels, 'numba' for JIT-compiled scalar loops (requires numba),
+                        or 'auto' for the fastest available one.
+        y_prev   (array): For leap_frog, the state one step before y0, to resume an interrupted run exactly
+                         (by default the first step is bootstrapped with Euler).
+
+    Returns:
+        array: State vector after the whole simulation time, of shape (len(t), 4) or (len(t), N, 4) for an ensemble.
+    """
+    if integration_method not in FUSED_METHODS:
+        raise ValueError(f"No fused kernel for integration method {getattr(integration_method, '__name__', integration_method)}")
+    resume = y_prev is not None and integration_method == leap_frog
+    if backend == 'auto':
+        if numba is None and np.ndim(y0) == 1 and not resume:
+            return henon_heiles(integration_method, equations_motion, y0, t_values, dt)
+        backend = 'numpy' if numba is None else 'numba'
+
+    # A resumed Leap-Frog run starts one sample earlier, from y_prev
+    buffer = np.zeros((len(t_values) + resume,) + np.shape(y0))
+    if resume:
+        buffer[0] = y_prev
+    buffer[int(resume)] = y0
+    y_values = buffer[int(resume):]
+    profiling.record_allocation('trajectory', buffer.nbytes)
+    profiling.count('steps', max(len(t_values) - 1, 0))
+    profiling.count('rhs_calls', max(len(t_values) - 1, 0) * _RHS_PER_STEP[integration_method])
+
+    if backend == 'numpy':
+        _henon_heiles_numpy(integration_method, buffer, dt, resume)
+    elif backend == 'numba':
+        if numba is None:
+            raise ImportError("The numba backend requires the numba package: pip install numba")
+        # The compiled loops always work on a (T, N, 4) view of the trajectory
+        loop = _leap_frog_resume_loop if resume else _compiled_loops[integration_method]
+        loop(buffer.reshape(len(buffer), -1, 4), dt)
+    else:
+        raise ValueError(f"Unknown backend {backend!r}: expected 'auto', 'numpy' or 'numba'")
+
+    return y_values
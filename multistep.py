@@ -0,0 +1,216 @@
+import numpy as np
+
+import profiling
+
+# Adams-Bashforth (explicit) and Adams-Moulton (implicit) weights of order k, applied to the derivatives
+# f_n, f_n-1, ..., f_n-k+1 and f_n+1, f_n, ..., f_n-k+2 respectively
+_ADAMS_BASHFORTH = {
+    2: [3/2, -1/2],
+    3: [23/12, -16/12, 5/12],
+    4: [55/24, -59/24, 37/24, -9/24],
+    5: [1901/720, -2774/720, 2616/720, -1274/720, 251/720],
+    6: [4277/1440, -7923/1440, 9982/1440, -7298/1440, 2877/1440, -475/1440],
+}
+_ADAMS_MOULTON = {
+    2: [1/2, 1/2],
+    3: [5/12, 8/12, -1/12],
+    4: [9/24, 19/24, -5/24, 1/24],
+    5: [251/720, 646/720, -264/720, 106/720, -19/720],
+    6: [475/1440, 1427/1440, -798/1440, 482/1440, -173/1440, 27/1440],
+}
+
+# Explicit Stormer weights of q_n+1 - 2 q_n + q_n-1 = dt^2 * sum_j w_j a_n-j, by order (the 2nd order one is Verlet)
+_STORMER = {
+    2: [1],
+    3: [13/12, -2/12, 1/12],
+    4: [14/12, -5/12, 4/12, -1/12],
+    5: [299/240, -176/240, 194/240, -96/240, 19/240],
+    6: [317/240, -266/240, 374/240, -276/240, 109/240, -18/240],
+}
+
+# Number of RK4 substeps per step of the warm-up, so that the starting values do not limit the accuracy
+_WARMUP_SUBSTEPS = 4
+
+class RingBuffer:
+    """
+    Fixed-size history of the last values of a multistep method (derivatives or accelerations).
+
+    The values are never moved: a new value overwrites the oldest one, and the weights of a linear combination are
+    rotated instead to follow the position of the newest value (see rotations).
+    """
+    def __init__(self, size, shape):
+        self.values = np.zeros((size,) + shape)
+        self.flat = self.values.reshape(size, -1)
+        self.head = -1
+
+    def push(self, value):
+        self.head = (self.head + 1) % len(self.values)
+        self.values[self.head] = value
+
+    def rotations(self, weights):
+        """
+        Weights of a linear combination sum_j weights[j] * value_n-j of the newest values (weights[0] for the newest),
+        rotated for every position of the newest value in the buffer.
+        """
+        size = len(self.values)
+        table = np.zeros((size, size))
+        for head in range(size):
+            table[head, (head - np.arange(len(weights))) % size] = weights
+        return table
+
+    def combine(self, rotations):
+        """
+        Linear combination of the newest values with weights prepared by rotations.
+        """
+        return (rotations[self.head] @ self.flat).reshape(self.values.shape[1:])
+
+def _warmup(f, t_values, y_values, dt, num_steps):
+    """
+    Fill y_values[1:num_steps] with RK4 substeps, to start a multistep method.
+    """
+    from integration_methods import runge_kutta4
+
+    for i in range(1, min(num_steps, len(t_values))):
+        y = y_values[i-1]
+        for j in range(_WARMUP_SUBSTEPS):
+            y = runge_kutta4(f, t_values[i-1] + j*dt/_WARMUP_SUBSTEPS, y, dt/_WARMUP_SUBSTEPS)
+        y_values[i] = y
+
+def adams_bashforth_moulton_solve(f, y0, t_values, dt, order=4):
+    """
+    Adams-Bashforth-Moulton predictor-corrector integration (PECE mode) of any first-order system.
+
+    Every step predicts with the explicit Adams-Bashforth formula, evaluates the derivative at the prediction, corrects
+    with the implicit Adams-Moulton formula and evaluates the derivative at the corrected state: two evaluations of f
+    per step at any order, instead of four for RK4. The past derivatives are kept in a ring buffer, and the first
+    order - 1 steps are made with RK4.
+
+    Parameters:
+        f  (function): The function that defines the ODE dy/dt = f(t, y).
+        y0 (array): Initial conditions for the state vector (x, y, px and py), or an (N, 4) array of initial conditions.
+        t_values (array): Simulation time.
+        dt (float): Step size.
+        order (int): Order of the method, from 2 to 6.
+
+    Returns:
+        array: State vector after the whole simulation time, of shape (len(t), 4) or (len(t), N, 4) for an ensemble.
+    """
+    if order not in _ADAMS_BASHFORTH:
+        raise ValueError(f"Unsupported order {order} for Adams-Bashforth-Moulton: expected one of {list(_ADAMS_BASHFORTH)}")
+    predictor = np.array(_ADAMS_BASHFORTH[order])
+    corrector = np.array(_ADAMS_MOULTON[order])
+
+    num_steps = len(t_values)
+    y_values = np.zeros((num_steps,) + np.shape(y0))
+    y_values[0] = y0
+    profiling.record_allocation('trajectory', y_values.nbytes)
+    _warmup(f, t_values, y_values, dt, order)
+
+    history = RingBuffer(order, np.shape(y0))
+    predictor, corrector_history = history.rotations(predictor), history.rotations(corrector[1:])
+    for i in range(min(order, num_steps)):
+        history.push(f(t_values[i], y_values[i]))
+
+    for i in range(order, num_steps):
+        y = y_values[i-1]
+        # Predict, evaluate
+        y_predicted = y + dt * history.combine(predictor)
+        f_predicted = np.asarray(f(t_values[i], y_predicted))
+        # Correct (the newest derivative of the Adams-Moulton formula is the one at the prediction), evaluate
+        y_values[i] = y + dt * (corrector[0] * f_predicted + history.combine(corrector_history))
+        history.push(f(t_values[i], y_values[i]))
+    profiling.count('steps', max(num_steps - 1, 0))
+
+    return y_values
+
+def stormer_cowell_solve(f, y0, t_values, dt, order=4):
+    """
+    Stormer-Cowell integration of the second-order form q'' = a(q) of a separable Hamiltonian system.
+
+    The positions are advanced with the explicit Stormer formula q_n+1 = 2 q_n - q_n-1 + dt^2 sum_j w_j a_n-j and the
+    momenta with the Adams-Moulton formula on the accelerations, which only needs the acceleration at the new
+    positions: one evaluation of f per step at any order. The past accelerations are kept in a ring buffer, and the
+    first order - 1 steps are made with RK4.
+
+    Parameters:
+        f  (function): The function that defines the ODE dy/dt = f(t, y); only its force components are used, and they
+                       must depend on the positions alone.
+        y0 (array): Initial conditions for the state vector (x, y, px and py), or an (N, 4) array of initial conditions.
+        t_values (array): Simulation time.
+        dt (float): Step size.
+        order (int): Order of the method, from 2 to 6.
+
+    Returns:
+        array: State vector after the whole simulation time, of shape (len(t), 4) or (len(t), N, 4) for an ensemble.
+    """
+    if order not in _STORMER:
+        raise ValueError(f"Unsupported order {order} for Stormer-Cowell: expected one of {list(_STORMER)}")
+    stormer = np.array(_STORMER[order])
+    moulton = np.array(_ADAMS_MOULTON[order])
+    # Number of past accelerations used by either formula, and first step of the method (it needs q_n-1)
+    size = max(len(stormer), len(moulton) - 1)
+    start = max(size, 2)
+
+    num_steps = len(t_values)
+    y_values = np.zeros((num_steps,) + np.shape(y0))
+    y_values[0] = y0
+    profiling.record_allocation('trajectory', y_values.nbytes)
+    _warmup(f, t_values, y_values, dt, start)
+
+    history = RingBuffer(size, np.shape(y0)[:-1] + (2,))
+    stormer, moulton_history = history.rotations(stormer), history.rotations(moulton[1:])
+    for i in range(min(start, num_steps)):
+        history.push(np.asarray(f(t_values[i], y_values[i]))[..., 2:])
+
+    # Positions and momenta views of the trajectory
+    q_values, p_values = y_values[..., :2], y_values[..., 2:]
+    for i in range(start, num_steps):
+        q_values[i] = 2 * q_values[i-1] - q_values[i-2] + dt**2 * history.combine(stormer)
+        # The acceleration depends on the positions only: the momenta of the new state are not needed
+        acceleration = np.asarray(f(t_values[i], y_values[i]))[..., 2:]
+        p_values[i] = p_values[i-1] + dt * (moulton[0] * acceleration + history.combine(moulton_history))
+        history.push(acceleration)
+    profiling.count('steps', max(num_steps - 1, 0))
+
+    return y_values
+
+def adams_bashforth_moulton(f, t, y, dt):
+    """
+    Adams-Bashforth-Moulton 4th order predictor-corrector method.
+
+    A multistep method needs the history of the integration: henon_heiles dispatches to adams_bashforth_moulton_solve
+    when this method is selected. As a single step without history, it is the RK4 step used for the warm-up.
+
+    Parameters:
+        f  (function): The function that defines the ODE dy/dt = f(t, y).
+        t  (float): Current time.
+        y  (array-like): Current state vector, or an (N, 4) batch of state vectors.
+        dt (float): Step size.
+
+    Returns:
+        array-like: New state vector after one time step.
+    """
+    from integration_methods import runge_kutta4
+    return runge_kutta4(f, t, y, dt)
+
+def stormer_cowell(f, t, y, dt):
+    """
+    Stormer-Cowell 4th order method for separable Hamiltonians.
+
+    A multistep method needs the history of the integration: henon_heiles dispatches to stormer_cowell_solve when this
+    method is selected. As a single step without history, it is the RK4 step used for the warm-up.
+
+    Parameters:
+        f  (function): The function that defines the ODE dy/dt = f(t, y).
+        t  (float): Current time.
+        y  (array-like): Current state vector, or an (N, 4) batch of state vectors.
+        dt (float): Step size.
+
+    Returns:
+        array-like: New state vector after one time step.
+    """
+    from integration_methods import runge_kutta4
+    return runge_kutta4(f, t, y, dt)
+
+# Solvers of the multistep methods, as dispatched by henon_heiles
+MULTISTEP_SOLVERS = {adams_bashforth_moulton: adams_bashforth_moulton_solve, stormer_cowell: stormer_cowell_solve}
@@ -0,0 +1,230 @@
+import numpy as np
+
+import cache
+from chaos import _extended_system
+from initial_conditions import section_samples
+from integration_methods import runge_kutta4
+from var import equations_motion, hamiltonian, variational_equations
+
+# Number of Newton iterations on the step size that place a crossing on the x = 0 plane
+_CROSSING_ITERATIONS = 3
+
+# Largest condition number of J - I for a Newton step of the periodic orbit search
+_MAX_CONDITION = 1e12
+
+def _initial_states(energy, points, f=equations_motion, hamiltonian=hamiltonian):
+    """
+    States [0, y, px, py] of section points (y, py) on the energy shell (px > 0) with the identity as deviation vectors,
+    and the derivative of the states with respect to (y, py), of shape (N, 4, 2). Points outside the energy curve get nan.
+    The potential V(0, y) = H(0, y, 0, 0) and its derivative V_y = -dpy/dt come from hamiltonian and f.
+    """
+    y, py = points[:, 0], points[:, 1]
+    zeros = np.zeros_like(y)
+    kinetic = 2 * (energy - np.asarray(hamiltonian(np.stack([zeros, y, zeros, zeros], axis=-1)))) - py**2
+    px = np.sqrt(np.where(kinetic > 0, kinetic, np.nan))
+    states = np.stack([zeros, y, px, py], axis=-1)
+    z = np.concatenate([states, np.tile(np.eye(4).ravel(), (len(y), 1))], axis=1)
+
+    # px is solved from the energy, px dpx = -V_y dy - py dpy: dpx/dy = -V_y(0, y) / px and dpx/dpy = -py / px
+    potential_y = -np.asarray(f(0.0, states))[:, 3]
+    tangent = np.zeros((len(y), 4, 2))
+    tangent[:, 1, 0] = 1
+    tangent[:, 3, 1] = 1
+    tangent[:, 2, 0] = -potential_y / px
+    tangent[:, 2, 1] = -py / px
+    return z, tangent
+
+def return_map(energy, points, multiplicity=1, dt=0.01, max_time=200.0, f=equations_motion, variational=variational_equations,
+               hamiltonian=hamiltonian):
+    """
+    Return map of the x = 0 section (crossings with increasing x) and its Jacobian, for a batch of section points.
+
+    The orbits are integrated with RK4 together with their variational equations, so that the Jacobian of the map comes
+    from the same run: it is the state transition matrix at the crossing, corrected for the change of the crossing time
+    and restricted to the (y, py) coordinates. Every crossing is placed on the plane by Newton iterations on the size of
+    the last step. Orbits are retired from the batch as soon as they reach their multiplicity-th crossing.
+
+    Parameters:
+        energy (float): Total energy.
+        points (array): Section points (y, py), of shape (N, 2).
+        multiplicity (int): Number of crossings of the map (the map is P^multiplicity).
+        dt (float): Step size.
+        max_time (float): Largest integration time; orbits without enough crossings (e.g. escaping ones) get nan.
+        f (function): The function that defines the ODE dy/dt = f(t, y).
+        variational (function): Derivatives of the deviation vectors (see var.variational_equations).
+        hamiltonian (function): Energy of the states, which places the section points on the energy shell (f, variational
+                                and hamiltonian may be those of a potential.PolynomialPotential).
+
+    Returns:
+        dict: 'points' (the successive crossings, of shape (N, multiplicity, 2)), 'time' (the time of the last crossing,
+              of shape (N,)) and 'jacobian' (the Jacobian of P^multiplicity, of shape (N, 2, 2)).
+    """
+    points = np.atleast_2d(np.asarray(points, dtype=float))
+    f_ext = _extended_system(f, variational, 4)
+    z, tangent = _initial_states(energy, points, f, hamiltonian)
+    n_points = len(points)
+
+    results = {
+        'points': np.full((n_points, multiplicity, 2), np.nan),
+        'time': np.full(n_points, np.nan),
+        'jacobian': np.full((n_points, 2, 2), np.nan),
+    }
+    orbit = np.flatnonzero(np.isfinite(z[:, 2]))
+    z, tangent = z[orbit], tangent[orbit]
+    crossings = np.zeros(len(orbit), dtype=int)
+    if len(orbit) == 0:
+        return results
+
+    t = 0.0
+    for step in range(1, int(np.ceil(max_time / dt)) + 1):
+        z_new = runge_kutta4(f_ext, t, z, dt)
+        crossed = np.flatnonzero((z[:, 0] < 0) & (z_new[:, 0] >= 0))
+        if len(crossed):
+            # Step from the last state before the crossing to the plane, refining the step size by Newton iterations
+            z_prev = z[crossed]
+            tau = -z_prev[:, 0] / z_prev[:, 2]
+            for _ in range(_CROSSING_ITERATIONS):
+                z_cross = runge_kutta4(f_ext, t, z_prev, tau[:, np.newaxis])
+                tau = tau - z_cross[:, 0] / z_cross[:, 2]
+            z_cross = runge_kutta4(f_ext, t, z_prev, tau[:, np.newaxis])
+
+            ids = orbit[crossed]
+            results['points'][ids, crossings[crossed]] = z_cross[:, [1, 3]]
+            crossings[crossed] += 1
+
+            done = crossings[crossed] == multiplicity
+            if done.any():
+                lanes, z_done = crossed[done], z_cross[done]
+                results['time'][orbit[lanes]] = t + tau[done]
+                # The deviation vectors are the columns of the state transition matrix; the crossing time moves with
+                # the state, which projects the variations along the flow onto the plane
+                transition = z_done[:, 4:].reshape(-1, 4, 4).transpose(0, 2, 1)
+                flow = np.asarray(f(0.0, z_done[:, :4]))
+                projection = np.eye(4) - flow[:, :, np.newaxis] * np.eye(4)[0] / flow[:, 0, np.newaxis, np.newaxis]
+                jacobian = projection @ transition @ tangent[lanes]
+                results['jacobian'][orbit[lanes]] = jacobian[:, [1, 3]]
+
+                keep = crossings < multiplicity
+                z_new, orbit, tangent, crossings = z_new[keep], orbit[keep], tangent[keep], crossings[keep]
+                if len(orbit) == 0:
+                    break
+        z = z_new
+        t = step * dt
+
+    return results
+
+def _minimal_multiplicity(point, crossings, tolerance):
+    """
+    Smallest number of crossings after which an orbit of the map comes back to its starting point.
+    """
+    for k in range(1, len(crossings) + 1):
+        if len(crossings) % k == 0 and np.linalg.norm(crossings[k-1] - point) < tolerance:
+            return k
+    return len(crossings)
+
+def find_periodic_orbits(energy, seeds=None, n_seeds=200, multiplicities=(1,), tolerance=1e-9, max_iterations=30, max_step=0.05,
+                         dt=0.01, max_time=200.0, dedupe_tolerance=1e-6, f=equations_motion, variational=variational_equations,
+                         hamiltonian=hamiltonian):
+    """
+    Find periodic orbits by Newton iterations on the return map of the x = 0 section, from many seed points at once.
+
+    The fixed points of P^k (the orbits that cross the section k times per period) solve P^k(s) - s = 0, and every Newton
+    iteration updates all the seeds together with the Jacobians of the map given by the variational equations (see
+    return_map). The converged seeds are deduplicated: an orbit is kept once, whatever seed and crossing it was found
+    from, and the orbits of a lower multiplicity found again at a higher one are discarded.
+
+    The stability of an orbit follows from the eigenvalues of the monodromy matrix of the section map (the Jacobian of
+    P^k at the orbit), whose determinant is 1: the orbit is stable (elliptic, at the center of an island chain) when
+    |trace| < 2 and the eigenvalues are on the unit circle, and unstable (hyperbolic, a saddle) when |trace| > 2.
+
+    Parameters:
+        energy (float): Total energy.
+        seeds (array): Seed points (y, py) of shape (N, 2); by default n_seeds Halton points of the section.
+        n_seeds (int): Number of default seed points.
+        multiplicities (tuple): Numbers of crossings per period of the orbits to look for.
+        tolerance (float): Convergence tolerance on |P^k(s) - s|.
+        max_iterations (int): Largest number of Newton iterations.
+        max_step (float): Largest length of a Newton step, which keeps the iterations on the section.
+        dt (float): Step size of the integration.
+        max_time (float): Largest integration time of every evaluation of the map, per crossing.
+        dedupe_tolerance (float): Distance below which two section points belong to the same orbit.
+        f, variational, hamiltonian: The system (see return_map); the default seeds sample the Henon-Heiles section, so
+                                     pass seeds for another potential.
+
+    Returns:
+        dict: Arrays with one entry per orbit: 'points' (a section point (y, py), of shape (M, 2)), 'multiplicity',
+              'period' (the time of one period), 'trace', 'eigenvalues' (of the monodromy matrix, complex, of shape
+              (M, 2)) and 'stable'; and the section points of all the orbits, 'section_points' (of shape (K, 2)) with the
+              index of their orbit, 'section_orbit'.
+    """
+    if seeds is None:
+        seeds = section_samples(energy, n_seeds, 'halton')[:, [1, 3]]
+    seeds = np.atleast_2d(np.asarray(seeds, dtype=float))
+
+    orbits = []
+    for multiplicity in multiplicities:
+        s = seeds.copy()
+        active = np.arange(len(s))
+        converged = np.zeros(len(s), dtype=bool)
+        for _ in range(max_iterations):
+            mapped = return_map(energy, s[active], multiplicity, dt, max_time * multiplicity, f, variational, hamiltonian)
+            residual = mapped['points'][:, -1] - s[active]
+            failed = ~np.isfinite(residual).all(axis=1)
+            done = ~failed & (np.linalg.norm(residual, axis=1) < tolerance)
+            converged[active[done]] = True
+
+            # Newton step on P^k(s) - s, limited in length; the lanes where J - I is singular or ill-conditioned
+            # (parabolic orbits, tangent crossings) cannot take a step and are dropped unconverged
+            iterate = np.flatnonzero(~failed & ~done)
+            jacobian = mapped['jacobian'][iterate] - np.eye(2)
+            finite = np.isfinite(jacobian).all(axis=(1, 2))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                condition = np.linalg.cond(np.where(finite[:, np.newaxis, np.newaxis], jacobian, 0))
+            solvable = finite & (condition < _MAX_CONDITION)
+            iterate, jacobian = iterate[solvable], jacobian[solvable]
+            step = -np.linalg.solve(jacobian, residual[iterate][..., np.newaxis])[..., 0]
+            length = np.linalg.norm(step, axis=1, keepdims=True)
+            s[active[iterate]] += step * np.minimum(1, max_step / np.maximum(length, 1e-300))
+            active = active[iterate]
+            if len(active) == 0:
+                break
+
+        # Final evaluation of the converged orbits, for their crossings, periods and monodromy matrices
+        points = s[converged]
+        mapped = return_map(energy, points, multiplicity, dt, max_time * multiplicity, f, variational, hamiltonian)
+        for i, point in enumerate(points):
+            crossings = mapped['points'][i]
+            if _minimal_multiplicity(point, crossings, dedupe_tolerance) < multiplicity:
+                continue
+            if any(np.min(np.linalg.norm(orbit['section_points'] - point, axis=1)) < dedupe_tolerance for orbit in orbits):
+                continue
+            monodromy = mapped['jacobian'][i]
+            orbits.append({
+                'point': point,
+                'multiplicity': multiplicity,
+                'period': mapped['time'][i],
+                'trace': np.trace(monodromy),
+                'eigenvalues': np.linalg.eigvals(monodromy).astype(complex),
+                'section_points': np.concatenate([[point], crossings[:-1]]),
+            })
+
+    return {
+        'points': np.array([orbit['point'] for orbit in orbits]).reshape(-1, 2),
+        'multiplicity': np.array([orbit['multiplicity'] for orbit in orbits], dtype=int),
+        'period': np.array([orbit['period'] for orbit in orbits], dtype=float),
+        'trace': np.array([orbit['trace'] for orbit in orbits], dtype=float),
+        'eigenvalues': np.array([orbit['eigenvalues'] for orbit in orbits], dtype=complex).reshape(-1, 2),
+        'stable': np.array([abs(orbit['trace']) < 2 for orbit in orbits], dtype=bool),
+        'section_points': np.concatenate([orbit['section_points'] for orbit in orbits]) if orbits else np.empty((0, 2)),
+        'section_orbit': np.repeat(np.arange(len(orbits)), [orbit['multiplicity'] for orbit in orbits]).astype(int),
+    }
+
+def periodic_orbits(energy, n_seeds=200, multiplicities=(1,), **options):
+    """
+    Cached version of find_periodic_orbits, keyed on the energy and the search options (see cache.cached), so that the
+    overlays of the island chains and saddles of an energy are only computed once.
+
+    Returns:
+        dict: Read-only arrays returned by find_periodic_orbits.
+    """
+    return cache.cached(find_periodic_orbits, float(energy), n_seeds=n_seeds, multiplicities=tuple(multiplicities), **options)
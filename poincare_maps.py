@@ -1,5 +1,9 @@
 import numpy as np
-import matplotlib.pyplot as plt
+
+import profiling
+import var
+from reducers import SectionCrossings
+from sections import find_crossings
 
 def plot_henon_heiles(t, x, y, px, py, color, title,axs):
     """
@@ -19,30 +23,145 @@ def plot_henon_heiles(t, x, y, px, py, color, title,axs):
     """
     ax1,ax2,ax3=axs
 
-    # Plot trajectories in the x-y plane
-    ax1.scatter(x, y, s=1, c=color)
-    ax1.set_xlabel('x', fontsize=12)
-    ax1.set_ylabel('y', fontsize=12)
-
-    # Create a Poincaré map by selecting points within a range of x values
-    selected_y = []
-    selected_py = []
-    for i in range(len(x)):
-        if -0.05 < x[i] < 0.05:
-            selected_y.append(y[i])
-            selected_py.append(py[i])
-
-    ax2.scatter(selected_y, selected_py, s=1, c=color,alpha=0.7)
-    ax2.set_xlabel('y', fontsize=12)
-    ax2.set_ylabel('py', fontsize=12)
-    ax2.set_title(f'{title}', fontsize=16)
-
-    # Plot energy evolution over time
-    hamiltonian = (px**2) / 2 + (py**2) / 2 + (x**2) / 2 + (y**2) / 2 + x**2 * y - (1/3) * y**3
-    normalized_hamiltonian = hamiltonian / hamiltonian[0]
-
-    ax3.plot(t, normalized_hamiltonian, color=color)
-    ax3.set_xlabel('Time', fontsize=12)
-    ax3.set_ylabel('Normalized Energy', fontsize=12)
-    
-    plt.tight_layout()
+    # Create a Poincaré map from the crossings of the x = 0 plane with increasing x
+    with profiling.phase('section'):
+        _, points, _ = find_crossings(t, np.stack([x, y, px, py], axis=-1))
+
+    with profiling.phase('energy'):
+        hamiltonian = var.hamiltonian(np.stack([x, y, px, py], axis=-1))
+        normalized_hamiltonian = hamiltonian / hamiltonian[0]
+
+    with profiling.phase('plotting'):
+        # Plot trajectories in the x-y plane
+        ax1.scatter(x, y, s=1, c=color)
+        ax1.set_xlabel('x', fontsize=12)
+        ax1.set_ylabel('y', fontsize=12)
+
+        ax2.scatter(points[:,1], points[:,3], s=1, c=color,alpha=0.7)
+        ax2.set_xlabel('y', fontsize=12)
+        ax2.set_ylabel('py', fontsize=12)
+        ax2.set_title(f'{title}', fontsize=16)
+
+        # Plot energy evolution over time
+        ax3.plot(t, normalized_hamiltonian, color=color)
+        ax3.set_xlabel('Time', fontsize=12)
+        ax3.set_ylabel('Normalized Energy', fontsize=12)
+
+        ax1.figure.tight_layout()
+
+def plot_henon_heiles_stream(stream, colors, title, axs):
+    """
+    Plot the trajectories, Poincaré map and energy evolution of the Henon-Heiles system from a streamed trajectory.
+
+    The chunks yielded by integration_methods.henon_heiles_stream are drawn as they arrive and then discarded, so the
+    whole trajectory never needs to be held in memory. The Poincaré map is made of the crossings of the x = 0 plane
+    (with increasing x) collected by a reducers.SectionCrossings.
+
+    Parameters:
+    - stream (iterator): Iterator over (t_chunk, y_chunk) pairs, with y_chunk of shape (n, 4) or (n, N, 4).
+    - colors (list): Color of every orbit for scatter plots and energy curves.
+    - title (str): Title for the second subplot.
+    - axs (list): The three axes to draw on.
+
+    Returns:
+    None
+    """
+    ax1,ax2,ax3=axs
+    section = SectionCrossings()
+    initial_energy = None
+
+    # The chunks are integrated lazily, while the loop asks for them
+    for t_chunk, y_chunk in profiling.timed_iter(stream, 'integration'):
+        y_chunk = y_chunk.reshape(len(t_chunk), -1, 4)
+        with profiling.phase('section'):
+            section.update(t_chunk, y_chunk)
+        with profiling.phase('energy'):
+            hamiltonian = var.hamiltonian(y_chunk)
+            if initial_energy is None:
+                initial_energy = hamiltonian[0]
+
+        with profiling.phase('plotting'):
+            for i in range(y_chunk.shape[1]):
+                # Plot trajectories in the x-y plane
+                ax1.scatter(y_chunk[:,i,0], y_chunk[:,i,1], s=1, c=colors[i])
+                # Plot energy evolution over time
+                ax3.plot(t_chunk, hamiltonian[:,i] / initial_energy[i], color=colors[i])
+
+    with profiling.phase('plotting'):
+        points = section.points
+        orbit = section.orbit
+        for i in np.unique(orbit):
+            ax2.scatter(points[orbit == i, 1], points[orbit == i, 3], s=1, c=colors[i], alpha=0.7)
+
+        ax1.set_xlabel('x', fontsize=12)
+        ax1.set_ylabel('y', fontsize=12)
+        ax2.set_xlabel('y', fontsize=12)
+        ax2.set_ylabel('py', fontsize=12)
+        ax2.set_title(f'{title}', fontsize=16)
+        ax3.set_xlabel('Time', fontsize=12)
+        ax3.set_ylabel('Normalized Energy', fontsize=12)
+
+        ax1.figure.tight_layout()
+
+def plot_henon_heiles_raster(rasters, colors, title, axs, log=True):
+    """
+    Plot the trajectories, Poincaré map and energy evolution of the Henon-Heiles system from density rasters.
+
+    The x-y plane and the section are each drawn as a single image blending the per-orbit densities of a
+    raster.TrajectoryRasters, and the energy as the envelope of its time bins, so that the plotting cost does not depend
+    on the length of the trajectories or on the number of section points.
+
+    Parameters:
+    - rasters (TrajectoryRasters): Rasters filled with the trajectory, e.g. as a reducer of henon_heiles_stream.
+    - colors (list): Color of every orbit.
+    - title (str): Title for the second subplot.
+    - axs (list): The three axes to draw on.
+    - log (bool): Use a logarithmic density scale.
+
+    Returns:
+    None
+    """
+    from matplotlib.colors import to_rgb
+    from raster import composite
+
+    ax1,ax2,ax3=axs
+    rgb = np.array([to_rgb(color) for color in colors])
+
+    with profiling.phase('plotting'):
+        for ax, density in [(ax1, rasters.plane), (ax2, rasters.section)]:
+            ax.imshow(composite(density.counts, rgb, log), extent=density.extent, origin='lower', aspect='auto',
+                      interpolation='nearest')
+        ax1.set_xlabel('x', fontsize=12)
+        ax1.set_ylabel('y', fontsize=12)
+        ax2.set_xlabel('y', fontsize=12)
+        ax2.set_ylabel('py', fontsize=12)
+        ax2.set_title(f'{title}', fontsize=16)
+
+        # Plot the energy envelope over time
+        t_mid = (rasters.t_edges[1:] + rasters.t_edges[:-1]) / 2
+        for i, color in enumerate(colors):
+            ax3.fill_between(t_mid, rasters.energy_min[i], rasters.energy_max[i], color=color, alpha=0.5, linewidth=0)
+            ax3.plot(t_mid, (rasters.energy_min[i] + rasters.energy_max[i]) / 2, color=color)
+        ax3.set_xlabel('Time', fontsize=12)
+        ax3.set_ylabel('Normalized Energy', fontsize=12)
+
+        ax1.figure.tight_layout()
+
+def plot_periodic_orbits(ax, orbits):
+    """
+    Overlay the section points of periodic orbits on a Poincaré map: the stable orbits (centers of the island chains) as
+    circles and the unstable ones (saddles) as crosses.
+
+    Parameters:
+    - ax (Axes): The axes of the (y, py) section.
+    - orbits (dict): Periodic orbits, as returned by periodic_orbits.periodic_orbits.
+
+    Returns:
+    None
+    """
+    with profiling.phase('plotting'):
+        stable = orbits['stable'][orbits['section_orbit']]
+        points = orbits['section_points']
+        ax.scatter(points[stable, 0], points[stable, 1], s=40, facecolors='none', edgecolors='black', label='stable periodic orbits')
+        ax.scatter(points[~stable, 0], points[~stable, 1], s=40, marker='x', color='tab:red', label='unstable periodic orbits')
+        ax.legend(loc='upper right', fontsize=8)
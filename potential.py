@@ -0,0 +1,166 @@
+import numpy as np
+
+def _derive(exponents, coefficients, axis):
+    """
+    Terms of the derivative of a polynomial along x (axis 0) or y (axis 1), without the vanishing terms.
+    """
+    keep = exponents[:, axis] > 0
+    derived = exponents[keep].copy()
+    derived[:, axis] -= 1
+    return derived, coefficients[..., keep] * exponents[keep, axis]
+
+class PolynomialPotential:
+    """
+    Polynomial potential V(x, y) = sum_k c_k x^i_k y^j_k of a particle in the plane, such as the generalized
+    Henon-Heiles potentials with arbitrary cubic and quartic coefficients.
+
+    The terms of the gradient and of the Hessian are derived once, when the potential is built, and every evaluation is
+    a vectorized sum over the terms of the powers of x and y. The coefficients may be arrays: the potential then holds a
+    different polynomial for every lane of a batch of states (e.g. a coupling strength per orbit), so that a sweep over
+    the parameters is a single vectorized integration.
+
+    Attributes:
+        exponents (array): Exponents (i, j) of the terms, of shape (K, 2).
+        coefficients (array): Coefficients of the terms, of shape (K,) or (..., K) for per-lane coefficients.
+    """
+
+    def __init__(self, terms):
+        """
+        Parameters:
+            terms (dict): Coefficients of the monomials x^i y^j by exponents (i, j). Every coefficient is a number or an
+                          array of per-lane values; the arrays are broadcast together.
+        """
+        self.exponents = np.array(list(terms), dtype=int).reshape(-1, 2)
+        self.coefficients = np.stack(np.broadcast_arrays(*[np.asarray(c, dtype=float) for c in terms.values()]), axis=-1)
+        self.degree = int(self.exponents.sum(axis=1).max(initial=0))
+
+        # Terms of the first and second derivatives, by derivation axes
+        dx, dy = _derive(self.exponents, self.coefficients, 0), _derive(self.exponents, self.coefficients, 1)
+        self._gradient = (dx, dy)
+        self._hessian = (_derive(*dx, 0), _derive(*dx, 1), _derive(*dy, 1))
+
+    def _powers(self, q):
+        """
+        Powers 1, u, u^2, ... up to the degree of the potential of the coordinates u = x and u = y, of shape (..., degree + 1).
+        """
+        q = np.asarray(q)
+        powers = np.ones(q.shape + (self.degree + 1,), dtype=np.result_type(q, float))
+        for k in range(1, self.degree + 1):
+            powers[..., k] = powers[..., k-1] * q
+        return powers[..., 0, :], powers[..., 1, :]
+
+    @staticmethod
+    def _evaluate(terms, x_powers, y_powers):
+        exponents, coefficients = terms
+        return np.sum(coefficients * x_powers[..., exponents[:, 0]] * y_powers[..., exponents[:, 1]], axis=-1)
+
+    def potential(self, q):
+        """
+        Potential energy at positions q of shape (..., 2).
+
+        Returns:
+            array: V(x, y), with the shape of q without its last axis.
+        """
+        return self._evaluate((self.exponents, self.coefficients), *self._powers(q))
+
+    def force(self, q):
+        """
+        Force -grad V at positions q of shape (..., 2).
+
+        Returns:
+            array: Forces of shape (..., 2).
+        """
+        powers = self._powers(q)
+        return -np.stack([self._evaluate(terms, *powers) for terms in self._gradient], axis=-1)
+
+    def hessian(self, q):
+        """
+        Hessian of V at positions q of shape (..., 2).
+
+        Returns:
+            array: Hessian matrices of shape (..., 2, 2).
+        """
+        powers = self._powers(q)
+        vxx, vxy, vyy = (self._evaluate(terms, *powers) for terms in self._hessian)
+        return np.stack([np.stack([vxx, vxy], axis=-1), np.stack([vxy, vyy], axis=-1)], axis=-2)
+
+    def hamiltonian(self, y):
+        """
+        Total energy of states [X, Y, px, py] along the last axis (see var.hamiltonian).
+        """
+        y = np.asarray(y)
+        return (y[..., 2]**2 + y[..., 3]**2) / 2 + self.potential(y[..., :2])
+
+    def equations_motion(self, t, y):
+        """
+        Derivatives [dX/dt, dY/dt, dpx/dt, dpy/dt] of states of shape (4,) or (N, 4), as var.equations_motion.
+        """
+        y = np.asarray(y)
+        return np.concatenate([y[..., 2:], self.force(y[..., :2])], axis=-1)
+
+    def variational_equations(self, t, y, w):
+        """
+        Derivatives of deviation vectors w of shape (..., k, 4) along states y of shape (..., 4), as
+        var.variational_equations: the positions move with the momenta and the momenta with -Hessian(V) times the positions.
+        """
+        hessian = self.hessian(np.asarray(y)[..., :2])
+        return np.concatenate([w[..., 2:], -np.einsum('...ij,...kj->...ki', hessian, w[..., :2])], axis=-1)
+
+    def section_momentum(self, energy, y, py, px_sign=1):
+        """
+        px of the points (y, py) of the x = 0 section on the energy shell, keeping the sign of px_sign, or nan where the
+        energy is too low (the lanes stay aligned with per-lane coefficients).
+        """
+        y, py = np.asarray(y, dtype=float), np.asarray(py, dtype=float)
+        kinetic = 2 * (energy - self.potential(np.stack(np.broadcast_arrays(np.zeros_like(y), y), axis=-1))) - py**2
+        with np.errstate(invalid='ignore'):
+            return np.where(np.asarray(px_sign) < 0, -1, 1) * np.sqrt(kinetic)
+
+def henon_heiles_potential(coupling=1.0, cubic=1/3, quartic=0.0, omega_x=1.0, omega_y=1.0):
+    """
+    Generalized Henon-Heiles potential
+
+        V = (omega_x^2 x^2 + omega_y^2 y^2) / 2 + coupling * (x^2 y - cubic * y^3) + quartic * (x^2 + y^2)^2
+
+    The classic system is coupling = 1, cubic = 1/3, quartic = 0. Every parameter may be an array of per-lane values.
+
+    Returns:
+        PolynomialPotential: The potential.
+    """
+    coupling = np.asarray(coupling, dtype=float)
+    terms = {
+        (2, 0): np.asarray(omega_x)**2 / 2,
+        (0, 2): np.asarray(omega_y)**2 / 2,
+        (2, 1): coupling,
+        (0, 3): -coupling * np.asarray(cubic),
+    }
+    # The quartic terms are only evaluated when they are used
+    if np.any(quartic):
+        quartic = np.asarray(quartic, dtype=float)
+        terms.update({(4, 0): quartic, (2, 2): 2 * quartic, (0, 4): quartic})
+    return PolynomialPotential(terms)
+
+# The potential of var.equations_motion and var.hamiltonian
+HENON_HEILES = henon_heiles_potential()
+
+def coupling_sweep(couplings, energy, y, py, **parameters):
+    """
+    Potential and initial conditions of a sweep over the coupling strength as a single batch: every point (y, py) of the
+    x = 0 section is completed on the energy shell for every coupling, with the coupling of its lane.
+
+    Parameters:
+        couplings (array): Coupling strengths.
+        energy (float): Total energy.
+        y, py (array): Points of the x = 0 section.
+        parameters: Further parameters of henon_heiles_potential (cubic, quartic, omega_x, omega_y).
+
+    Returns:
+        tuple: (potential, y0, coupling) with the per-lane potential, the (N, 4) initial conditions and the coupling of
+               every lane; the points without a real px at their coupling are dropped.
+    """
+    coupling = np.repeat(np.asarray(couplings, dtype=float), np.size(y))
+    y, py = np.tile(np.ravel(y), np.size(couplings)), np.tile(np.ravel(py), np.size(couplings))
+    px = henon_heiles_potential(coupling, **parameters).section_momentum(energy, y, py)
+    valid = np.isfinite(px)
+    y0 = np.stack([np.zeros(valid.sum()), y[valid], px[valid], py[valid]], axis=-1)
+    return henon_heiles_potential(coupling[valid], **parameters), y0, coupling[valid]
@@ -0,0 +1,108 @@
+import warnings
+
+import numpy as np
+
+import profiling
+from integration_methods import euler, runge_kutta2, runge_kutta4, velocity_verlet, yoshida4, yoshida6, yoshida8
+from integration_methods import _YOSHIDA4, _YOSHIDA6, _YOSHIDA8
+from var import hamiltonian
+
+# Runge-Kutta type methods, whose step is y + dt * (combination of derivatives)
+_RUNGE_KUTTA_METHODS = (euler, runge_kutta2, runge_kutta4)
+
+# Splitting methods, by the relative sizes of their Verlet substeps
+_SPLITTING_WEIGHTS = {velocity_verlet: [1.0], yoshida4: _YOSHIDA4, yoshida6: _YOSHIDA6, yoshida8: _YOSHIDA8}
+
+def _add(total, compensation, increment, compensated):
+    """
+    Add an increment to a running sum, with Kahan compensated summation when compensated is True.
+
+    Returns:
+        tuple: (total, compensation) after the addition.
+    """
+    if not compensated:
+        return total + increment, compensation
+    increment = increment - compensation
+    new_total = total + increment
+    return new_total, (new_total - total) - increment
+
+def _runge_kutta_step(integration_method, f, t, y, c, dt, zeros, compensated):
+    # The method is applied to the deviation d from y, so that it returns the increment alone instead of
+    # y + increment, which would already have lost the low-order bits of the increment
+    increment = integration_method(lambda t, d: f(t, y + d), t, zeros, dt)
+    return _add(y, c, increment, compensated)
+
+def _splitting_step(weights, f, t, y, c, dt, compensated):
+    # Kick-drift-kick substeps as in integration_methods._symplectic_composition, with compensated updates
+    q, p = y[..., :2], y[..., 2:]
+    cq, cp = c[..., :2], c[..., 2:]
+    force = np.asarray(f(t, y))[..., 2:]
+    for w in weights:
+        p, cp = _add(p, cp, 0.5 * w * dt * force, compensated)
+        q, cq = _add(q, cq, w * dt * p, compensated)
+        t = t + w * dt
+        force = np.asarray(f(t, np.concatenate([q, p], axis=-1)))[..., 2:]
+        p, cp = _add(p, cp, 0.5 * w * dt * force, compensated)
+    return np.concatenate([q, p], axis=-1), np.concatenate([cq, cp], axis=-1)
+
+def henon_heiles_mixed(integration_method, f, y0, t_values, dt, dtype=np.float32, compensated=True, check_every=1000,
+                       energy_tolerance=1e-5):
+    """
+    Integrate an ensemble with reduced-precision storage and arithmetic, and compensated summation of the state update.
+
+    For large ensembles the throughput is bound by memory bandwidth: storing and computing the states in float32 halves
+    the bytes per orbit, so twice as many orbits fit in cache and RAM. The rounding of every state update to float32
+    would make the energy drift grow over long runs; with Kahan compensated summation the low-order bits lost at every
+    update are carried over to the next one, which keeps the drift at the level of the float32 resolution of the states.
+
+    The relative energy error of every orbit is computed in float64 every check_every steps and at the end, and a
+    RuntimeWarning is issued when it exceeds energy_tolerance, i.e. when the precision is insufficient for the run.
+
+    Parameters:
+        integration_method (function): euler, runge_kutta2, runge_kutta4, velocity_verlet, yoshida4, yoshida6 or yoshida8.
+        f  (function): The function that defines the ODE dy/dt = f(t, y); it must preserve the dtype of the states.
+        y0 (array): Initial conditions for the state vector (x, y, px and py), or an (N, 4) array of initial conditions.
+        t_values (array): Simulation time.
+        dt (float): Step size.
+        dtype (numpy.dtype): Precision of the stored and integrated states.
+        compensated (bool): Use compensated summation of the state updates.
+        check_every (int): Number of steps between two energy checks.
+        energy_tolerance (float): Relative energy error above which the precision is reported as insufficient.
+
+    Returns:
+        tuple: (y_values, diagnostics) with the states of dtype at t_values, of shape (len(t), 4) or (len(t), N, 4), and
+               a dictionary with 'energy_drift' (largest relative energy error of every orbit at the checks) and
+               'insufficient' (whether it exceeds energy_tolerance).
+    """
+    if integration_method not in _RUNGE_KUTTA_METHODS and integration_method not in _SPLITTING_WEIGHTS:
+        raise ValueError(f"No mixed-precision mode for integration method {getattr(integration_method, '__name__', integration_method)}: "
+                         "use a Runge-Kutta or a splitting method")
+
+    # A float64 step size would promote every product back to float64
+    dt = np.dtype(dtype).type(dt)
+    num_steps = len(t_values)
+    y_values = np.zeros((num_steps,) + np.shape(y0), dtype=dtype)
+    y_values[0] = y0
+    profiling.record_allocation('trajectory', y_values.nbytes)
+    profiling.count('steps', max(num_steps - 1, 0))
+
+    y = y_values[0].copy()
+    c = np.zeros_like(y)
+    zeros = np.zeros_like(y)
+    initial_energy = hamiltonian(np.asarray(y0, dtype=float))
+    drift = np.zeros(np.shape(initial_energy))
+
+    for i in range(1, num_steps):
+        if integration_method in _RUNGE_KUTTA_METHODS:
+            y, c = _runge_kutta_step(integration_method, f, t_values[i-1], y, c, dt, zeros, compensated)
+        else:
+            y, c = _splitting_step(_SPLITTING_WEIGHTS[integration_method], f, t_values[i-1], y, c, dt, compensated)
+        y_values[i] = y
+        if i % check_every == 0 or i == num_steps - 1:
+            drift = np.maximum(drift, np.abs(hamiltonian(y.astype(float)) / initial_energy - 1))
+
+    insufficient = drift > energy_tolerance
+    if np.any(insufficient):
+        warnings.warn(f"{np.dtype(dtype).name} precision is insufficient for {np.sum(insufficient)} orbit(s): relative energy "
+                      f"error up to {np.max(drift):.2e} (tolerance {energy_tolerance:.0e})", RuntimeWarning, stacklevel=2)
+    return y_values, {'energy_drift': drift, 'insufficient': insufficient}
@@ -0,0 +1,130 @@
+import json
+import time
+from contextlib import contextmanager, nullcontext
+
+# Profiler collecting the measurements, or None when profiling is disabled
+_active = None
+
+# Shared do-nothing context manager returned by phase() when profiling is disabled
+_NULL = nullcontext()
+
+class Profiler:
+    """
+    Measurements of a profiled run: wall time and number of entries of every phase, event counters (RHS calls, steps
+    taken or rejected, ...) and bytes allocated for the main buffers.
+
+    Hooks are called as hook(phase, seconds) every time a phase ends, e.g. to report progress or feed another tool.
+    """
+    def __init__(self, hooks=None):
+        self.phases = {}
+        self.counters = {}
+        self.allocations = {}
+        self.hooks = list(hooks or [])
+        self.start = time.perf_counter()
+
+    def add_time(self, name, seconds):
+        entry = self.phases.setdefault(name, {'seconds': 0.0, 'calls': 0})
+        entry['seconds'] += seconds
+        entry['calls'] += 1
+        for hook in self.hooks:
+            hook(name, seconds)
+
+    def summary(self):
+        """
+        Machine-readable summary of the measurements.
+
+        Returns:
+            dict: 'total_seconds', 'phases' ({name: {'seconds', 'calls'}}), 'counters' and 'allocated_bytes'.
+        """
+        return {
+            'total_seconds': time.perf_counter() - self.start,
+            'phases': {name: dict(entry) for name, entry in self.phases.items()},
+            'counters': dict(self.counters),
+            'allocated_bytes': dict(self.allocations),
+        }
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=2)
+
+@contextmanager
+def profile(hooks=None):
+    """
+    Enable profiling for the duration of a with block.
+
+    Parameters:
+        hooks (list): Functions called as hook(phase, seconds) every time a phase ends.
+
+    Yields:
+        Profiler: The profiler collecting the measurements (see Profiler.summary).
+    """
+    global _active
+    previous = _active
+    _active = Profiler(hooks)
+    try:
+        yield _active
+    finally:
+        _active = previous
+
+def enabled():
+    return _active is not None
+
+@contextmanager
+def _timed(profiler, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.add_time(name, time.perf_counter() - start)
+
+def phase(name):
+    """
+    Context manager timing a phase of the run (integration, section extraction, energy computation, plotting, ...).
+    Nested phases are timed independently. When profiling is disabled it does nothing.
+    """
+    if _active is None:
+        return _NULL
+    return _timed(_active, name)
+
+def count(name, n=1):
+    """
+    Add n to an event counter (no-op when profiling is disabled).
+    """
+    if _active is not None:
+        _active.counters[name] = _active.counters.get(name, 0) + n
+
+def record_allocation(name, nbytes):
+    """
+    Add nbytes to the bytes allocated for a kind of buffer (no-op when profiling is disabled).
+    """
+    if _active is not None:
+        _active.allocations[name] = _active.allocations.get(name, 0) + int(nbytes)
+
+def counted(f, name='rhs_calls'):
+    """
+    Wrap a right-hand side so that its calls are counted, or return it unchanged when profiling is disabled, so that
+    the hot path pays nothing for the instrumentation.
+    """
+    if _active is None or getattr(f, '_counted', False):
+        return f
+    profiler = _active
+    def counted_f(t, y):
+        profiler.counters[name] = profiler.counters.get(name, 0) + 1
+        return f(t, y)
+    counted_f._counted = True
+    return counted_f
+
+def timed_iter(iterable, name):
+    """
+    Iterate over iterable, timing the production of its items as a phase (e.g. the integration of a lazy stream).
+    """
+    if _active is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        with phase(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
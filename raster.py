@@ -0,0 +1,163 @@
+import numpy as np
+
+from initial_conditions import section_bounds
+from sections import find_crossings
+from var import equations_motion, hamiltonian
+
+def section_extent(energy, margin=0.05):
+    """
+    (y_min, y_max, py_min, py_max) extent of the x = 0 section accessible at the given energy, with a relative margin.
+    """
+    (y_min, y_max), py_max = section_bounds(energy)
+    return _padded((y_min, y_max, -py_max, py_max), margin)
+
+def plane_extent(energy, margin=0.05):
+    """
+    (x_min, x_max, y_min, y_max) extent of the region of the x-y plane accessible at the given energy (V(x, y) <= E),
+    with a relative margin. Above the escape energy 1/6 the region is cut at the saddles, as in section_bounds.
+    """
+    (y_min, y_max), _ = section_bounds(energy)
+    # On the boundary V(x, y) = E: x^2 (1/2 + y) = E - y^2/2 + y^3/3, and the y extremes are on the x = 0 axis
+    y = np.linspace(max(y_min, -0.5 + 1e-9), y_max, 1001)
+    x_max = np.sqrt(np.max(np.maximum(energy - y**2 / 2 + y**3 / 3, 0) / (0.5 + y)))
+    return _padded((-min(x_max, 1.0), min(x_max, 1.0), y_min, y_max), margin)
+
+def _padded(extent, margin):
+    u_min, u_max, v_min, v_max = extent
+    du, dv = margin * (u_max - u_min), margin * (v_max - v_min)
+    return (u_min - du, u_max + du, v_min - dv, v_max + dv)
+
+class DensityRaster:
+    """
+    Fixed-resolution 2D histogram of points, with one channel per orbit, filled incrementally.
+
+    The points are binned with a single np.bincount per update, so that the memory is set by the resolution and the cost
+    of drawing the raster does not depend on the number of points. Points outside the extent are only counted.
+
+    Attributes:
+        extent (tuple): (u_min, u_max, v_min, v_max) of the raster.
+        resolution (tuple): Number of pixels (n_u, n_v).
+        counts (array): Number of points in every pixel, of shape (n_channels, n_v, n_u).
+        outside (int): Number of points that fell outside the extent.
+    """
+
+    def __init__(self, extent, resolution=512, n_channels=1):
+        self.extent = tuple(float(e) for e in extent)
+        self.resolution = (resolution, resolution) if np.isscalar(resolution) else tuple(resolution)
+        self.counts = np.zeros((n_channels,) + self.resolution[::-1], dtype=np.int64)
+        self.outside = 0
+
+    def update(self, u, v, channel=0):
+        """
+        Add points to the raster.
+
+        Parameters:
+            u, v (array): Coordinates of the points (any shape).
+            channel (int or array): Channel of every point, broadcast to the shape of u (e.g. np.arange(N) for the
+                                    (n, N) coordinates of an ensemble).
+        """
+        u, v = np.asarray(u, dtype=float), np.asarray(v, dtype=float)
+        channel = np.broadcast_to(channel, u.shape).ravel()
+        u_min, u_max, v_min, v_max = self.extent
+        n_u, n_v = self.resolution
+        i = np.floor((u.ravel() - u_min) * (n_u / (u_max - u_min)))
+        j = np.floor((v.ravel() - v_min) * (n_v / (v_max - v_min)))
+        # Non-finite coordinates fail the comparisons and count as outside
+        inside = (i >= 0) & (i < n_u) & (j >= 0) & (j < n_v)
+        self.outside += int(inside.size - np.count_nonzero(inside))
+        flat = (channel[inside] * n_v + j[inside].astype(np.int64)) * n_u + i[inside].astype(np.int64)
+        self.counts += np.bincount(flat, minlength=self.counts.size).reshape(self.counts.shape)
+
+def composite(counts, colors, log=True):
+    """
+    Blend the channels of a raster into a single RGBA image.
+
+    Every channel contributes its color with an intensity given by its density, on a scale shared by all the channels
+    (logarithmic by default, so that both the dense and the sparse parts of the orbits stay visible). Empty pixels are
+    transparent.
+
+    Parameters:
+        counts (array): Counts of shape (n_channels, n_v, n_u) (see DensityRaster.counts).
+        colors (array): RGB colors of the channels, of shape (n_channels, 3), with values in [0, 1].
+        log (bool): Use a logarithmic intensity scale.
+
+    Returns:
+        array: RGBA image of shape (n_v, n_u, 4), with the first row at v_min.
+    """
+    density = np.log1p(counts) if log else counts.astype(float)
+    intensity = density / max(density.max(), 1e-300)
+    total = intensity.sum(axis=0)
+    image = np.zeros(counts.shape[1:] + (4,))
+    image[..., :3] = np.einsum('cij,ck->ijk', intensity, np.asarray(colors, dtype=float)) / np.maximum(total, 1e-300)[..., np.newaxis]
+    image[..., 3] = np.minimum(total, 1)
+    return image
+
+class TrajectoryRasters:
+    """
+    Reducer rasterizing a streamed trajectory for plotting: the x-y plane and the crossings of the x = 0 section into
+    DensityRasters with one channel per orbit, and the normalized energy into its minimum and maximum over a fixed
+    number of time bins.
+
+    Fed chunk by chunk through update(), it keeps a fixed amount of memory and its plot costs the same for any length of
+    the trajectory (see poincare_maps.plot_henon_heiles_raster). The last sample of every chunk is kept so that the
+    crossings between chunks are not missed, as in reducers.SectionCrossings.
+
+    Attributes:
+        plane (DensityRaster): Density of the (x, y) samples.
+        section (DensityRaster): Density of the (y, py) section points.
+        t_edges (array): Edges of the time bins of the energy envelope.
+        energy_min, energy_max (array): Envelope of the normalized energy of every orbit, of shape (n_orbits, bins)
+                                        (nan for the bins without samples).
+    """
+
+    def __init__(self, energy, n_orbits, t_range, resolution=512, energy_bins=1000, direction=1, method='hermite', f=equations_motion):
+        """
+        Parameters:
+            energy (float): Largest energy of the orbits, which sets the extents of the rasters.
+            n_orbits (int): Number of orbits (channels).
+            t_range (tuple): (t_start, t_end) of the trajectory, for the time bins of the energy envelope.
+            resolution (int or tuple): Number of pixels of the rasters.
+            energy_bins (int): Number of time bins of the energy envelope.
+            direction, method, f: Crossings of the section (see sections.find_crossings).
+        """
+        self.plane = DensityRaster(plane_extent(energy), resolution, n_orbits)
+        self.section = DensityRaster(section_extent(energy), resolution, n_orbits)
+        self.t_edges = np.linspace(t_range[0], t_range[1], energy_bins + 1)
+        self.energy_min = np.full((n_orbits, energy_bins), np.nan)
+        self.energy_max = np.full((n_orbits, energy_bins), np.nan)
+        self.direction = direction
+        self.method = method
+        self.f = f
+        self._initial_energy = None
+        self._last = None
+
+    def update(self, t_chunk, y_chunk):
+        """
+        Add a chunk of the trajectory to the rasters.
+
+        Parameters:
+            t_chunk (array): Times of the samples in the chunk.
+            y_chunk (array): States of the samples in the chunk, of shape (n, 4) or (n, N, 4).
+        """
+        t_chunk = np.asarray(t_chunk)
+        y_chunk = np.asarray(y_chunk).reshape(len(t_chunk), -1, 4)
+        orbits = np.arange(y_chunk.shape[1])
+        self.plane.update(y_chunk[..., 0], y_chunk[..., 1], orbits)
+
+        energy = hamiltonian(y_chunk)
+        if self._initial_energy is None:
+            self._initial_energy = energy[0]
+        energy = energy / self._initial_energy
+        # The samples are sorted in time: every bin is a contiguous run of the chunk
+        bins = np.clip(np.searchsorted(self.t_edges, t_chunk, side='right') - 1, 0, len(self.t_edges) - 2)
+        starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+        ids = bins[starts]
+        self.energy_min[:, ids] = np.fmin(self.energy_min[:, ids], np.minimum.reduceat(energy, starts, axis=0).T)
+        self.energy_max[:, ids] = np.fmax(self.energy_max[:, ids], np.maximum.reduceat(energy, starts, axis=0).T)
+
+        if self._last is not None:
+            t_chunk = np.concatenate([[self._last[0]], t_chunk])
+            y_chunk = np.concatenate([self._last[1][np.newaxis], y_chunk])
+        self._last = (t_chunk[-1], y_chunk[-1].copy())
+        _, points, orbit = find_crossings(t_chunk, y_chunk, direction=self.direction, method=self.method, f=self.f)
+        self.section.update(points[:, 1], points[:, 3], orbit)
@@ -0,0 +1,114 @@
+import numpy as np
+
+from sections import find_crossings
+from var import equations_motion, hamiltonian
+
+class EnergyStats:
+    """
+    Running energy statistics of a streamed trajectory.
+
+    The reducer is fed chunk by chunk through update() and keeps, for every orbit, the initial energy and the running
+    minimum, maximum and mean of the energy, together with the largest relative deviation from the initial energy.
+    The nan samples of the orbits retired by an escape criterion (see escape.EscapeMonitor) are skipped.
+
+    Attributes:
+        initial (array): Energy of the first sample.
+        minimum, maximum, mean (array): Running statistics of the energy.
+        max_relative_drift (array): Largest |E(t) - E(0)| / |E(0)| seen so far.
+        count (int): Number of samples seen so far.
+    """
+
+    def __init__(self):
+        self.initial = None
+        self.minimum = None
+        self.maximum = None
+        self.mean = None
+        self.max_relative_drift = None
+        self.count = 0
+        self._samples = 0
+
+    def update(self, t_chunk, y_chunk):
+        """
+        Update the statistics with a chunk of the trajectory.
+
+        Parameters:
+            t_chunk (array): Times of the samples in the chunk.
+            y_chunk (array): States of the samples in the chunk, of shape (n, 4) or (n, N, 4).
+        """
+        energy = hamiltonian(y_chunk)
+        if self.initial is None:
+            self.initial = energy[0]
+            self.minimum = np.fmin.reduce(energy, axis=0)
+            self.maximum = np.fmax.reduce(energy, axis=0)
+            self.mean = np.zeros_like(self.initial)
+            self.max_relative_drift = np.zeros_like(self.initial)
+        else:
+            self.minimum = np.fmin(self.minimum, np.fmin.reduce(energy, axis=0))
+            self.maximum = np.fmax(self.maximum, np.fmax.reduce(energy, axis=0))
+
+        # Running mean over the samples of every orbit that are not nan
+        sampled = ~np.isnan(energy)
+        n = sampled.sum(axis=0)
+        self._samples = self._samples + n
+        self.mean = self.mean + (np.where(sampled, energy, 0).sum(axis=0) - n * self.mean) / np.maximum(self._samples, 1)
+        self.count += len(energy)
+
+        drift = np.fmax.reduce(np.abs(energy - self.initial), axis=0) / np.abs(self.initial)
+        self.max_relative_drift = np.fmax(self.max_relative_drift, drift)
+
+class SectionCrossings:
+    """
+    Crossings of the x = 0 plane collected from a streamed trajectory.
+
+    Crossings are extracted from every chunk with sections.find_crossings; the last sample of every chunk is kept so
+    that crossings between chunks are not missed.
+
+    Attributes:
+        direction (int): +1 for crossings with increasing x, -1 for decreasing x, 0 for both.
+        method (str): How crossings are placed on the plane: 'linear', 'hermite' or 'henon'.
+        f (function): The function that defines the ODE dy/dt = f(t, y), used by 'hermite' and 'henon'.
+        t (array): Crossing times.
+        points (array): States at the crossings, of shape (M, 4).
+        orbit (array): Index of the orbit each crossing belongs to (always 0 for a single orbit).
+    """
+
+    def __init__(self, direction=1, method='hermite', f=equations_motion):
+        self.direction = direction
+        self.method = method
+        self.f = f
+        self._t = []
+        self._points = []
+        self._orbit = []
+        self._last = None
+
+    def update(self, t_chunk, y_chunk):
+        """
+        Collect the crossings contained in a chunk of the trajectory.
+
+        Parameters:
+            t_chunk (array): Times of the samples in the chunk.
+            y_chunk (array): States of the samples in the chunk, of shape (n, 4) or (n, N, 4).
+        """
+        t_chunk = np.asarray(t_chunk)
+        y_chunk = np.asarray(y_chunk).reshape(len(t_chunk), -1, 4)
+        if self._last is not None:
+            t_chunk = np.concatenate([[self._last[0]], t_chunk])
+            y_chunk = np.concatenate([self._last[1][np.newaxis], y_chunk])
+        self._last = (t_chunk[-1], y_chunk[-1].copy())
+
+        t, points, orbit = find_crossings(t_chunk, y_chunk, direction=self.direction, method=self.method, f=self.f)
+        self._t.append(t)
+        self._points.append(points)
+        self._orbit.append(orbit)
+
+    @property
+    def t(self):
+        return np.concatenate(self._t) if self._t else np.empty(0)
+
+    @property
+    def points(self):
+        return np.concatenate(self._points) if self._points else np.empty((0, 4))
+
+    @property
+    def orbit(self):
+        return np.concatenate(self._orbit) if self._orbit else np.empty(0, dtype=int)
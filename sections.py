@@ -0,0 +1,110 @@
+import numpy as np
+
+from integration_methods import henon_heiles_stream, runge_kutta4
+from var import equations_motion
+
+def find_crossings(t, y, direction=1, method='hermite', f=equations_motion, integration_method=runge_kutta4):
+    """
+    Locate the crossings of the x = 0 plane in a sampled trajectory.
+
+    Crossings are detected in a vectorized way from the sign changes of x between consecutive samples, filtered by
+    direction, and then placed exactly on the plane:
+    - 'linear' interpolates linearly between the two samples around the crossing;
+    - 'hermite' finds the root of the cubic Hermite interpolant built from the samples and their derivatives f(t, y);
+    - 'henon' uses Hénon's trick: x becomes the independent variable and a single step of integration_method of size -x
+      from the sample before the crossing lands on the plane.
+
+    Parameters:
+        t (array): Times of the samples.
+        y (array): States of the samples, of shape (n, 4) or (n, N, 4).
+        direction (int): +1 for crossings with increasing x (px > 0), -1 for decreasing x, 0 for both.
+        method (str): 'linear', 'hermite' or 'henon'.
+        f (function): The function that defines the ODE dy/dt = f(t, y), used by 'hermite' and 'henon'.
+        integration_method (function): Single-step method used by 'henon'.
+
+    Returns:
+        tuple: (t_cross, points, orbit) with the crossing times, the states on the plane of shape (M, 4) and the index
+               of the orbit each crossing belongs to (always 0 for a single orbit).
+    """
+    t = np.asarray(t, dtype=float)
+    y = np.asarray(y, dtype=float).reshape(len(t), -1, 4)
+
+    x = y[..., 0]
+    before, after = x[:-1], x[1:]
+    crossing = np.zeros(before.shape, dtype=bool)
+    if direction >= 0:
+        crossing |= (before < 0) & (after >= 0)
+    if direction <= 0:
+        crossing |= (before > 0) & (after <= 0)
+    step, orbit = np.nonzero(crossing)
+
+    t0, t1 = t[step], t[step+1]
+    y0, y1 = y[step, orbit], y[step+1, orbit]
+
+    if method == 'linear':
+        s = (y0[:, 0] / (y0[:, 0] - y1[:, 0]))[:, np.newaxis]
+        return t0 + s[:, 0] * (t1 - t0), y0 + s * (y1 - y0), orbit
+
+    if method == 'hermite':
+        h = (t1 - t0)[:, np.newaxis]
+        m0 = h * np.asarray(f(t0, y0))
+        m1 = h * np.asarray(f(t1, y1))
+
+        def hermite(s, derivative=False):
+            s = s[:, np.newaxis]
+            if derivative:
+                basis = (6*s**2 - 6*s, 3*s**2 - 4*s + 1, -6*s**2 + 6*s, 3*s**2 - 2*s)
+            else:
+                basis = (2*s**3 - 3*s**2 + 1, s**3 - 2*s**2 + s, -2*s**3 + 3*s**2, s**3 - s**2)
+            return basis[0]*y0 + basis[1]*m0 + basis[2]*y1 + basis[3]*m1
+
+        # Newton iterations on the x component, starting from the linear estimate
+        s = y0[:, 0] / (y0[:, 0] - y1[:, 0])
+        for _ in range(4):
+            s = np.clip(s - hermite(s)[:, 0] / hermite(s, derivative=True)[:, 0], 0, 1)
+        points = hermite(s)
+        points[:, 0] = 0
+        return t0 + s * (t1 - t0), points, orbit
+
+    if method == 'henon':
+        # Extended state (x, y, px, py, t) integrated with x as the independent variable
+        def g(_, z):
+            derivatives = np.asarray(f(z[:, 4], z[:, :4]))
+            return np.concatenate([derivatives, np.ones((len(z), 1))], axis=1) / z[:, 2:3]
+
+        z = integration_method(g, 0.0, np.concatenate([y0, t0[:, np.newaxis]], axis=1), -y0[:, 0:1])
+        points = z[:, :4]
+        points[:, 0] = 0
+        return z[:, 4], points, orbit
+
+    raise ValueError(f"Unknown crossing method {method!r}: expected 'linear', 'hermite' or 'henon'")
+
+def henon_heiles_section(integration_method, f, y0, t0, dt, num_steps, direction=1, method='henon', chunk_size=10000):
+    """
+    Integrate the system and return only its crossings of the x = 0 plane.
+
+    The trajectory is streamed chunk by chunk through henon_heiles_stream and every chunk is discarded once its
+    crossings have been extracted, so only the section points are ever stored.
+
+    Parameters:
+        integration_method (function): One of euler, runge_kutta4, runge_kutta2, leap_frog.
+        f  (function): The function that defines the ODE dy/dt = f(t, y).
+        y0 (array): Initial conditions for the state vector (x, y, px and py), or an (N, 4) array of initial conditions.
+        t0 (float): Initial time.
+        dt (float): Step size.
+        num_steps (int): Number of time samples, including the initial condition.
+        direction (int): +1 for crossings with increasing x (px > 0), -1 for decreasing x, 0 for both.
+        method (str): How crossings are placed on the plane: 'linear', 'hermite' or 'henon' (see find_crossings).
+        chunk_size (int): Number of steps integrated between two crossing extractions.
+
+    Returns:
+        tuple: (t_cross, points, orbit) as returned by find_crossings.
+    """
+    # Imported here because reducers builds on find_crossings
+    from reducers import SectionCrossings
+
+    section = SectionCrossings(direction=direction, method=method, f=f)
+    for _ in henon_heiles_stream(integration_method, f, y0, t0, dt, num_steps, chunk_size=chunk_size, reducers=[section]):
+        pass
+
+    return section.t, section.points, section.orbit
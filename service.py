@@ -0,0 +1,389 @@
+"""
+Local job service for integration requests, over a Unix socket or TCP.
+
+The service runs in a long-lived process with a warm pool of worker processes: the interpreter, NumPy and the modules
+are loaded once, instead of once per `python henon_heiles.py` run. Clients send job specifications as JSON lines and
+receive JSON-line events as the jobs progress: the section points are streamed as soon as they are produced, and
+identical jobs submitted while one is in flight share its run.
+
+Usage:
+  henon_heiles.py serve [--socket PATH | --host HOST --port PORT] [--workers W] [--batch-size B] [--segment-time T]
+
+Options:
+  --socket PATH       Listen on a Unix socket [default: henon_heiles.sock].
+  --host HOST         Listen on TCP at this address instead of a Unix socket.
+  --port PORT         TCP port [default: 8765].
+  --workers W         Number of worker processes [default: all the cores].
+  --batch-size B      Number of orbits integrated together by a worker [default: 64].
+  --segment-time T    Simulation time integrated by a worker between two progress events [default: 20].
+
+Job specification (one JSON object per line):
+  {"method": "rk4", "initial_conditions": [[0, -0.1475, 0.3101, 0]], "time": 200, "dt": 0.01}
+  {"method": "yoshida4", "section": {"energy": 0.125, "n": [20, 20], "sampling": "grid"}, "time": 500}
+  "method" is a fixed-step method of integration_methods.METHODS (rk4 by default); the orbits are either given as
+  "initial_conditions" (moved to "energy" when given, as with --energy) or sampled on the x = 0 "section" (see
+  initial_conditions.section_samples); "time" and "dt" default to 200 and 0.01.
+
+Events (one JSON object per line, all with the "job" key of their job):
+  {"event": "accepted", "orbits": N, "deduplicated": false}
+  {"event": "progress", "fraction": 0.25}
+  {"event": "section", "t": [...], "points": [[y, py], ...], "orbit": [...]}
+  {"event": "done", "section_points": M, "energy_drift": 1e-9}
+  {"event": "error", "message": "..."}
+
+Examples:
+  python henon_heiles.py serve --socket /tmp/henon_heiles.sock
+  printf '{"section": {"energy": 0.125, "n": 100}}\\n' | nc -U /tmp/henon_heiles.sock
+"""
+
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import cache
+from initial_conditions import SAMPLINGS, on_energy_shell, section_samples
+from integration_methods import METHODS, henon_heiles_stream, leap_frog
+from reducers import SectionCrossings
+from var import equations_motion, hamiltonian
+
+def _warm_up():
+    """
+    Initializer of the worker processes: tiny integrations load the modules and run their first calls, which also
+    compiles the numba kernels of the fused methods (see _integrate_segment) when numba is installed.
+    """
+    import kernels
+    y0 = np.array([[0.0, 0.1, 0.1, 0.0]])
+    for method in METHODS:
+        if METHODS[method] in kernels.FUSED_METHODS:
+            _integrate_segment(method, y0, None, 0.0, 0.01, 3, np.ones(1))
+    # The later segments of a Leap-Frog job resume from the previous state
+    _integrate_segment('leapfrog', y0, y0, 0.0, 0.01, 3, np.ones(1))
+
+def _integrate_segment(method, y0, y_prev, t0, dt, num_steps, initial_energy):
+    """
+    Integrate a batch of orbits over one segment of a job and extract its section crossings.
+
+    Runs in a worker process. The segment starts from the final state of the previous one (and, for leapfrog, from the
+    state one step before it), so that the crossings of consecutive segments join without gaps or duplicates. When numba
+    is installed, the methods with a fused kernel run the JIT-compiled loops of kernels.henon_heiles_fused over the
+    whole segment (whose length is bounded by the segment time of the service); the others are streamed.
+
+    Returns:
+        dict: 'state' and 'previous' (the last two states, of shape (N, 4)), 't', 'points' and 'orbit' (the crossings,
+              as returned by sections.find_crossings) and 'energy_drift' (the largest relative deviation of every orbit
+              from its initial_energy over the segment).
+    """
+    import kernels
+    integration_method = METHODS[method]
+    y_prev = y_prev if integration_method == leap_frog else None
+    section = SectionCrossings(method='henon')
+    state, previous = y0, y_prev
+    drift = np.zeros(len(y0))
+    if kernels.numba is not None and integration_method in kernels.FUSED_METHODS:
+        t_values = t0 + np.arange(num_steps) * dt
+        y_values = kernels.henon_heiles_fused(integration_method, y0, t_values, dt, backend='numba', y_prev=y_prev)
+        section.update(t_values, y_values)
+        chunks = [(t_values, y_values)]
+    else:
+        chunks = henon_heiles_stream(integration_method, equations_motion, y0, t0, dt, num_steps, chunk_size=min(num_steps, 10000),
+                                     reducers=[section], y_prev=y_prev)
+    for _, y_chunk in chunks:
+        drift = np.maximum(drift, np.max(np.abs(hamiltonian(y_chunk) / initial_energy - 1), axis=0))
+        previous = y_chunk[-2] if len(y_chunk) > 1 else state
+        state = y_chunk[-1].copy()
+    return {'state': state, 'previous': previous, 't': section.t, 'points': section.points, 'orbit': section.orbit,
+            'energy_drift': drift}
+
+def job_spec(spec):
+    """
+    Validate a job specification and complete it with its defaults.
+
+    Returns:
+        dict: The specification with 'method', 'initial_conditions' (an (N, 4) array), 'time' and 'dt'.
+
+    Raises:
+        ValueError: When the specification is invalid.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("A job specification must be a JSON object")
+    method = spec.get('method', 'rk4')
+    if method not in METHODS or method == 'dopri':
+        raise ValueError(f"Unknown or unsupported method {method!r}: expected a fixed-step method of "
+                         f"{', '.join(name for name in METHODS if name != 'dopri')}")
+    time, dt = float(spec.get('time', 200)), float(spec.get('dt', 0.01))
+    if not (time > 0 and dt > 0):
+        raise ValueError("time and dt must be positive")
+
+    if 'section' in spec:
+        section = spec['section']
+        if not isinstance(section, dict):
+            raise ValueError("The 'section' of a job must be a JSON object")
+        sampling = section.get('sampling', 'grid')
+        if sampling not in SAMPLINGS:
+            raise ValueError(f"Unknown sampling {sampling!r}: expected one of {', '.join(SAMPLINGS)}")
+        n = section.get('n', 20)
+        initial_conditions = section_samples(float(section['energy']), n if np.isscalar(n) else tuple(n), sampling)
+    elif 'initial_conditions' in spec:
+        initial_conditions = np.array(spec['initial_conditions'], dtype=float).reshape(-1, 4)
+        if 'energy' in spec:
+            shell = on_energy_shell(float(spec['energy']), initial_conditions[:, 1], initial_conditions[:, 3],
+                                    px_sign=initial_conditions[:, 2])
+            if len(shell) != len(initial_conditions):
+                raise ValueError(f"The initial conditions have no real px at the energy {spec['energy']}")
+            initial_conditions = shell
+    else:
+        raise ValueError("A job needs 'initial_conditions' or a 'section'")
+    if len(initial_conditions) == 0:
+        raise ValueError("The job has no orbit")
+    return {'method': method, 'initial_conditions': np.array(initial_conditions), 'time': time, 'dt': dt}
+
+class Job:
+    """
+    An integration job in flight, with the list of the events it has published.
+
+    Subscribers iterate over all the events from the first one, so that a client joining a deduplicated job late still
+    receives its whole history.
+    """
+    def __init__(self, key, spec):
+        self.key = key
+        self.spec = spec
+        self.events = []
+        self.done = False
+        self._changed = asyncio.Condition()
+
+    async def publish(self, event, final=False):
+        async with self._changed:
+            self.events.append(dict(event, job=self.key))
+            self.done = self.done or final
+            self._changed.notify_all()
+
+    async def subscribe(self):
+        """
+        Yield the events of the job until its last one.
+        """
+        i = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: i < len(self.events) or self.done)
+                events = self.events[i:]
+            for event in events:
+                yield event
+            i += len(events)
+            if self.done and i == len(self.events):
+                return
+
+class JobService:
+    """
+    Schedule integration jobs on a pool of worker processes.
+
+    The orbits of a job are split into batches of batch_size orbits, and every batch into segments of segment_time,
+    each integrated by a worker from the final state of the previous one; the batches of all the jobs run concurrently
+    on the pool, and every finished segment publishes its section points and the progress of the job. A job identical to
+    one in flight (same method, initial conditions, time and step size) is not run again: its client subscribes to the
+    running job.
+    """
+    def __init__(self, workers=None, batch_size=64, segment_time=20.0):
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_warm_up)
+        self.batch_size = batch_size
+        self.segment_time = segment_time
+        self.jobs = {}
+
+    def submit(self, spec):
+        """
+        Start a job, or join the identical job in flight.
+
+        Returns:
+            tuple: (job, deduplicated).
+        """
+        spec = job_spec(spec)
+        key = cache.cache_key(spec['method'], spec['initial_conditions'], spec['time'], spec['dt'])[:16]
+        if key in self.jobs:
+            return self.jobs[key], True
+        job = self.jobs[key] = Job(key, spec)
+        asyncio.get_running_loop().create_task(self._run(job))
+        return job, False
+
+    async def _run(self, job):
+        spec = job.spec
+        y0 = spec['initial_conditions']
+        num_steps = int(round(spec['time'] / spec['dt']))
+        segment_steps = max(1, int(round(self.segment_time / spec['dt'])))
+        initial_energy = hamiltonian(y0)
+        progress = {'steps': 0, 'drift': np.zeros(len(y0)), 'crossings': 0}
+        loop = asyncio.get_running_loop()
+
+        async def run_batch(start):
+            lanes = slice(start, start + self.batch_size)
+            y, y_prev = y0[lanes], None
+            for first in range(0, num_steps, segment_steps):
+                steps = min(segment_steps, num_steps - first)
+                result = await loop.run_in_executor(self.pool, _integrate_segment, spec['method'], y, y_prev,
+                                                    first * spec['dt'], spec['dt'], steps + 1, initial_energy[lanes])
+                y, y_prev = result['state'], result['previous']
+                progress['steps'] += steps * len(y)
+                progress['drift'][lanes] = np.maximum(progress['drift'][lanes], result['energy_drift'])
+                progress['crossings'] += len(result['t'])
+                if len(result['t']):
+                    await job.publish({'event': 'section', 't': result['t'].tolist(), 'points': result['points'][:, [1, 3]].tolist(),
+                                       'orbit': (result['orbit'] + start).tolist()})
+                await job.publish({'event': 'progress', 'fraction': progress['steps'] / (num_steps * len(y0))})
+
+        batches = []
+        try:
+            await job.publish({'event': 'accepted', 'orbits': len(y0)})
+            batches = [asyncio.create_task(run_batch(start)) for start in range(0, len(y0), self.batch_size)]
+            await asyncio.gather(*batches)
+            await job.publish({'event': 'done', 'section_points': progress['crossings'],
+                               'energy_drift': float(np.max(progress['drift']))}, final=True)
+        except Exception as error:
+            # Stop the other batches before the final event, so that nothing is published after it
+            for batch in batches:
+                batch.cancel()
+            await asyncio.gather(*batches, return_exceptions=True)
+            await job.publish({'event': 'error', 'message': str(error)}, final=True)
+        finally:
+            del self.jobs[job.key]
+
+    async def handle(self, reader, writer):
+        """
+        Serve a connection: every line is a job specification, whose events are written back as they are published.
+        """
+        async def stream(job, deduplicated):
+            async for event in job.subscribe():
+                if event['event'] == 'accepted':
+                    event = dict(event, deduplicated=deduplicated)
+                writer.write((json.dumps(event) + '\n').encode())
+                await writer.drain()
+
+        tasks = []
+        try:
+            while line := await reader.readline():
+                if not line.strip():
+                    continue
+                try:
+                    job, deduplicated = self.submit(json.loads(line))
+                except (ValueError, KeyError, TypeError) as error:
+                    writer.write((json.dumps({'event': 'error', 'message': str(error)}) + '\n').encode())
+                    await writer.drain()
+                    continue
+                tasks.append(asyncio.create_task(stream(job, deduplicated)))
+            await asyncio.gather(*tasks)
+        except ConnectionError:
+            # Disconnected: the jobs keep running for their other subscribers
+            for task in tasks:
+                task.cancel()
+        except asyncio.CancelledError:
+            # Shutting down: the cancellation is propagated once the connection is cleaned up
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path=None, host=None, port=8765):
+        """
+        Listen for connections until cancelled, on a Unix socket or on TCP when host is given.
+        """
+        if host is not None:
+            server = await asyncio.start_server(self.handle, host, port)
+        else:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = await asyncio.start_unix_server(self.handle, socket_path)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+async def request(spec, socket_path=None, host=None, port=8765):
+    """
+    Submit a job to a running service and yield its events as they arrive.
+
+    Parameters:
+        spec (dict): Job specification (see the module documentation).
+        socket_path (str): Unix socket of the service.
+        host, port: TCP address of the service, instead of a Unix socket.
+
+    Yields:
+        dict: The events of the job, until 'done' or 'error'.
+    """
+    if host is not None:
+        reader, writer = await asyncio.open_connection(host, port)
+    else:
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+    try:
+        writer.write((json.dumps(spec) + '\n').encode())
+        await writer.drain()
+        while line := await reader.readline():
+            event = json.loads(line)
+            yield event
+            if event['event'] in ('done', 'error'):
+                return
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+def run_job(spec, socket_path=None, host=None, port=8765, on_event=None):
+    """
+    Submit a job to a running service and wait for its result (blocking version of request).
+
+    Parameters:
+        spec (dict): Job specification (see the module documentation).
+        socket_path, host, port: Address of the service (see request).
+        on_event (function): Called with every event as it arrives, e.g. to report the progress.
+
+    Returns:
+        dict: 't', 'points' ((y, py) of shape (M, 2)) and 'orbit' of the section crossings sorted by orbit and time, and
+              the final 'done' event as 'summary'.
+
+    Raises:
+        RuntimeError: When the service reports an error.
+    """
+    async def collect():
+        sections = []
+        async for event in request(spec, socket_path, host, port):
+            if on_event is not None:
+                on_event(event)
+            if event['event'] == 'error':
+                raise RuntimeError(event['message'])
+            if event['event'] == 'section':
+                sections.append(event)
+            if event['event'] == 'done':
+                return sections, event
+
+    sections, summary = asyncio.run(collect())
+    t = np.concatenate([[]] + [event['t'] for event in sections])
+    points = np.concatenate([np.empty((0, 2))] + [np.reshape(event['points'], (-1, 2)) for event in sections])
+    orbit = np.concatenate([np.empty(0, dtype=int)] + [np.asarray(event['orbit'], dtype=int) for event in sections])
+    order = np.lexsort((t, orbit))
+    return {'t': t[order], 'points': points[order], 'orbit': orbit[order], 'summary': summary}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="henon_heiles.py serve", description="Local job service for Henon-Heiles integrations")
+    address = parser.add_mutually_exclusive_group()
+    address.add_argument("--socket", default="henon_heiles.sock", help="Listen on a Unix socket")
+    address.add_argument("--host", help="Listen on TCP at this address instead of a Unix socket")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--batch-size", type=int, default=64, help="Number of orbits integrated together by a worker")
+    parser.add_argument("--segment-time", type=float, default=20.0, help="Simulation time between two progress events")
+
+    args = parser.parse_args(argv)
+
+    service = JobService(workers=args.workers, batch_size=args.batch_size, segment_time=args.segment_time)
+    where = f"{args.host}:{args.port}" if args.host else args.socket
+    print(f"Serving integration jobs on {where} with {args.workers or os.cpu_count()} workers", flush=True)
+    try:
+        asyncio.run(service.serve(socket_path=args.socket, host=args.host, port=args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+if __name__ == "__main__":
+    main()
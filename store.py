@@ -0,0 +1,173 @@
+import json
+import os
+
+import numpy as np
+
+from adaptive import dormand_prince
+from integration_methods import METHODS, henon_heiles_stream
+from sections import find_crossings
+from var import equations_motion
+
+# Files of a trajectory store directory
+TRAJECTORY_FILE = 'trajectory.npy'
+SECTION_FILE = 'section.bin'
+CHECKPOINT_FILE = 'checkpoint.json'
+
+# Columns of the section file: t, x, y, px, py, orbit
+SECTION_COLUMNS = 6
+
+def load_checkpoint(path):
+    """
+    Read the checkpoint of a trajectory store.
+
+    Parameters:
+        path (str): Directory of the store.
+
+    Returns:
+        dict: The checkpoint (method, dt, t0, num_steps, stride, step, state, prev_state, section_rows, done), or None
+              if the store has no checkpoint yet.
+    """
+    try:
+        with open(os.path.join(path, CHECKPOINT_FILE)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+def _write_checkpoint(path, checkpoint):
+    """
+    Atomically replace the checkpoint of a trajectory store, so that an interruption never leaves a partial file.
+    """
+    temporary = os.path.join(path, CHECKPOINT_FILE + '.tmp')
+    with open(temporary, 'w') as file:
+        json.dump(checkpoint, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, os.path.join(path, CHECKPOINT_FILE))
+
+def integrate_to_store(path, method, y0, t0, dt, num_steps, stride=1, chunk_size=10000, checkpoint_every=1, f=equations_motion):
+    """
+    Integrate the system into an on-disk trajectory store, resuming from its checkpoint if it has one.
+
+    The store is a directory holding a memory-mapped trajectory.npy, preallocated for all the kept samples and written
+    incrementally chunk by chunk, a section.bin file to which the x = 0 crossings are appended (rows of t, x, y, px, py,
+    orbit) and a checkpoint.json with the integrator state (state, previous state, step index, method, dt). When the
+    directory already has a checkpoint for the same run, the integration resumes exactly where it stopped.
+
+    Parameters:
+        path (str): Directory of the store (created if needed).
+        method (str): Name of the integration method (a key of integration_methods.METHODS, except 'dopri').
+        y0 (array): Initial conditions for the state vector (x, y, px and py), or an (N, 4) array of initial conditions.
+        t0 (float): Initial time.
+        dt (float): Step size.
+        num_steps (int): Number of time samples, including the initial condition.
+        stride (int): Keep every stride-th step only in the stored trajectory (sections use every step).
+        chunk_size (int): Number of steps integrated between two writes.
+        checkpoint_every (int): Number of chunks between two checkpoints.
+        f (function): The function that defines the ODE dy/dt = f(t, y); it is not saved and must be the same on resume.
+
+    Returns:
+        dict: The final checkpoint.
+    """
+    if method not in METHODS or METHODS[method] == dormand_prince:
+        raise ValueError(f"Unsupported integration method {method!r} for a trajectory store")
+    integration_method = METHODS[method]
+    y0 = np.asarray(y0, dtype=float)
+    num_samples = (num_steps - 1) // stride + 1
+    os.makedirs(path, exist_ok=True)
+
+    run = {'method': method, 'dt': dt, 't0': t0, 'num_steps': num_steps, 'stride': stride, 'shape': list(y0.shape)}
+    checkpoint = load_checkpoint(path)
+    if checkpoint is not None:
+        if {key: checkpoint[key] for key in run} != run:
+            raise ValueError(f"The store in {path} belongs to a different run: {checkpoint}")
+        if checkpoint['done']:
+            return checkpoint
+        trajectory = np.load(os.path.join(path, TRAJECTORY_FILE), mmap_mode='r+')
+        # Drop the section rows written after the last checkpoint
+        with open(os.path.join(path, SECTION_FILE), 'r+b') as file:
+            file.truncate(checkpoint['section_rows'] * SECTION_COLUMNS * 8)
+        step = checkpoint['step']
+        state = np.array(checkpoint['state'])
+        prev_state = None if checkpoint['prev_state'] is None else np.array(checkpoint['prev_state'])
+    else:
+        trajectory = np.lib.format.open_memmap(os.path.join(path, TRAJECTORY_FILE), mode='w+', shape=(num_samples,) + y0.shape)
+        open(os.path.join(path, SECTION_FILE), 'wb').close()
+        checkpoint = dict(run, step=0, state=y0.tolist(), prev_state=None, section_rows=0, done=False)
+        step, state, prev_state = 0, y0, None
+
+    stream = henon_heiles_stream(integration_method, f, state, t0 + step*dt, dt, num_steps - step,
+                                 chunk_size=chunk_size, y_prev=prev_state)
+    last = None
+    with open(os.path.join(path, SECTION_FILE), 'ab') as section_file:
+        for n, (t_chunk, y_chunk) in enumerate(stream, start=1):
+            # The first sample of the stream is the (already stored) state at the resume step
+            steps = step + np.arange(len(t_chunk)) if last is None else step + 1 + np.arange(len(t_chunk))
+            kept = steps % stride == 0
+            trajectory[steps[kept] // stride] = y_chunk[kept]
+
+            # Crossings between the previous chunk and this one are found by prepending its last sample
+            if last is None:
+                t_cross, points, orbit = find_crossings(t_chunk, y_chunk, f=f)
+            else:
+                t_cross, points, orbit = find_crossings(np.concatenate([[last[0]], t_chunk]), np.concatenate([last[1][np.newaxis], y_chunk]), f=f)
+            np.column_stack([t_cross, points, orbit]).astype(float).tofile(section_file)
+            checkpoint['section_rows'] += len(t_cross)
+
+            if len(y_chunk) > 1:
+                prev_state = y_chunk[-2]
+            elif last is not None:
+                prev_state = last[1]
+            last = (t_chunk[-1], y_chunk[-1])
+            state = y_chunk[-1]
+            step = int(steps[-1])
+
+            if step == num_steps - 1 or n % checkpoint_every == 0:
+                trajectory.flush()
+                section_file.flush()
+                os.fsync(section_file.fileno())
+                checkpoint.update(step=step, state=state.tolist(), prev_state=None if prev_state is None else prev_state.tolist(),
+                                  done=step == num_steps - 1)
+                _write_checkpoint(path, checkpoint)
+
+    return checkpoint
+
+def load_trajectory(path, t_start=None, t_end=None):
+    """
+    Read a time window of the trajectory of a store without copying it.
+
+    Parameters:
+        path (str): Directory of the store.
+        t_start, t_end (float): Time window (the whole run by default).
+
+    Returns:
+        tuple: (t, y) with the times of the kept samples in the window and a read-only memory-mapped view of the states.
+    """
+    checkpoint = load_checkpoint(path)
+    if checkpoint is None:
+        raise FileNotFoundError(f"No trajectory store in {path}")
+    trajectory = np.load(os.path.join(path, TRAJECTORY_FILE), mmap_mode='r')
+    sample_dt = checkpoint['dt'] * checkpoint['stride']
+    # Only the samples up to the last checkpoint are guaranteed to be written
+    num_written = checkpoint['step'] // checkpoint['stride'] + 1
+
+    start = 0 if t_start is None else max(0, int(np.ceil((t_start - checkpoint['t0']) / sample_dt - 1e-9)))
+    stop = num_written if t_end is None else min(num_written, int(np.floor((t_end - checkpoint['t0']) / sample_dt + 1e-9)) + 1)
+    t = checkpoint['t0'] + sample_dt * np.arange(start, max(start, stop))
+    return t, trajectory[start:max(start, stop)]
+
+def load_section(path):
+    """
+    Read the section crossings of a store without copying them.
+
+    Parameters:
+        path (str): Directory of the store.
+
+    Returns:
+        tuple: (t_cross, points, orbit) with the crossing times, memory-mapped states on the plane of shape (M, 4) and
+               the index of the orbit each crossing belongs to.
+    """
+    checkpoint = load_checkpoint(path)
+    if checkpoint is None or checkpoint['section_rows'] == 0:
+        return np.empty(0), np.empty((0, 4)), np.empty(0, dtype=int)
+    rows = np.memmap(os.path.join(path, SECTION_FILE), dtype=float, mode='r', shape=(checkpoint['section_rows'], SECTION_COLUMNS))
+    return rows[:, 0], rows[:, 1:5], rows[:, 5].astype(int)
@@ -0,0 +1,185 @@
+"""
+Parallel sweep of Poincaré sections over energy levels and initial-condition grids.
+
+Usage:
+  henon_heiles.py sweep --energies E [E ...] [--grid NY NPY] [--sampling SAMPLING] [--method METHOD] [--dt DT] [--time T]
+                        [--workers W] [--chunk-size C] [--output FILE] [--plot]
+
+Options:
+  --energies E [E ...]  Energy levels, as decimals or fractions (e.g. 1/12 1/8 1/6).
+  --grid NY NPY         Size of the (y, py) grid on the x = 0 section [default: 20 20].
+  --sampling SAMPLING   Sampling of the section: grid, halton, sobol (requires scipy) or boundary (quasi-random,
+                        refined near the energy curve); the quasi-random samplings use NY * NPY points [default: grid].
+  --method METHOD       Integration method: rk2, rk4, leapfrog, euler, verlet, yoshida4, yoshida6, yoshida8 or dopri [default: yoshida4].
+  --dt DT               Step size [default: 0.01].
+  --time T              Simulation time of every orbit [default: 200].
+  --workers W           Number of worker processes [default: all the cores].
+  --chunk-size C        Number of orbits integrated together by a worker [default: 64].
+  --output FILE         Save the sections to a .npz file.
+  --plot                Plot the section of every energy.
+
+Examples:
+  python henon_heiles.py sweep --energies 1/12 1/8 1/6 --grid 30 30 --output sections.npz
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from adaptive import dormand_prince, dormand_prince_section
+from initial_conditions import SAMPLINGS, section_grid, section_samples
+from integration_methods import METHODS
+from sections import henon_heiles_section
+from var import equations_motion
+
+def _integrate_chunk(points_name, counts_name, shape, start, initial_conditions, method, dt, t_end):
+    """
+    Integrate a chunk of orbits and write their section points (y, py) into the shared-memory result arrays.
+
+    Runs in a worker process: the results are written in place at rows start:start+len(initial_conditions) instead of
+    being pickled back to the parent process.
+    """
+    points_memory = shared_memory.SharedMemory(name=points_name)
+    counts_memory = shared_memory.SharedMemory(name=counts_name)
+    try:
+        points = np.ndarray(shape, dtype=float, buffer=points_memory.buf)
+        counts = np.ndarray(shape[0], dtype=np.int64, buffer=counts_memory.buf)
+
+        integration_method = METHODS[method]
+        if integration_method == dormand_prince:
+            _, crossings, orbit = dormand_prince_section(equations_motion, initial_conditions, 0.0, t_end, dt)
+        else:
+            num_steps = int(round(t_end / dt)) + 1
+            _, crossings, orbit = henon_heiles_section(integration_method, equations_motion, initial_conditions, 0.0, dt, num_steps)
+
+        max_crossings = shape[1]
+        for i in range(len(initial_conditions)):
+            section = crossings[orbit == i][:max_crossings]
+            points[start + i, :len(section)] = section[:, [1, 3]]
+            counts[start + i] = len(section)
+    finally:
+        points_memory.close()
+        counts_memory.close()
+
+def sweep(energies, n_y, n_py, method='yoshida4', dt=0.01, t_end=200, workers=None, chunk_size=64, max_crossings=None, sampling='grid'):
+    """
+    Compute the Poincaré sections of full (y, py) grids at several energies on a process pool.
+
+    For every energy the x = 0 section is filled with initial conditions on the energy shell, on a regular grid by
+    default (see initial_conditions.section_samples). The orbits of all the energies are split into chunks that the
+    workers integrate as ensembles; the section points are collected into shared memory, with room for max_crossings
+    points per orbit.
+
+    Parameters:
+        energies (list): Energy levels.
+        n_y, n_py (int): Size of the (y, py) grid (for the other samplings, n_y * n_py points are sampled).
+        method (str): Name of the integration method (a key of integration_methods.METHODS).
+        dt (float): Step size (initial step size for dopri).
+        t_end (float): Simulation time of every orbit.
+        workers (int): Number of worker processes (all the cores by default).
+        chunk_size (int): Number of orbits integrated together by a worker.
+        max_crossings (int): Maximum number of section points kept per orbit (by default enough for t_end).
+        sampling (str): Sampling of the section: 'grid', 'halton', 'sobol' or 'boundary'.
+
+    Returns:
+        dict: For every energy, a tuple (points, orbit) with the section points (y, py) of shape (M, 2) and the index of
+              the initial condition of the grid (or sample) each point comes from.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown integration method {method!r}: expected one of {', '.join(METHODS)}")
+    if max_crossings is None:
+        # The orbits cross the section about once per period 2*pi of the harmonic part of the potential
+        max_crossings = int(t_end / (2 * np.pi) * 1.5) + 10
+
+    if sampling == 'grid':
+        grids = [section_grid(energy, n_y, n_py) for energy in energies]
+    else:
+        grids = [section_samples(energy, n_y * n_py, sampling) for energy in energies]
+    offsets = np.cumsum([0] + [len(grid) for grid in grids])
+    shape = (offsets[-1], max_crossings, 2)
+
+    points_memory = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * 8))
+    counts_memory = shared_memory.SharedMemory(create=True, size=max(1, shape[0] * 8))
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(_integrate_chunk, points_memory.name, counts_memory.name, shape, offsets[k] + start,
+                            grid[start:start + chunk_size], method, dt, t_end)
+                for k, grid in enumerate(grids)
+                for start in range(0, len(grid), chunk_size)
+            ]
+            for future in futures:
+                future.result()
+
+        points = np.ndarray(shape, dtype=float, buffer=points_memory.buf)
+        counts = np.ndarray(shape[0], dtype=np.int64, buffer=counts_memory.buf)
+        results = {}
+        for k, energy in enumerate(energies):
+            rows = range(offsets[k], offsets[k+1])
+            results[energy] = (
+                np.concatenate([points[i, :counts[i]] for i in rows]) if len(rows) else np.empty((0, 2)),
+                np.repeat(np.arange(len(rows)), counts[offsets[k]:offsets[k+1]]),
+            )
+        del points, counts
+    finally:
+        points_memory.close()
+        points_memory.unlink()
+        counts_memory.close()
+        counts_memory.unlink()
+
+    return results
+
+def _energy(value):
+    """
+    Parse an energy given as a decimal or a fraction such as 1/12.
+    """
+    return float(Fraction(value))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="henon_heiles.py sweep", description="Parallel sweep of Poincaré sections over energy levels")
+    parser.add_argument("--energies", type=_energy, nargs="+", required=True, help="Energy levels, as decimals or fractions (e.g. 1/12 1/8 1/6)")
+    parser.add_argument("--grid", type=int, nargs=2, default=[20, 20], metavar=("NY", "NPY"), help="Size of the (y, py) grid on the x = 0 section")
+    parser.add_argument("--sampling", choices=SAMPLINGS, default="grid", help="Sampling of the section")
+    parser.add_argument("--method", choices=list(METHODS), default="yoshida4", help="Integration method")
+    parser.add_argument("--dt", type=float, default=0.01, help="Step size")
+    parser.add_argument("--time", type=float, default=200, help="Simulation time of every orbit")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--chunk-size", type=int, default=64, help="Number of orbits integrated together by a worker")
+    parser.add_argument("--output", help="Save the sections to a .npz file")
+    parser.add_argument("--plot", action="store_true", help="Plot the section of every energy")
+
+    args = parser.parse_args(argv)
+
+    workers = args.workers or os.cpu_count()
+    print(f"Sweep of {len(args.energies)} energies on a {args.grid[0]}x{args.grid[1]} grid with {workers} workers")
+    results = sweep(args.energies, *args.grid, method=args.method, dt=args.dt, t_end=args.time,
+                    workers=workers, chunk_size=args.chunk_size, sampling=args.sampling)
+
+    for energy, (points, orbit) in results.items():
+        print(f"E = {energy:.6g}: {len(np.unique(orbit))} orbits, {len(points)} section points")
+
+    if args.output:
+        arrays = {'energies': np.array(args.energies)}
+        for k, (points, orbit) in enumerate(results.values()):
+            arrays[f'section_{k}'] = points
+            arrays[f'orbit_{k}'] = orbit
+        np.savez(args.output, **arrays)
+
+    if args.plot:
+        import matplotlib.pyplot as plt
+
+        fig, axs = plt.subplots(1, len(results), figsize=(6 * len(results), 6), squeeze=False)
+        for ax, (energy, (points, orbit)) in zip(axs[0], results.items()):
+            ax.scatter(points[:, 0], points[:, 1], s=0.5, c=orbit, cmap='viridis')
+            ax.set_xlabel('y', fontsize=12)
+            ax.set_ylabel('py', fontsize=12)
+            ax.set_title(f'E = {energy:.4g}', fontsize=16)
+        plt.tight_layout()
+        plt.show()
+
+if __name__ == "__main__":
+    main()
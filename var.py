@@ -4,17 +4,20 @@ def equations_motion(t, y):
     """
     Compute the derivatives of the Henon-Heiles system.
 
+    The state may be a single vector of shape (4,) or a batch of vectors of shape (N, 4),
+    in which case the derivatives of all the N orbits are computed at once.
+    This is the hand-written fast path of potential.HENON_HEILES; other polynomial potentials and per-orbit
+    coefficients are handled by potential.PolynomialPotential.equations_motion.
+
     Parameters:
         t (float): Current time.
-        y (numpy.ndarray): Array containing the system variables [X, Y, px, py].
+        y (numpy.ndarray): Array containing the system variables [X, Y, px, py] along its last axis.
 
     Returns:
-        numpy.ndarray: Array containing the derivatives [dX/dt, dY/dt, dpx/dt, dpy/dt].
+        numpy.ndarray: Array containing the derivatives [dX/dt, dY/dt, dpx/dt, dpy/dt], with the same shape as y.
     """
-    X = y[0]
-    Y = y[1]
-    px = y[2]
-    py = y[3]
+    # Unpacking the transpose gives the components of a single state or the columns of a batch
+    X, Y, px, py = np.asarray(y).T
 
     # Define the differential equations
     dX_dt = px
@@ -22,4 +25,83 @@ def equations_motion(t, y):
     dpx_dt = -X * (1 + 2 * Y)
     dpy_dt = Y * (Y - 1) - X**2
 
-    return np.array([dX_dt, dY_dt, dpx_dt, dpy_dt])
\ No newline at end of file
+    return np.array([dX_dt, dY_dt, dpx_dt, dpy_dt]).T
+
+def equations_motion_into(y, out):
+    """
+    Compute the derivatives of the Henon-Heiles system in place, without allocating temporary arrays.
+
+    This is the specialized counterpart of equations_motion used by the fused stepping kernels:
+    the derivatives are written into a preallocated buffer instead of being returned as a new array.
+
+    Parameters:
+        y (numpy.ndarray): Array containing the system variables [X, Y, px, py] along its last axis.
+        out (numpy.ndarray): Preallocated array with the same shape as y, overwritten with [dX/dt, dY/dt, dpx/dt, dpy/dt].
+
+    Returns:
+        numpy.ndarray: The out array.
+    """
+    X = y[..., 0]
+    Y = y[..., 1]
+    dpx_dt = out[..., 2]
+    dpy_dt = out[..., 3]
+
+    # dpy/dt = Y*(Y-1) - X**2, using the dpx/dt slot to hold X**2
+    np.multiply(X, X, out=dpx_dt)
+    np.subtract(Y, 1, out=dpy_dt)
+    np.multiply(dpy_dt, Y, out=dpy_dt)
+    np.subtract(dpy_dt, dpx_dt, out=dpy_dt)
+
+    # dpx/dt = -X*(1 + 2*Y)
+    np.multiply(Y, -2, out=dpx_dt)
+    np.subtract(dpx_dt, 1, out=dpx_dt)
+    np.multiply(dpx_dt, X, out=dpx_dt)
+
+    out[..., 0] = y[..., 2]
+    out[..., 1] = y[..., 3]
+
+    return out
+
+def hamiltonian(y):
+    """
+    Compute the total energy of the Henon-Heiles system.
+
+    Parameters:
+        y (numpy.ndarray): Array containing the system variables [X, Y, px, py] along its last axis.
+
+    Returns:
+        numpy.ndarray: Energy of each state, with the shape of y without its last axis.
+    """
+    y = np.asarray(y)
+    X = y[..., 0]
+    Y = y[..., 1]
+    px = y[..., 2]
+    py = y[..., 3]
+
+    return (px**2) / 2 + (py**2) / 2 + (X**2) / 2 + (Y**2) / 2 + X**2 * Y - (1/3) * Y**3
+
+def variational_equations(t, y, w):
+    """
+    Compute the time derivatives of deviation vectors of the Henon-Heiles system (tangent map).
+
+    The deviation vectors w evolve with the Jacobian of equations_motion along the orbit: dw/dt = J(y) w.
+
+    Parameters:
+        t (float): Current time.
+        y (numpy.ndarray): Array containing the system variables [X, Y, px, py] along its last axis, of shape (..., 4).
+        w (numpy.ndarray): Deviation vectors [dX, dY, dpx, dpy] along the last axis, of shape (..., k, 4).
+
+    Returns:
+        numpy.ndarray: Array containing the derivatives of the deviation vectors, with the same shape as w.
+    """
+    X = y[..., 0, np.newaxis]
+    Y = y[..., 1, np.newaxis]
+    dX = w[..., 0]
+    dY = w[..., 1]
+
+    ddX_dt = w[..., 2]
+    ddY_dt = w[..., 3]
+    ddpx_dt = -(1 + 2 * Y) * dX - 2 * X * dY
+    ddpy_dt = -2 * X * dX + (2 * Y - 1) * dY
+
+    return np.stack([ddX_dt, ddY_dt, ddpx_dt, ddpy_dt], axis=-1)